@@ -1,6 +1,9 @@
 # ai.py
-import os, json
+import os, json, asyncio
 import httpx
+from router import Router, load_providers
+from structured import parse_json, validate_output, parse_stats, StructuredOutputError
+from metrics import stage, record_tokens
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -8,6 +11,18 @@ API_URL = os.getenv("LLM_API_URL")
 API_KEY = os.getenv("LLM_API_KEY")
 MODEL  = os.getenv("LLM_MODEL", "gpt-4o-mini")
 
+# Shared client tuning: one pooled keep-alive client per process, and a cap on
+# how many LLM calls a single worker keeps in flight at once.
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "64"))
+HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+# full: always ask for every field; minimal: ask only for the requested channels;
+# parallel: minimal, with each channel as its own smaller concurrent call
+CHANNEL_MODE = os.getenv("LLM_CHANNEL_MODE", "minimal")
+# Follow-up calls asking only for fields that came back invalid or missing
+REASKS = int(os.getenv("LLM_REASKS", "1"))
+
 PROMPT = """You are an expert DTC marketer.
 From ONLY the product_name below, infer plausible attributes and produce STRICT JSON.
 
@@ -28,12 +43,81 @@ Return valid JSON ONLY, no markdown, no prose.
 product_name: "{name}"
 """
 
-async def call_llm(name: str, include=None, voice="default") -> dict:
-    if not (API_URL and API_KEY):
-        raise RuntimeError("LLM not configured")
+# channel -> (GenerateOut key, instruction, output-token budget)
+CHANNEL_FIELDS = {
+    "seo": ("SEO_title", "SEO_title (<=70 chars)", 40),
+    "description": ("description", "description (<=300 chars)", 100),
+    "bullets": ("benefit_bullets", "benefit_bullets (exactly 3 items)", 90),
+    "tiktok": ("tiktok_caption", "tiktok_caption (<=150 chars)", 60),
+    "instagram": ("instagram_ad_caption", "instagram_ad_caption (<=2200 chars)", 700),
+    "subjects": ("email_subjects", "email_subjects (exactly 3 items)", 50),
+}
+KEYWORDS_FIELD = ("keywords_used", "keywords_used (<=10 items)", 50)  # always requested once
+TOKEN_OVERHEAD = 40  # braces, quotes, key names
+FIELD_SPECS = {key: (instruction, budget) for key, instruction, budget in [*CHANNEL_FIELDS.values(), KEYWORDS_FIELD]}
+
+CHANNEL_PROMPT = """You are an expert DTC marketer.
+From ONLY the product_name below, infer plausible attributes and produce STRICT JSON.
 
+Return exactly these keys and no others:
+{fields}
+
+Adopt the requested brand voice: {voice}.
+
+Return valid JSON ONLY, no markdown, no prose.
+
+product_name: "{name}"
+"""
+
+REASK_PROMPT = """Your previous JSON for the product below had problems with these keys:
+{problems}
+
+Return JSON with ONLY these keys, corrected:
+{fields}
+
+Adopt the requested brand voice: {voice}.
+
+Return valid JSON ONLY, no markdown, no prose.
+
+product_name: "{name}"
+"""
+
+_client = None
+_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONCURRENCY,
+        max_keepalive_connections=MAX_KEEPALIVE,
+    )
+    try:
+        return httpx.AsyncClient(timeout=TIMEOUT, limits=limits, http2=HTTP2)
+    except ImportError:
+        # http2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1
+        return httpx.AsyncClient(timeout=TIMEOUT, limits=limits)
+
+async def startup():
+    """Create the process-wide client. Called from the app lifespan."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client() -> httpx.AsyncClient:
+    # Scripts and tests may call the LLM without going through the app lifespan
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+def build_payload(name: str, include=None, voice="default") -> dict:
     include = include or []
-    payload = {
+    return {
         "model": MODEL,
         "messages": [
             {"role": "system", "content": "Return only valid JSON matching the schema."},
@@ -46,22 +130,149 @@ async def call_llm(name: str, include=None, voice="default") -> dict:
         "temperature": 0.4
     }
 
-    headers = {"Authorization": f"Bearer {API_KEY}", "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(API_URL, headers=headers, json=payload)
-        r.raise_for_status()
-        data = r.json()
+def requested_channels(include) -> list:
+    """Known channels from `include`, in canonical order; [] means "ask for everything"."""
+    wanted = set(include or [])
+    channels = [ch for ch in CHANNEL_FIELDS if ch in wanted]
+    if CHANNEL_MODE == "full" or len(channels) == len(CHANNEL_FIELDS):
+        return []
+    return channels
+
+def build_channel_payload(name: str, channels: list, voice="default", keywords: bool = True) -> dict:
+    fields = [CHANNEL_FIELDS[ch] for ch in channels] + ([KEYWORDS_FIELD] if keywords else [])
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": "Return only valid JSON matching the schema."},
+            {"role": "user", "content": CHANNEL_PROMPT.format(
+                name=name.replace('"','\\"'),
+                fields="\n".join(f"- {instruction}" for _, instruction, _ in fields),
+                voice=voice
+            )}
+        ],
+        "temperature": 0.4,
+        # Cap output at what the requested fields need
+        "max_tokens": TOKEN_OVERHEAD + sum(budget for _, _, budget in fields),
+    }
+
+def build_request(name: str, include=None, voice="default") -> dict:
+    channels = requested_channels(include)
+    if not channels:
+        return build_payload(name, include, voice)
+    return build_channel_payload(name, channels, voice)
+
+def required_fields(include) -> list:
+    """GenerateOut keys the caller asked for; no known channels means all of them."""
+    wanted = set(include or [])
+    channels = [ch for ch in CHANNEL_FIELDS if ch in wanted] or list(CHANNEL_FIELDS)
+    return [CHANNEL_FIELDS[ch][0] for ch in channels] + [KEYWORDS_FIELD[0]]
+
+def build_reask_payload(name: str, invalid: dict, voice="default") -> dict:
+    keys = [k for k in FIELD_SPECS if k in invalid]
+    return {
+        "model": MODEL,
+        "messages": [
+            {"role": "system", "content": "Return only valid JSON matching the schema."},
+            {"role": "user", "content": REASK_PROMPT.format(
+                name=name.replace('"','\\"'),
+                problems="\n".join(f"- {k}: {invalid[k]}" for k in keys),
+                fields="\n".join(f"- {FIELD_SPECS[k][0]}" for k in keys),
+                voice=voice
+            )}
+        ],
+        "temperature": 0.4,
+        "max_tokens": TOKEN_OVERHEAD + sum(FIELD_SPECS[k][1] for k in keys),
+    }
+
+# Providers in priority order (LLM_PROVIDERS, or the single LLM_API_URL/KEY/MODEL one)
+router = Router(load_providers(API_URL, API_KEY, MODEL, TIMEOUT), client=get_client)
+
+async def call_llm(name: str, include=None, voice="default") -> dict:
+    """Generate copy for the requested channels, validated against GenerateOut.
+
+    Fields for channels that were not requested are simply absent; GenerateOut
+    leaves them empty.
+    """
+    channels = requested_channels(include)
+    if CHANNEL_MODE == "parallel" and len(channels) > 1:
+        # Independent channels as smaller concurrent calls; keywords ride on the first
+        parts = await asyncio.gather(*(
+            _complete(build_channel_payload(name, [ch], voice, keywords=(i == 0)))
+            for i, ch in enumerate(channels)
+        ))
+        merged = {}
+        for part in parts:
+            merged.update(part)
+    else:
+        merged = await _complete(build_request(name, include, voice))
+    return await finalize(name, include, voice, merged)
+
+async def finalize(name: str, include, voice: str, data: dict) -> dict:
+    """Validate parsed output; re-ask only for the fields that failed.
+
+    Raises StructuredOutputError if requested fields are still invalid after
+    LLM_REASKS follow-ups.
+    """
+    required = required_fields(include)
+    with stage("llm.validate"):
+        fields, invalid = validate_output(data, required)
+    for _ in range(REASKS):
+        if not invalid:
+            break
+        parse_stats.reasks += 1
+        patch = await _complete(build_reask_payload(name, invalid, voice))
+        patch = {k: v for k, v in patch.items() if k in invalid}
+        fixed, still_invalid = validate_output(patch, list(invalid))
+        parse_stats.reask_fixed += len(fixed)
+        fields.update(fixed)
+        invalid = still_invalid
+    if invalid:
+        raise StructuredOutputError(f"LLM output invalid for: {', '.join(sorted(invalid))}")
+    return fields
+
+async def _complete(payload: dict) -> dict:
+    with stage("llm"):
+        async with _semaphore:
+            data = await router.complete(payload)
+    record_tokens(data.get("usage"))
 
     text = (
         data.get("choices",[{}])[0]
             .get("message",{})
             .get("content","").strip()
     )
-
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        start = text.find("{"); end = text.rfind("}")
-        if start != -1 and end != -1:
-            return json.loads(text[start:end+1])
-        raise
+        with stage("llm.parse"):
+            return parse_json(text)
+    except StructuredOutputError:
+        # Nothing salvageable; finalize() re-asks for every requested field
+        return {}
+
+async def stream_llm(name: str, include=None, voice="default"):
+    """Yield content deltas from an OpenAI-compatible SSE stream.
+
+    Streams are not retried or hedged (tokens may already be on the wire);
+    they go to the first provider whose breaker lets a request through.
+    """
+    provider = router.first_available()
+    payload = {**build_request(name, include, voice), "stream": True, "model": provider.model}
+    async with _semaphore:
+        async with get_client().stream("POST", provider.url, headers=provider.headers(), json=payload,
+                                       timeout=provider.timeout) as r:
+            if r.status_code >= 500 or r.status_code == 429:
+                provider.record_error(f"http_{r.status_code}")
+            r.raise_for_status()
+            provider.breaker.record_success()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                delta = (
+                    json.loads(data).get("choices",[{}])[0]
+                        .get("delta",{})
+                        .get("content")
+                )
+                if delta:
+                    yield delta
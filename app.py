@@ -1,27 +1,142 @@
-import os
-import stripe
-from fastapi import FastAPI, HTTPException, Depends, Request, Header
+import os, json, time, asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request, Header, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
 
-from schemas import GenerateIn, GenerateOut, UserCreate, UserLogin, UserOut
-from crud import create_user, get_user_by_email, authenticate_user, create_generation, get_generations
+from schemas import GenerateIn, GenerateOut, UserCreate, UserLogin, UserOut, GenerationPage, GenerationDetail, GenerationSearchHit, JobOut
+from crud import create_user, get_user_by_email, authenticate_user, get_recent_generation_outputs, bulk_create_generations, list_generations, get_generation
 from auth import create_access_token, decode_access_token
-from database import SessionLocal, engine, Base, get_db
-from models import User, Generation
-from utils import baseline_generate
+from database import AsyncSessionLocal, engine, get_db, pool_status, pool_stats, migrate, schema_head, schema_revision, DB_POOL_SIZE
+from models import User, Generation, Job
+from ai import call_llm, stream_llm
+import ai
+from cache import generation_cache, cache_key, CACHE_WARM_LIMIT
+from coalesce import llm_flight
+from hashing import hash_pool, HashPoolBusy
+from plans import PLAN_RULES, ALL_CHANNELS, plan_priority, plan_limit
+from reset_monthly import reset_users as reset_monthly_users, RESET_BATCH_SIZE
+from quota import reserve, refund, QuotaExceeded, quota_front
+from principal import Principal, principal_cache, principal_claims, principal_from_claims
+from search import search_generations
+from similar import SIMILAR_THRESHOLD, find_similar, adapt
+from writebehind import WriteBehind, WriteBehindFull
+from webhooks import WebhookWorker, record_event
+from jobs import JobQueue, validate_callback_url
+from streaming import FieldStreamParser, ndjson
+from structured import parse_json, parse_stats, StructuredOutputError
+import metrics
+from metrics import MetricsMiddleware, stage, current_plan, quota_rejections
+from export import aiter_export, FORMATS
+from usage import Meter, ingest_usage, summarize, window_start, truncate
+from batch import read_batch_request, run_batch, batch_line, batch_summary, BATCH_MAX_ITEMS
 from datetime import datetime
-from auth import create_access_token
+from typing import Optional, List, Literal
 
 # --- Setup ---
-Base.metadata.create_all(bind=engine)
 origins = [
     "https://ecomaicopy.netlify.app"
 ]
 
-app = FastAPI(title="Ecom Copy AI", version="0.6.0")
+# Schema changes ship as Alembic migrations run before deploys (`alembic upgrade head`);
+# DB_AUTO_MIGRATE=1 runs them at startup instead, for local development
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0") == "1"
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", str(min(DB_POOL_SIZE, 4))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled LLM client per worker, opened at startup and closed at shutdown.
+    # Nothing here touches the database, so the port opens right away; warm_up()
+    # does the rest in the background and /ready reports when it is done.
+    await ai.startup()
+    await writer.start()
+    warming = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warming.cancel()
+        try:
+            await warming
+        except asyncio.CancelledError:
+            pass
+        # Let streams finish settling, then drain queued writes before the pool goes away
+        await asyncio.gather(*settling, return_exceptions=True)
+        await job_queue.stop()
+        await webhook_worker.stop()
+        await writer.stop()
+        await ai.shutdown()
+        hash_pool.shutdown()
+        await engine.dispose()
+
+# ----- Readiness -----
+readiness = {"ready": False, "database": False, "schema": None, "cache_warm": False, "error": None,
+             "started": time.monotonic(), "ready_after_ms": None}
+
+async def warm_pool(n: int):
+    # Open n pooled connections at once so the first requests find them ready
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+    await asyncio.gather(*(ping() for _ in range(n)))
+
+async def warm_up():
+    """Check the schema, warm the pool, start the workers and fill the cache."""
+    try:
+        if DB_AUTO_MIGRATE:
+            await asyncio.to_thread(migrate)
+        await warm_pool(DB_WARM_CONNECTIONS)
+        readiness["database"] = True
+        async with engine.connect() as conn:
+            current = await conn.run_sync(schema_revision)
+        head = await asyncio.to_thread(schema_head)
+        readiness["schema"] = {"current": current, "head": head}
+        if current != head:
+            raise RuntimeError(f"database schema is at {current}, expected {head}: run `alembic upgrade head`")
+        await webhook_worker.start()
+        await job_queue.start()
+        await warm_cache()
+        readiness["cache_warm"] = True
+        readiness["ready"] = True
+        readiness["ready_after_ms"] = round(1000 * (time.monotonic() - readiness["started"]), 1)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"⚠️ warm-up failed: {e}")
+
+async def warm_cache():
+    async with AsyncSessionLocal() as db:
+        rows = await get_recent_generation_outputs(db, CACHE_WARM_LIMIT)
+    # Oldest first so the most recent generations end up most-recently-used
+    await generation_cache.warm(reversed(rows))
+
+# Generation rows are persisted off the request path in batched inserts
+writer = WriteBehind(AsyncSessionLocal)
+writer.register("generation", bulk_create_generations)
+# ...and so is the usage ledger, which keeps its hourly/daily rollups current as it goes
+writer.register("usage", ingest_usage)
+
+# Stripe events are acknowledged on receipt and applied here, in order per customer
+webhook_worker = WebhookWorker(AsyncSessionLocal)
+
+# ?async=true requests run here; premium jobs are claimed ahead of lower plans
+job_queue = JobQueue(AsyncSessionLocal)
+
+def generation_row(user_id: int, product_name: str, voice: str, include: list, output: dict) -> dict:
+    return {
+        "user_id": user_id,
+        "product_name": product_name,
+        "voice": voice,
+        "include": ",".join(include),
+        "output": output,
+    }
 
+app = FastAPI(title="Ecom Copy AI", version="0.6.0", lifespan=lifespan)
+
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -32,62 +147,74 @@ app.add_middleware(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy(request: Request, exc: HashPoolBusy):
+    # Shed load during signup/login bursts instead of queueing without bound
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(WriteBehindFull)
+async def write_behind_full(request: Request, exc: WriteBehindFull):
+    # Persistence is backed up (usually the database is down): fail fast instead of hanging
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.exception_handler(StructuredOutputError)
+async def structured_output_error(request: Request, exc: StructuredOutputError):
+    # The model answered but not usably, even after re-asking
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
 # Stripe keys
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
-
-# --- Database Dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# --- Plan Rules ---
-PLAN_RULES = {
-    "basic": {
-        "max_generates": 20,
-        "features": {"seo", "description", "subjects", "bullets"},
-    },
-    "pro": {
-        "max_generates": 75,
-        "features": {"seo", "description", "subjects", "bullets", "instagram", "tiktok"},
-    },
-    "premium": {
-        "max_generates": None,  # unlimited
-        "features": {"seo", "description", "subjects", "bullets", "instagram", "tiktok", "emails_full"},
-    },
-}
-
-ALL_CHANNELS = ["seo", "description", "bullets", "tiktok", "instagram", "subjects"]
+_stripe = None
+
+def get_stripe():
+    # The SDK (and the requests stack under it) is the slowest import we have;
+    # load it on the first billing or webhook request instead of at every cold start
+    global _stripe
+    if _stripe is None:
+        import stripe
+        stripe.api_key = STRIPE_SECRET_KEY
+        _stripe = stripe
+    return _stripe
 
 # --- Auth ---
 @app.post("/signup", response_model=UserOut)
-def signup(user: UserCreate, db: Session = Depends(get_db)):
-    if get_user_by_email(db, user.email):
+async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
+    if await get_user_by_email(db, user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    return create_user(db, user.email, user.password)
+    return await create_user(db, user.email, user.password)
 
 @app.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = authenticate_user(db, user.email, user.password)
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await authenticate_user(db, user.email, user.password)
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    token = create_access_token({"sub": str(db_user.id)})
+    token = create_access_token({"sub": str(db_user.id)}, claims=principal_claims(db_user))
     return {"access_token": token, "token_type": "bearer"}
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    payload = decode_access_token(token)
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    with stage("auth.jwt"):
+        payload = decode_access_token(token)
     if not payload or "sub" not in payload:
         raise HTTPException(status_code=401, detail="Invalid token")
-    user = db.query(User).get(int(payload["sub"]))
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return user
+    user_id = int(payload["sub"])
+
+    # Cache first, then (if enabled) fresh plan claims, then the users table
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = principal_from_claims(payload)
+        if principal is None:
+            with stage("auth.db"):
+                user = await db.get(User, user_id)
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            principal = Principal.from_user(user)
+        principal_cache.set(principal)
+    current_plan.set(principal.plan)
+    return principal
 
 @app.get("/me")
-def read_me(current_user: User = Depends(get_current_user)):
+def read_me(current_user: Principal = Depends(get_current_user)):
     # Default voices available to all plans
     voices_basic = ["default"]
     voices_pro = ["default", "luxury", "playful", "minimal", "trendy", "formal", "persuasive"]
@@ -112,78 +239,495 @@ def read_me(current_user: User = Depends(get_current_user)):
         "allowed_voices": allowed_voices,
     }
 
-# --- Generate Copy ---
-@app.post("/generate", response_model=GenerateOut)
-async def generate_copy(
-    body: GenerateIn,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    # --- Free trial logic (no plan yet) ---
-    if current_user.plan == "free":
-        if current_user.monthly_generates >= 3:
+# --- Plan checks ---
+def check_features(user: Principal, include: list):
+    # Free trial users (no plan yet) may try every channel
+    if user.plan == "free":
+        return
+    rules = PLAN_RULES[user.plan]
+    for ch in include:
+        if ch not in rules["features"]:
+            quota_rejections.inc(plan=user.plan, reason="feature")
             raise HTTPException(
                 status_code=403,
-                detail="Free trial limit reached. Please sign up or upgrade to continue."
+                detail=f"{ch} not available on {user.plan} plan"
             )
 
-    # --- Paid plan logic ---
-    else:
-        rules = PLAN_RULES[current_user.plan]
-        if rules["max_generates"] is not None and current_user.monthly_generates >= rules["max_generates"]:
+async def reserve_quota(db: AsyncSession, user: Principal, count: int = 1):
+    """Take quota up front (atomic in the DB); pair with release_quota on failure."""
+    try:
+        with stage("quota"):
+            user.monthly_generates = await reserve(db, user.id, user.plan, count)
+    except QuotaExceeded as e:
+        quota_rejections.inc(plan=e.plan, reason="quota")
+        if e.plan == "free":
             raise HTTPException(
                 status_code=403,
-                detail=f"Monthly limit reached for {current_user.plan} plan. Please upgrade to continue."
+                detail="Free trial limit reached. Please sign up or upgrade to continue."
             )
+        raise HTTPException(
+            status_code=403,
+            detail=f"Monthly limit reached for {e.plan} plan. Please upgrade to continue."
+        )
 
-        # Check feature availability
-        include = body.include or ALL_CHANNELS
-        for ch in include:
-            if ch not in rules["features"]:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"{ch} not available on {current_user.plan} plan"
-                )
-
-    # --- Generate using AI ---
-    result = baseline_generate(body.product_name.strip(), voice=body.voice)
+async def release_quota(db: AsyncSession, user_id: int, count: int = 1):
+    await refund(db, user_id, count)
+    principal_cache.bump(user_id, -count)
+
+async def generate_for(product_name: str, voice: str, include: list):
+    """Cache -> single-flight -> LLM. Returns (GenerateOut, cache_hit)."""
+    key = cache_key(product_name, voice, include)
+    result = await generation_cache.get(key)
+    if result is not None:
+        return GenerateOut(**result), True
+
+    # Identical requests already in flight share one upstream call
+    result = await llm_flight.do(
+        key, lambda: call_llm(product_name.strip(), include=include, voice=voice)
+    )
     out = GenerateOut(**result)
+    await generation_cache.set(key, out.model_dump())
+    return out, False
+
+async def similar_for(db: AsyncSession, user_id: int, product_name: str, voice: str, include: list, threshold: float):
+    """The user's closest prior generation's copy, renamed for this product. Returns (GenerateOut, match) or None."""
+    with stage("similar.lookup"):
+        match = await find_similar(db, user_id, product_name, voice, include, threshold)
+    if match is None:
+        return None
+    try:
+        return GenerateOut(**adapt(match["output"], match["product_name"], product_name)), match
+    except ValidationError:
+        return None  # renamed copy no longer fits the limits; generate fresh
+
+# Streamed responses settle (persist or refund) in tasks that shutdown waits for
+settling = set()
+
+def settle_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    settling.add(task)
+    task.add_done_callback(settling.discard)
+    return task
+
+async def record_usage(row: dict):
+    # A ledger row is never worth failing a request over: write it inline if the queue is backed up
+    try:
+        await writer.put("usage", row)
+    except WriteBehindFull:
+        await writer.write("usage", [row])
+
+async def refund_generation(user_id: int, meter: Meter):
+    """Give back the unit reserved for a generation that will not be saved, and meter the failure."""
+    # Callers may outlive the request-scoped session, so use our own
+    async with AsyncSessionLocal() as db:
+        await release_quota(db, user_id)
+    await record_usage(meter.row(status="error"))
+
+async def save_generation(user_id: int, row: Optional[dict], meter: Meter, cache: str):
+    """Queue a finished generation and its usage row; without one, refund the reserved unit.
+    Raises WriteBehindFull (after refunding) when the queue stays full."""
+    if row is None:
+        await refund_generation(user_id, meter)
+        return
+    try:
+        await writer.put("generation", row)
+    except WriteBehindFull:
+        await refund_generation(user_id, meter)
+        raise
+    await record_usage(meter.row(cache=cache))
+
+async def stream_generation(user_id: int, body: GenerateIn, include: list, meter: Meter):
+    """NDJSON: one {"field", "value"} line per GenerateOut field as soon as it is
+    complete, then a final {"done", "output"} line once validated and saved."""
+    meter.attach()
+    key = cache_key(body.product_name, body.voice, include)
+    result = await generation_cache.get(key)
+    hit = result is not None
+    out, error = None, None
+    try:
+        if hit:
+            for field, value in result.items():
+                yield ndjson({"field": field, "value": value})
+            out = GenerateOut(**result)
+        else:
+            parser = FieldStreamParser()
+            async for delta in stream_llm(body.product_name.strip(), include=include, voice=body.voice):
+                for field, value in parser.feed(delta):
+                    yield ndjson({"field": field, "value": value})
+            # A cut-off stream still gets repaired and its bad fields re-asked
+            data = parser.fields if parser.done else parse_json(parser.buf)
+            out = GenerateOut(**await ai.finalize(body.product_name.strip(), include, body.voice, data))
+            await generation_cache.set(key, out.model_dump())
+    except Exception as e:
+        error = e
+    finally:
+        # Also runs when the client disconnects mid-stream: an unfinished generation is
+        # refunded, in a task the response's cancellation cannot cut short
+        row = generation_row(user_id, body.product_name, body.voice, include, out.model_dump()) if out is not None else None
+        try:
+            await asyncio.shield(settle_in_background(save_generation(user_id, row, meter, "hit" if hit else "miss")))
+        except WriteBehindFull as e:
+            error = e
+
+    if error is not None:
+        yield ndjson({"error": str(error)})
+        return
+    yield ndjson({"done": True, "cached": hit, "output": out.model_dump()})
 
-    # --- Save Generation ---
-    create_generation(db, body.product_name, body.voice, include, out.dict())
+# --- Generate Copy ---
+@app.post("/generate", response_model=GenerateOut)
+async def generate_copy(
+    body: GenerateIn,
+    response: Response,
+    stream: bool = False,
+    async_job: bool = Query(False, alias="async"),
+    callback_url: Optional[str] = None,
+    reuse_similar: bool = False,
+    similarity: float = Query(SIMILAR_THRESHOLD, ge=0.5, le=1.0),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    include = body.include or ALL_CHANNELS
+    meter = Meter(current_user.id, current_user.plan, "generate", body.voice, include)
+    check_features(current_user, include)
+    if reuse_similar and (stream or async_job):
+        raise HTTPException(status_code=422, detail="reuse_similar cannot be combined with stream or async")
+    await check_callback(callback_url)
+    await reserve_quota(db, current_user)
+
+    if async_job:
+        # Metered when a worker runs it
+        params = {"product_name": body.product_name, "voice": body.voice, "include": include}
+        return await enqueue_job(db, current_user, "generate", params, callback_url)
+
+    if stream:
+        return StreamingResponse(
+            stream_generation(current_user.id, body, include, meter),
+            media_type="application/x-ndjson",
+        )
 
-    # --- Increment counter ---
-    current_user.monthly_generates += 1
-    db.commit()
+    # --- Reuse the copy of one of the user's own near-duplicate products (opt-in), else generate using AI ---
+    match = await similar_for(db, current_user.id, body.product_name, body.voice, include, similarity) if reuse_similar else None
+    if match:
+        out, similar = match
+        response.headers["X-Cache"] = "SIMILAR"
+        response.headers["X-Similar-To"] = str(similar["gen_id"])
+        response.headers["X-Similarity"] = str(similar["score"])
+    else:
+        try:
+            out, hit = await generate_for(body.product_name, body.voice, include)
+        except Exception:
+            await refund_generation(current_user.id, meter)
+            raise
+        response.headers["X-Cache"] = "HIT" if hit else "MISS"
+
+    # --- Save Generation and usage (write-behind) ---
+    with stage("persist.enqueue"):
+        row = generation_row(current_user.id, body.product_name, body.voice, include, out.model_dump())
+        await save_generation(current_user.id, row, meter, response.headers["X-Cache"].lower())
 
     return out
 
+# --- Async Jobs ---
+async def check_callback(callback_url: Optional[str]):
+    if callback_url:
+        try:
+            await asyncio.to_thread(validate_callback_url, callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+async def enqueue_job(db: AsyncSession, user: Principal, kind: str, params: dict, callback_url: Optional[str]):
+    """Queue a job whose quota is already reserved; 202 with the id to poll."""
+    try:
+        job_id = await job_queue.submit(db, user.id, kind, {**params, "plan": user.plan},
+                                        priority=plan_priority(user.plan), callback_url=callback_url)
+    except Exception:
+        await release_quota(db, user.id)
+        raise
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "poll": f"/jobs/{job_id}"})
+
+async def run_generate_job(job_id: str, user_id: int, params: dict) -> dict:
+    current_plan.set(params["plan"])
+    include = params["include"]
+    meter = Meter(user_id, params["plan"], "generate", params["voice"], include)
+    try:
+        out, hit = await generate_for(params["product_name"], params["voice"], include)
+    except Exception:
+        await refund_generation(user_id, meter)
+        raise
+    row = generation_row(user_id, params["product_name"], params["voice"], include, out.model_dump())
+    await save_generation(user_id, row, meter, "hit" if hit else "miss")
+    return out.model_dump()
+
+async def run_email_job(job_id: str, user_id: int, params: dict) -> dict:
+    meter = Meter(user_id, params["plan"], "email")
+    out = email_copy(params["product_name"], params["email_type"])
+    await record_usage(meter.row())
+    return out
+
+job_queue.register("generate", run_generate_job)
+job_queue.register("email", run_email_job)
+
+@app.get("/jobs/{job_id}", response_model=JobOut)
+async def get_job(job_id: str, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    job = await db.get(Job, job_id)
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# --- Batch Generate ---
+async def settle_batch(user_id: int, reserved: int, rows: list, meter: Meter, hits: int):
+    # The stream outlives the request-scoped session, so persist on our own
+    async with AsyncSessionLocal() as db:
+        await bulk_create_generations(db, rows)
+        await db.commit()
+        # Hand back quota reserved for items that failed or never ran
+        await release_quota(db, user_id, reserved - len(rows))
+    await record_usage(meter.row(status="ok" if rows else "error", units=len(rows), cache_hits=hits))
+
+@app.post("/generate/batch")
+async def generate_batch(
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Accepts a JSON list of GenerateIn, or a CSV/JSONL upload (multipart field `file`
+    or a raw text/csv / application/x-ndjson body). Streams NDJSON as items finish."""
+    items = await read_batch_request(request)
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch limited to {BATCH_MAX_ITEMS} items")
+
+    # One quota/feature check for the whole batch
+    all_channels = sorted({ch for it in items for ch in (it.include or ALL_CHANNELS)})
+    meter = Meter(current_user.id, current_user.plan, "batch", include=all_channels)
+    check_features(current_user, all_channels)
+    await reserve_quota(db, current_user, count=len(items))
+    user_id = current_user.id
+
+    async def stream():
+        meter.attach()
+        rows, hits = [], 0
+
+        async def generate_counted(product_name: str, voice: str, include: list):
+            nonlocal hits
+            out, hit = await generate_for(product_name, voice, include)
+            hits += hit
+            return out, hit
+
+        try:
+            async for index, item, out, error in run_batch(items, generate_counted, ALL_CHANNELS):
+                if error is None:
+                    rows.append(generation_row(user_id, item.product_name, item.voice,
+                                               item.include or ALL_CHANNELS, out.model_dump()))
+                    yield batch_line(index, item, output=out.model_dump())
+                else:
+                    yield batch_line(index, item, error=error)
+        finally:
+            # Also runs when the client disconnects mid-batch: what was generated is
+            # saved and the rest refunded, in a task the response's cancellation cannot cut short
+            await asyncio.shield(settle_in_background(settle_batch(user_id, len(items), rows, meter, hits)))
+        yield batch_summary(len(rows), len(items) - len(rows))
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --- Generation History ---
+def _summary(row) -> dict:
+    return {
+        "id": row.id,
+        "product_name": row.product_name,
+        "voice": row.voice,
+        "include": row.include.split(",") if row.include else [],
+        "created_at": row.created_at,
+    }
+
+@app.get("/generations", response_model=GenerationPage)
+async def list_my_generations(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    voice: Optional[str] = None,
+    channel: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    if channel and channel not in ALL_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"Unknown channel {channel}")
+    try:
+        rows, next_cursor = await list_generations(
+            db, current_user.id, limit=limit, cursor=cursor, voice=voice, channel=channel,
+            created_from=created_from, created_to=created_to,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": [_summary(r) for r in rows], "next_cursor": next_cursor}
+
+@app.get("/generations/search", response_model=List[GenerationSearchHit])
+async def search_my_generations(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    rows = await search_generations(db, current_user.id, q, limit=limit)
+    return [{**_summary(r), "rank": r.rank} for r in rows]
+
+@app.get("/generations/export")
+async def export_my_generations(
+    format: Literal["csv", "jsonl", "shopify"] = "csv",
+    gzip: bool = False,
+    voice: Optional[str] = None,
+    channel: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_user),
+):
+    """Every generation as CSV, JSONL or a Shopify product CSV, streamed as it is read."""
+    if channel and channel not in ALL_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"Unknown channel {channel}")
+    media_type, ext = FORMATS[format]
+    filename = f"generations-{format}.{ext}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        aiter_export(AsyncSessionLocal, current_user.id, format, gzip, voice=voice, channel=channel,
+                     created_from=created_from, created_to=created_to),
+        media_type="application/gzip" if gzip else media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/generations/{gen_id}", response_model=GenerationDetail)
+async def read_generation(
+    gen_id: int,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    gen = await get_generation(db, current_user.id, gen_id)
+    if not gen:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return {**_summary(gen), "output": gen.output}
+
+# --- Usage (served from the hourly/daily rollups, never the raw ledger) ---
+@app.get("/usage")
+async def my_usage(
+    grain: Literal["hour", "day"] = "day",
+    days: int = Query(30, ge=1, le=366),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    since = window_start(days)
+    month_start = truncate(datetime.utcnow(), "day").replace(day=1)
+    totals = await summarize(db, "day", since, current_user.id)
+    month = await summarize(db, "day", month_start, current_user.id)
+    return {
+        "grain": grain,
+        "since": since,
+        # Reservations stay on the atomic counter; the rollups trail it by a write-behind flush
+        "quota": {"plan": current_user.plan, "used": current_user.monthly_generates,
+                  "limit": plan_limit(current_user.plan), "month_to_date": month[0]},
+        "totals": totals[0],
+        "series": await summarize(db, grain, since, current_user.id, group_by=("bucket", "kind")),
+    }
+
+@app.get("/admin/usage")
+async def admin_usage(
+    x_api_key: str = Header(...),
+    grain: Literal["hour", "day"] = "day",
+    days: int = Query(7, ge=1, le=366),
+    db: AsyncSession = Depends(get_db),
+):
+    """Requests, generations, cache hits, tokens and latency per plan."""
+    secret = os.getenv("ADMIN_SECRET")
+    if not secret or x_api_key != secret:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    since = window_start(days)
+    return {
+        "grain": grain,
+        "since": since,
+        "plans": await summarize(db, "day", since, group_by=("plan",)),
+        "series": await summarize(db, grain, since, group_by=("bucket", "plan")),
+    }
+
+@app.get("/ready")
+def ready():
+    """200 once the schema is current, the pool is warm and the cache is filled; 503 until then."""
+    body = {**{k: v for k, v in readiness.items() if k != "started"},
+            "uptime_ms": round(1000 * (time.monotonic() - readiness["started"]), 1)}
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=body)
+
+# --- Operational endpoints (pool, queue, provider and cache internals) ---
+def require_metrics_token(authorization: Optional[str] = Header(None)):
+    # Closed unless METRICS_TOKEN is set and presented as "Bearer <token>"
+    if not metrics.METRICS_TOKEN or authorization != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+@app.get("/auth/stats", dependencies=[Depends(require_metrics_token)])
+def auth_stats():
+    return hash_pool.stats()
+
+@app.get("/db/stats", dependencies=[Depends(require_metrics_token)])
+def db_stats():
+    return {**pool_status(), "write_behind": writer.stats(), "webhooks": webhook_worker.stats(), "jobs": job_queue.stats()}
+
+@app.get("/llm/stats", dependencies=[Depends(require_metrics_token)])
+def llm_stats():
+    return {**ai.router.stats(), "structured": parse_stats.as_dict()}
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@metrics.registry.collector
+def runtime_gauges():
+    pool = pool_status()
+    gauges = [
+        ("write_behind_queued", "Records waiting for write-behind", {}, writer.stats()["queued"]),
+        ("generation_cache_hit_ratio", "Generation cache hit ratio", {}, generation_cache.stats()["hit_ratio"]),
+        ("db_pool_wait_seconds_total", "Time spent waiting for a pooled connection", {}, round(pool_stats.total_wait, 6)),
+    ]
+    if "checked_out" in pool:
+        gauges.append(("db_pool_checked_out", "Pooled connections in use", {}, pool["checked_out"]))
+    for name, p in ai.router.stats()["providers"].items():
+        gauges.append(("llm_breaker_open", "1 if the provider's circuit breaker is not closed", {"provider": name},
+                       int(p["breaker"] != "closed")))
+    return gauges
+
+@app.get("/cache/stats", dependencies=[Depends(require_metrics_token)])
+def cache_stats():
+    return {**generation_cache.stats(), "single_flight": llm_flight.stats()}
+
 # --- Premium Email Generator ---
 @app.post("/generate_email")
-def generate_email(
+async def generate_email(
     product_name: str,
     email_type: str = "promo",
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    async_job: bool = Query(False, alias="async"),
+    callback_url: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    rules = PLAN_RULES[current_user.plan]
+    meter = Meter(current_user.id, current_user.plan, "email")
     if current_user.plan != "premium":
         raise HTTPException(status_code=403, detail="Upgrade to Premium to access email generator")
+    await check_callback(callback_url)
+    await reserve_quota(db, current_user)
+
+    if async_job:
+        params = {"product_name": product_name, "email_type": email_type}
+        return await enqueue_job(db, current_user, "email", params, callback_url)
+    out = email_copy(product_name, email_type)
+    await record_usage(meter.row())
+    return out
 
-    if rules["max_generates"] is not None and current_user.monthly_generates >= rules["max_generates"]:
-        raise HTTPException(status_code=403, detail="Monthly limit reached. Upgrade your plan.")
-
+def email_copy(product_name: str, email_type: str) -> dict:
     subject = f"[{email_type.title()}] {product_name} just for you!"
     body = f"Hello,\n\nHere’s a {email_type} email for {product_name}.\n\nCheers,\nThe Team"
-
-    current_user.monthly_generates += 1
-    db.commit()
-
     return {"subject": subject, "body": body}
 
 # --- Billing Portal ---
 @app.post("/billing-portal")
-def create_billing_portal(current_user: User = Depends(get_current_user)):
+def create_billing_portal(current_user: Principal = Depends(get_current_user)):
+    stripe = get_stripe()
     try:
         session = stripe.billing_portal.Session.create(
             customer=current_user.stripe_customer_id,
@@ -195,10 +739,11 @@ def create_billing_portal(current_user: User = Depends(get_current_user)):
 
 # --- Stripe Checkout (simplified example) ---
 @app.post("/create-checkout-session")
-def create_checkout_session(plan: str, current_user: User = Depends(get_current_user)):
+def create_checkout_session(plan: str, current_user: Principal = Depends(get_current_user)):
     if plan not in ["basic", "pro", "premium"]:
         raise HTTPException(status_code=400, detail="Invalid plan")
 
+    stripe = get_stripe()
     try:
         session = stripe.checkout.Session.create(
             payment_method_types=["card"],
@@ -208,6 +753,7 @@ def create_checkout_session(plan: str, current_user: User = Depends(get_current_
             }],
             mode="subscription",
             customer_email=current_user.email,
+            client_reference_id=str(current_user.id),  # lets the webhook find the user without the email
             metadata={"plan": plan},
             success_url="https://ecomaicopy.netlify.app?success=true",
             cancel_url="https://ecomaicopy.netlify.app?canceled=true",
@@ -218,60 +764,47 @@ def create_checkout_session(plan: str, current_user: User = Depends(get_current_
 
 # --- Stripe Webhook ---
 @app.post("/webhook")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     payload = await request.body()
     sig_header = request.headers.get("stripe-signature")
 
+    stripe = get_stripe()
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, WEBHOOK_SECRET)
+        stripe.Webhook.construct_event(payload, sig_header, WEBHOOK_SECRET)
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        email = session.get("customer_email")
-        plan = session["metadata"].get("plan", "basic")  # fallback to basic if missing
-
-        user = db.query(User).filter(User.email == email).first()
-        if user:
-            user.plan = plan
-            user.monthly_generates = 0  # ✅ reset counter on successful upgrade
-            db.commit()
-            print(f"✅ Upgraded {email} to {plan} and reset monthly_generates")
-
-    elif event["type"] == "customer.subscription.deleted":
-        subscription = event["data"]["object"]
-        email = subscription.get("customer_email")
-        user = db.query(User).filter(User.email == email).first()
-        if user:
-            user.plan = "basic"
-            user.monthly_generates = 0  # reset when downgraded too
-            db.commit()
-            print(f"❌ Downgraded {email} to basic (subscription cancelled)")
-
+    # Record and acknowledge; the worker applies it. Stripe retries reuse the
+    # event id, so a redelivery is acknowledged without being applied twice.
+    if not await record_event(db, json.loads(payload)):
+        return {"status": "duplicate"}
+    webhook_worker.notify()
     return {"status": "success"}
 
+# --- Monthly Reset ---
+@app.post("/reset")
+async def reset_users(
+    x_api_key: str = Header(...),
+    rolling: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    secret = os.getenv("RESET_SECRET")
+    if not secret or x_api_key != secret:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    # The reset engine is shared with the sync CLI job
+    n = await db.run_sync(
+        lambda session: reset_monthly_users(session, batch_size=RESET_BATCH_SIZE, rolling=rolling)
+    )
+    principal_cache.clear()
+    quota_front.clear()
+    return {"status": "✅ All users reset for the month", "reset": n}
+
 # --- Entry Point for Local & Render ---
 if __name__ == "__main__":
     import uvicorn
 
     port = int(os.environ.get("PORT", 8000))  # Render provides PORT
     uvicorn.run("app:app", host="0.0.0.0", port=port, reload=False)
-
-app.post("/reset")
-def reset_users(
-    x_api_key: str = Header(...),
-    db: Session = Depends(get_db)
-):
-    secret = os.getenv("RESET_SECRET")
-    if x_api_key != secret:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
-    users = db.query(User).all()
-    for user in users:
-        user.monthly_generates = 0
-        user.last_reset = datetime.utcnow()
-    db.commit()
-    return {"status": "✅ All users reset for the month"}
\ No newline at end of file
@@ -0,0 +1,120 @@
+# batch.py
+import os, io, csv, json, re, asyncio
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+
+from schemas import GenerateIn
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+
+# ----- Input parsing -----
+def _item(row: dict, line: int) -> GenerateIn:
+    try:
+        return GenerateIn(**row)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Item {line}: {e.errors()[0]['msg']}")
+
+def parse_csv(text: str):
+    """Columns: product_name, voice (optional), include (optional, separated by , ; or |)."""
+    items = []
+    for line, row in enumerate(csv.DictReader(io.StringIO(text)), start=1):
+        row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        parsed = {"product_name": row.get("product_name", "")}
+        if row.get("voice"):
+            parsed["voice"] = row["voice"]
+        if row.get("include"):
+            parsed["include"] = [ch.strip() for ch in re.split(r"[,;|]", row["include"]) if ch.strip()]
+        items.append(_item(parsed, line))
+    return items
+
+def parse_jsonl(text: str):
+    items = []
+    for line, raw in enumerate(text.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=422, detail=f"Item {line}: invalid JSON")
+        items.append(_item(row, line))
+    return items
+
+def parse_json(data):
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=422, detail="Expected a list of items")
+    return [_item(row, i) for i, row in enumerate(data, start=1)]
+
+def _is_csv(name: str, content_type: str) -> bool:
+    return name.lower().endswith(".csv") or "csv" in content_type
+
+async def read_batch_request(request: Request):
+    content_type = request.headers.get("content-type", "").lower()
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing file upload")
+        text = (await upload.read()).decode("utf-8-sig")
+        if _is_csv(upload.filename or "", upload.content_type or ""):
+            return parse_csv(text)
+        return parse_jsonl(text)
+
+    if "csv" in content_type:
+        return parse_csv((await request.body()).decode("utf-8-sig"))
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return parse_jsonl((await request.body()).decode("utf-8"))
+
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    return parse_json(data)
+
+# ----- Execution -----
+async def run_batch(items, generate, default_channels, concurrency: int = BATCH_CONCURRENCY):
+    """Run `generate(name, voice, include)` over items with a bounded worker pool.
+
+    Yields (index, item, output, error) in completion order.
+    """
+    pending = asyncio.Queue()
+    for i, item in enumerate(items):
+        pending.put_nowait((i, item))
+    done = asyncio.Queue()
+
+    async def worker():
+        while True:
+            try:
+                i, item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                out, _ = await generate(item.product_name, item.voice, item.include or default_channels)
+                await done.put((i, item, out, None))
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+                await done.put((i, item, None, detail))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        for _ in range(len(items)):
+            yield await done.get()
+    finally:
+        # Client went away or we finished: stop any remaining work
+        for w in workers:
+            w.cancel()
+
+# ----- NDJSON output -----
+def batch_line(index: int, item: GenerateIn, output: dict = None, error: str = None) -> str:
+    line = {"index": index, "product_name": item.product_name, "ok": error is None}
+    if error is None:
+        line["output"] = output
+    else:
+        line["error"] = error
+    return json.dumps(line) + "\n"
+
+def batch_summary(succeeded: int, failed: int) -> str:
+    return json.dumps({"done": True, "succeeded": succeeded, "failed": failed}) + "\n"
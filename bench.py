@@ -0,0 +1,323 @@
+# bench.py
+import os, sys, json, time, hmac, random, asyncio, hashlib, argparse, platform, subprocess
+from collections import Counter
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import event, select, insert, update
+
+from database import engine, SessionLocal, migrate
+from models import User
+from hashing import get_pwd_context
+import stubllm
+
+BENCH_PASSWORD = "bench-pass-123"
+BENCH_WEBHOOK_SECRET = "whsec_bench"
+BENCH_DOMAIN = "bench.local"
+STUB_URL = "http://stub-llm/v1/chat/completions"
+SEED_BATCH = 1000
+
+# Deterministic plan mix by user index: 20% free, 30% basic, 20% pro, 30% premium
+PLAN_CYCLE = ["free", "free", "basic", "basic", "basic", "pro", "pro", "premium", "premium", "premium"]
+
+SCENARIOS = ["login_storm", "me", "generation_burst", "batch_catalog", "webhook_flood"]
+DEFAULT_REQUESTS = {"login_storm": 200, "me": 1000, "generation_burst": 300, "batch_catalog": 8, "webhook_flood": 500}
+BATCH_SIZE = 25
+
+# ----- Fixtures -----
+def bench_email(i: int) -> str:
+    return f"bench-{i}@{BENCH_DOMAIN}"
+
+def seed_users(session, n: int) -> list:
+    """Create bench users 0..n-1 if missing and zero their usage. Returns [(email, plan)].
+
+    Works on whatever DATABASE_URL points at (SQLite or Postgres). Every bench
+    user shares one password, so only one bcrypt hash is computed.
+    """
+    users = [(bench_email(i), PLAN_CYCLE[i % len(PLAN_CYCLE)]) for i in range(n)]
+    existing = set(session.execute(
+        select(User.email).where(User.email.like(f"bench-%@{BENCH_DOMAIN}"))
+    ).scalars())
+    password_hash = get_pwd_context().hash(BENCH_PASSWORD)
+    rows = [
+        {"email": email, "password_hash": password_hash, "plan": plan, "monthly_generates": 0}
+        for email, plan in users if email not in existing
+    ]
+    for i in range(0, len(rows), SEED_BATCH):
+        session.execute(insert(User), rows[i:i + SEED_BATCH])
+    # Same starting quota every run, so results are comparable
+    session.execute(
+        update(User).where(User.email.like(f"bench-%@{BENCH_DOMAIN}")).values(monthly_generates=0)
+    )
+    session.commit()
+    return users
+
+# ----- Measurement -----
+class QueryCounter:
+    """Counts SQL statements sent through an engine."""
+
+    def __init__(self, sync_engine):
+        self.engine = sync_engine
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def close(self):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+async def run_scenario(endpoint: str, send, total: int, concurrency: int, counter: QueryCounter = None,
+                       settle=None, items_per_request: int = 1) -> dict:
+    """Fire `total` calls of `send(i)` with at most `concurrency` in flight."""
+    latencies, statuses = [], Counter()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with sem:
+            start = time.perf_counter()
+            try:
+                r = await send(i)
+                statuses[str(r.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    queries_before = counter.count if counter else 0
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    if settle:
+        await settle()  # e.g. drain write-behind so its queries are counted here
+    queries = counter.count - queries_before if counter else None
+
+    ms = lambda s: round(s * 1000, 2) if s is not None else None
+    ok = sum(n for code, n in statuses.items() if code.startswith("2"))
+    return {
+        "endpoint": endpoint,
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total / elapsed, 2) if elapsed else None,
+        "items_per_s": round(total * items_per_request / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(max(latencies) if latencies else None),
+        "ok": ok,
+        "errors": total - ok,
+        "status": dict(statuses),
+        "db_queries": queries,
+        "queries_per_request": round(queries / total, 2) if queries is not None and total else None,
+    }
+
+def stripe_signature(payload: bytes, secret: str) -> str:
+    # Same scheme stripe.Webhook.construct_event verifies
+    ts = int(time.time())
+    sig = hmac.new(secret.encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={sig}"
+
+# ----- Scenarios -----
+async def login(client: httpx.AsyncClient, email: str) -> str:
+    r = await client.post("/login", json={"email": email, "password": BENCH_PASSWORD})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+async def run_scenarios(client: httpx.AsyncClient, users: list, scenarios: list, requests: dict,
+                        concurrency: int, seed: int, webhook_secret: str,
+                        counter: QueryCounter = None, settle=None) -> dict:
+    rng = random.Random(seed)
+    nonce = int(time.time())
+    premium = [email for email, plan in users if plan == "premium"]
+    paid = [(email, plan) for email, plan in users if plan != "free"]
+
+    # Tokens for authenticated scenarios are fetched up front, outside any measurement
+    tokens = [await login(client, email) for email in premium[:min(len(premium), 20)]]
+    auth = lambda i: {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+    senders = {
+        "login_storm": ("POST /login", lambda i: client.post(
+            "/login", json={"email": rng.choice(users)[0], "password": BENCH_PASSWORD})),
+        "me": ("GET /me", lambda i: client.get("/me", headers=auth(i))),
+        "generation_burst": ("POST /generate", lambda i: client.post(
+            "/generate", json={"product_name": f"Bench Item {nonce}-{i}"}, headers=auth(i))),
+        "batch_catalog": ("POST /generate/batch", lambda i: client.post(
+            "/generate/batch", headers=auth(i),
+            json=[{"product_name": f"Bench Catalog {nonce}-{i}-{j}"} for j in range(BATCH_SIZE)])),
+        "webhook_flood": ("POST /webhook", lambda i: _send_webhook(
+            client, rng.choice(paid), f"evt_bench_{nonce}_{i}", webhook_secret)),
+    }
+
+    results = {}
+    for name in scenarios:
+        endpoint, send = senders[name]
+        total = requests.get(name, DEFAULT_REQUESTS[name])
+        print(f"🏁 {name}: {total} × {endpoint} (concurrency {concurrency})")
+        results[name] = await run_scenario(
+            endpoint, send, total, concurrency, counter=counter, settle=settle,
+            items_per_request=BATCH_SIZE if name == "batch_catalog" else 1,
+        )
+    return results
+
+def _send_webhook(client: httpx.AsyncClient, user: tuple, event_id: str, secret: str):
+    email, plan = user
+    # Re-confirms the user's current plan, so a flood leaves the fixtures unchanged
+    payload = json.dumps({
+        "id": event_id,
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": {"customer_email": email, "metadata": {"plan": plan}}},
+    }).encode()
+    return client.post("/webhook", content=payload, headers={
+        "stripe-signature": stripe_signature(payload, secret),
+        "content-type": "application/json",
+    })
+
+# ----- Runner -----
+async def run_bench(users: int = 2000, scenarios: list = None, requests: dict = None, concurrency: int = 50,
+                    seed: int = 42, base_url: str = None, webhook_secret: str = None,
+                    stub_latency: str = stubllm.STUB_LATENCY, stub_token_delay: float = stubllm.STUB_TOKEN_DELAY) -> dict:
+    """Seed fixtures and run the scenarios; returns the results document.
+
+    Without `base_url` the app runs in-process against an in-process stub LLM and
+    DB query counts are recorded. With `base_url` requests go to a running server
+    (start `stubllm.py` and point its LLM_API_URL at it); the fixtures are still
+    seeded through the local DATABASE_URL, which must be the server's database.
+    """
+    scenarios = scenarios or SCENARIOS
+    requests = requests or {}
+    migrate()
+    db = SessionLocal()
+    try:
+        fixtures = seed_users(db, users)
+    finally:
+        db.close()
+
+    meta = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_sha": _git_sha(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "target": base_url or "in-process",
+        "users": users,
+        "seed": seed,
+        "concurrency": concurrency,
+        "stub_latency": None if base_url else stub_latency,
+        "stub_token_delay": None if base_url else stub_token_delay,
+    }
+
+    if base_url:
+        secret = webhook_secret or os.getenv("STRIPE_WEBHOOK_SECRET") or BENCH_WEBHOOK_SECRET
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            results = await run_scenarios(client, fixtures, scenarios, requests, concurrency, seed, secret)
+        return {"meta": meta, "scenarios": results}
+
+    import ai
+    import app as app_module
+    from router import Router, Provider
+
+    # Every LLM call goes to the stub; nothing reaches a real provider
+    ai.router = Router([Provider("stub", STUB_URL, "bench", ai.MODEL)], client=ai.get_client)
+    ai._client = httpx.AsyncClient(transport=httpx.ASGITransport(
+        app=stubllm.create_app(stub_latency, stub_token_delay, 0.0, seed)))
+    if webhook_secret or not app_module.WEBHOOK_SECRET:
+        app_module.WEBHOOK_SECRET = webhook_secret or BENCH_WEBHOOK_SECRET
+
+    counter = QueryCounter(engine.sync_engine)
+    try:
+        async with app_module.app.router.lifespan_context(app_module.app):
+            # App errors become 500s in the results rather than aborting the run
+            transport = httpx.ASGITransport(app=app_module.app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                async def settle():
+                    # Count deferred work (write-behind rows, webhook events) against its scenario
+                    await app_module.writer.flush()
+                    await app_module.webhook_worker.drain()
+
+                results = await run_scenarios(
+                    client, fixtures, scenarios, requests, concurrency, seed, app_module.WEBHOOK_SECRET,
+                    counter=counter, settle=settle,
+                )
+    finally:
+        counter.close()
+    return {"meta": meta, "scenarios": results}
+
+def _git_sha():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ----- Regression check -----
+def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> list:
+    """Human-readable regressions of `current` against `baseline` (empty if none)."""
+    regressions = []
+    for name, new in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        if old.get("p95_ms") and new.get("p95_ms") and new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if old.get("rps") and new.get("rps") and new["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {old['rps']} -> {new['rps']}")
+        if old.get("queries_per_request") is not None and new.get("queries_per_request") is not None \
+                and new["queries_per_request"] > old["queries_per_request"]:
+            regressions.append(f"{name}: queries/request {old['queries_per_request']} -> {new['queries_per_request']}")
+        if new.get("errors", 0) > old.get("errors", 0):
+            regressions.append(f"{name}: errors {old.get('errors', 0)} -> {new['errors']}")
+    return regressions
+
+def print_table(results: dict):
+    print(f"{'scenario':<18}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>8}{'errors':>8}")
+    for name, r in results["scenarios"].items():
+        qpr = "-" if r["queries_per_request"] is None else r["queries_per_request"]
+        print(f"{name:<18}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{qpr:>8}{r['errors']:>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load scenarios against the API with a stub LLM")
+    parser.add_argument("--users", type=int, default=2000, help="bench users to seed")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", action="append", default=[], metavar="SCENARIO=N",
+                        help="override request count, e.g. --requests me=5000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", help="benchmark a running server instead of in-process")
+    parser.add_argument("--webhook-secret")
+    parser.add_argument("--stub-latency", default=stubllm.STUB_LATENCY)
+    parser.add_argument("--stub-token-delay", type=float, default=stubllm.STUB_TOKEN_DELAY)
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", help="baseline results file; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    overrides = {k: int(v) for k, v in (item.split("=", 1) for item in args.requests)}
+    results = asyncio.run(run_bench(
+        users=args.users,
+        scenarios=[s for s in args.scenarios.split(",") if s],
+        requests=overrides,
+        concurrency=args.concurrency,
+        seed=args.seed,
+        base_url=args.base_url,
+        webhook_secret=args.webhook_secret,
+        stub_latency=args.stub_latency,
+        stub_token_delay=args.stub_token_delay,
+    ))
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print_table(results)
+    print(f"✅ Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print(f"❌ {line}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline")
@@ -0,0 +1,116 @@
+# blobstore.py
+import json
+import argparse
+from sqlalchemy import select, update, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Generation, OutputBlob
+from codec import BLOB_CODEC, canonical_json, content_hash, compress
+
+# ----- Schema -----
+def has_blob_schema(conn) -> bool:
+    # generations.output_hash comes from migration 0001 (`alembic upgrade head`)
+    return "output_hash" in {c["name"] for c in inspect(conn).get_columns("generations")}
+
+# ----- Writing -----
+def _insert_blobs(dialect_name: str):
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(OutputBlob).on_conflict_do_nothing(index_elements=["hash"])
+
+def _blob(digest: str, raw: bytes) -> dict:
+    return {"hash": digest, "codec": BLOB_CODEC, "data": compress(raw), "raw_size": len(raw)}
+
+async def store_outputs(db, outputs: list) -> list:
+    """Store each distinct output once, inside the caller's transaction.
+    Returns the content hash for every output, in order."""
+    raws = [canonical_json(o) for o in outputs]
+    hashes = [content_hash(raw) for raw in raws]
+    distinct = dict(zip(hashes, raws))
+    existing = set((await db.execute(
+        select(OutputBlob.hash).where(OutputBlob.hash.in_(list(distinct)))
+    )).scalars())
+    # Only compress copy we have not stored before
+    new = [_blob(digest, raw) for digest, raw in distinct.items() if digest not in existing]
+    if new:
+        await db.execute(_insert_blobs(db.bind.dialect.name), new)
+    return hashes
+
+# ----- Backfill -----
+def backfill(session, batch_size: int = 500, dry_run: bool = False, progress=None) -> dict:
+    """Move inline outputs into deduplicated compressed blobs. Idempotent.
+
+    Returns byte counts: `inline_bytes` is the JSON the rows held inline,
+    `blob_bytes` is what the new blobs take.
+    """
+    migrated = has_blob_schema(session.connection())
+    if not migrated and not dry_run:
+        raise RuntimeError("generations.output_hash is missing: run `alembic upgrade head` first")
+    # A dry run may look at a table that has no output_hash column yet
+    pending = [Generation.output_hash.is_(None)] if migrated else []
+    insert_blobs = _insert_blobs(session.bind.dialect.name)
+    stats = {"rows": 0, "inline_bytes": 0, "blob_bytes": 0, "blobs_created": 0, "deduplicated": 0}
+    known, last_id = set(), 0
+    while True:
+        rows = session.execute(
+            select(Generation.id, Generation.output_json)
+            .where(Generation.id > last_id, Generation.output_json.isnot(None), *pending)
+            .order_by(Generation.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        rows = [r for r in rows if r.output_json is not None]
+        raws = {r.id: canonical_json(r.output_json) for r in rows}
+        hashes = {gen_id: content_hash(raw) for gen_id, raw in raws.items()}
+        unseen = set(hashes.values()) - known
+        if unseen:
+            known |= set(session.execute(select(OutputBlob.hash).where(OutputBlob.hash.in_(list(unseen)))).scalars())
+
+        blobs = {}
+        for r in rows:
+            digest = hashes[r.id]
+            stats["inline_bytes"] += len(json.dumps(r.output_json))
+            if digest in known or digest in blobs:
+                stats["deduplicated"] += 1
+            else:
+                blobs[digest] = _blob(digest, raws[r.id])
+                stats["blob_bytes"] += len(blobs[digest]["data"])
+        stats["blobs_created"] += len(blobs)
+        stats["rows"] += len(rows)
+        known |= set(blobs)
+
+        if not dry_run:
+            if blobs:
+                session.execute(insert_blobs, list(blobs.values()))
+            session.execute(update(Generation), [
+                {"id": gen_id, "output_hash": digest, "output_json": None} for gen_id, digest in hashes.items()
+            ])
+            session.commit()
+        if progress:
+            progress(stats["rows"])
+
+    stats["saved_bytes"] = stats["inline_bytes"] - stats["blob_bytes"]
+    stats["saved_pct"] = round(100 * stats["saved_bytes"] / stats["inline_bytes"], 1) if stats["inline_bytes"] else 0.0
+    return stats
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Compress and deduplicate stored generation outputs")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report the savings without writing")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        s = backfill(db, batch_size=args.batch_size, dry_run=args.dry_run,
+                     progress=lambda done: print(f"… compacted {done} outputs"))
+    finally:
+        db.close()
+    verb = "Would compact" if args.dry_run else "Compacted"
+    print(f"✅ {verb} {s['rows']} outputs into {s['blobs_created']} blobs ({s['deduplicated']} deduplicated, codec {BLOB_CODEC}).")
+    print(f"📦 {s['inline_bytes']:,} bytes inline -> {s['blob_bytes']:,} bytes compressed: saved {s['saved_bytes']:,} bytes ({s['saved_pct']}%).")
+    if not args.dry_run and db.bind.dialect.name == "postgresql":
+        print("ℹ️ Run VACUUM FULL generations (or pg_repack) to return the freed space to the OS.")
@@ -0,0 +1,140 @@
+# cache.py
+import os, json, time, hashlib
+from collections import OrderedDict
+from typing import Optional, Iterable
+
+from pydantic import ValidationError
+from ai import MODEL, PROMPT, CHANNEL_PROMPT, CHANNEL_MODE
+from schemas import GenerateOut
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | redis
+CACHE_TTL = int(os.getenv("CACHE_TTL", str(60 * 60 * 24)))  # 1 day
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "10000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_WARM_LIMIT = int(os.getenv("CACHE_WARM_LIMIT", "5000"))
+
+# Any change to the prompt template changes every key, so stale copy is never served
+PROMPT_VERSION = hashlib.sha256((PROMPT + CHANNEL_PROMPT + CHANNEL_MODE).encode()).hexdigest()[:12]
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+def _valid(output: dict) -> bool:
+    # Rows saved before GenerateOut had length/count limits may not fit them
+    try:
+        GenerateOut(**output)
+        return True
+    except ValidationError:
+        return False
+
+def cache_key(product_name: str, voice: Optional[str], include: Optional[Iterable[str]]) -> str:
+    parts = {
+        "name": normalize_name(product_name),
+        "voice": (voice or "default").strip().lower(),
+        "include": sorted({ch.strip().lower() for ch in (include or []) if ch.strip()}),
+        "model": MODEL,
+        "prompt": PROMPT_VERSION,
+    }
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+# ----- Backends -----
+class MemoryBackend:
+    """In-process LRU with per-entry TTL."""
+
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: int = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    async def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class RedisBackend:
+    """Shared backend so every worker sees the same cache.
+
+    TTL is set per key; LRU eviction is left to Redis (maxmemory-policy allkeys-lru).
+    """
+
+    def __init__(self, url: str = CACHE_REDIS_URL, ttl: int = CACHE_TTL, prefix: str = "gen:"):
+        import redis.asyncio as redis  # optional dependency
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: dict):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    async def clear(self):
+        async for k in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(k)
+
+# ----- Cache -----
+class GenerationCache:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict):
+        await self.backend.set(key, value)
+
+    async def warm(self, rows) -> int:
+        """Load (product_name, voice, include, output) rows, oldest first."""
+        n = 0
+        for product_name, voice, include, output in rows:
+            if not output or not _valid(output):
+                continue
+            channels = include.split(",") if include else []
+            await self.backend.set(cache_key(product_name, voice, channels), output)
+            n += 1
+        return n
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self.backend) if hasattr(self.backend, "__len__") else None,
+        }
+
+def build_cache() -> GenerationCache:
+    if CACHE_BACKEND == "redis":
+        return GenerationCache(RedisBackend())
+    return GenerationCache(MemoryBackend())
+
+generation_cache = build_cache()
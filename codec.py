@@ -0,0 +1,36 @@
+# codec.py
+import os, json, zlib, hashlib
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+# Codec for new blobs; every blob records its own, so switching is safe
+BLOB_CODEC = os.getenv("BLOB_CODEC", "zstd" if zstandard else "zlib")
+BLOB_LEVEL = int(os.getenv("BLOB_LEVEL", "9" if BLOB_CODEC == "zlib" else "10"))
+
+def canonical_json(output: dict) -> bytes:
+    # Sorted keys, no whitespace: identical outputs always give identical bytes (and hashes)
+    return json.dumps(output, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+def compress(raw: bytes, codec: str = BLOB_CODEC) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("BLOB_CODEC=zstd needs the zstandard package")
+        return zstandard.ZstdCompressor(level=BLOB_LEVEL).compress(raw)
+    return zlib.compress(raw, BLOB_LEVEL)
+
+def decompress(codec: str, data: bytes) -> dict:
+    if codec == "zstd":
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = zlib.decompress(data)
+    return json.loads(raw)
+
+def decode_output(inline, codec: str = None, data: bytes = None):
+    """Output from a (generations.output, output_blobs.codec, output_blobs.data) outer-join row."""
+    return decompress(codec, data) if data is not None else inline
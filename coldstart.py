@@ -0,0 +1,119 @@
+# coldstart.py
+import os, sys, json, time, socket, argparse, tempfile, statistics, subprocess
+import httpx
+
+from bench import stripe_signature, percentile, _git_sha
+from database import migrate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Heavy modules that must not load at import time; they load on first use
+LAZY_MODULES = ["stripe", "openai", "passlib", "requests", "alembic"]
+
+IMPORT_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import app
+print(json.dumps({"import_ms": (time.perf_counter() - t) * 1000,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+def measure_import(env: dict) -> dict:
+    """Import app.py in a fresh interpreter (nothing cached in sys.modules)."""
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE % LAZY_MODULES], env=env, cwd=HERE,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _timed(client, method, url, expect: int, **kwargs) -> float:
+    start = time.perf_counter()
+    r = client.request(method, url, **kwargs)
+    elapsed = (time.perf_counter() - start) * 1000
+    if r.status_code != expect:
+        raise RuntimeError(f"{method} {url}: expected {expect}, got {r.status_code} {r.text[:200]}")
+    return elapsed
+
+def measure_boot(env: dict, timeout: float = 30.0) -> dict:
+    """Start a server process and time it from spawn until it answers and is ready,
+    then the first vs second request of each lazily-loaded route."""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                            env=env, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        with httpx.Client(base_url=base, timeout=10) as client:
+            while "listening_ms" not in result or "ready_ms" not in result:
+                if time.perf_counter() - spawned > timeout:
+                    raise RuntimeError(f"server not ready after {timeout}s")
+                try:
+                    r = client.get("/ready")
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                elapsed = (time.perf_counter() - spawned) * 1000
+                result.setdefault("listening_ms", elapsed)
+                if r.status_code == 200:
+                    result["ready_ms"] = elapsed
+                else:
+                    time.sleep(0.005)
+
+            # First call pays the lazy import (stripe, passlib); the second shows the steady state.
+            # The webhook is signed with the wrong secret: verification loads the SDK, then rejects it
+            payload = b'{"id": "evt_coldstart", "type": "ping"}'
+            webhook = {"content": payload, "headers": {"stripe-signature": stripe_signature(payload, "whsec_other")}}
+            result["webhook_first_ms"] = _timed(client, "POST", "/webhook", 400, **webhook)
+            result["webhook_second_ms"] = _timed(client, "POST", "/webhook", 400, **webhook)
+            signup = lambda: {"json": {"email": f"cold-{time.time_ns()}@example.com", "password": "coldstart"}}
+            result["signup_first_ms"] = _timed(client, "POST", "/signup", 200, **signup())
+            result["signup_second_ms"] = _timed(client, "POST", "/signup", 200, **signup())
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+def run_coldstart(runs: int = 5, database_url: str = None) -> dict:
+    env = {**os.environ, "STRIPE_WEBHOOK_SECRET": "whsec_coldstart", "BCRYPT_ROUNDS": os.getenv("BCRYPT_ROUNDS", "10")}
+    if database_url is None:
+        # Throwaway database, migrated out of band as a deploy would
+        database_url = f"sqlite:///{tempfile.mkdtemp(prefix='coldstart-')}/app.db"
+        migrate(url=database_url)
+    env["DATABASE_URL"] = database_url
+
+    samples = {}
+    loaded = set()
+    for _ in range(runs):
+        probe = measure_import(env)
+        loaded.update(probe["loaded"])
+        for name, value in {"import_ms": probe["import_ms"], **measure_boot(env)}.items():
+            samples.setdefault(name, []).append(value)
+
+    summary = {name: {"median": round(statistics.median(v), 1), "p95": round(percentile(v, 95), 1)}
+               for name, v in samples.items()}
+    return {
+        "meta": {"git_sha": _git_sha(), "python": sys.version.split()[0], "runs": runs},
+        "eagerly_loaded": sorted(loaded),  # should be empty
+        "timings": summary,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: import time and first-request latency")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="already-migrated database (default: a fresh SQLite file)")
+    parser.add_argument("--out", default="coldstart-results.json")
+    args = parser.parse_args()
+
+    results = run_coldstart(args.runs, args.database_url)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"{'timing':<20}{'median':>10}{'p95':>10}")
+    for name, t in results["timings"].items():
+        print(f"{name:<20}{t['median']:>10}{t['p95']:>10}")
+    if results["eagerly_loaded"]:
+        print(f"⚠️ Loaded at import time: {', '.join(results['eagerly_loaded'])}")
+    print(f"✅ Results written to {args.out}")
@@ -0,0 +1,13 @@
+# conftest.py
+import os, tempfile
+
+# Point the app at a throwaway SQLite file before database.py is imported
+_tmp = tempfile.mkdtemp(prefix="ecom-ai-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("WRITE_BEHIND_INTERVAL", "0.01")
+
+# The app no longer creates tables at startup; build the test schema the way deploys do
+from database import migrate
+migrate()
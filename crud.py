@@ -1,46 +1,149 @@
-from sqlalchemy.orm import Session
-from models import User, Generation
-from auth import hash_password, verify_password
-from utils import get_password_hash, verify_password
+import base64
+from datetime import datetime
+from sqlalchemy import select, insert, or_, and_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import User, Generation, OutputBlob
+from hashing import hash_password_async, verify_and_update_async
+from search import index_generations
+from similar import index_similar
+from blobstore import store_outputs
+from codec import decode_output
 
 # ----- Users -----
-def create_user(db, email: str, password: str):
-    hashed_password = get_password_hash(password)
+async def create_user(db: AsyncSession, email: str, password: str):
+    hashed_password = await hash_password_async(password)
     new_user = User(
         email=email,
         password_hash=hashed_password,
         plan="free",                 # ✅ Start all new users on free plan
-        monthly_generates=0,         # start at 0
-        free_trial_remaining=3       # ✅ Give them 3 free trial generates
+        monthly_generates=0,         # start at 0 (3 free trial generates)
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
 
-def authenticate_user(db, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    ok, new_hash = await verify_and_update_async(password, user.password_hash)
+    if not ok:
         return None
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was made: upgrade it transparently
+        user.password_hash = new_hash
+        await db.commit()
     return user
 
 # ----- Generations -----
-def create_generation(db: Session, product_name: str, voice: str, include: list, output: dict):
-    gen = Generation(
-        product_name=product_name,
-        voice=voice,
-        include=",".join(include),
-        output=output
+async def bulk_create_generations(db: AsyncSession, rows: list):
+    # Rows carry an "output" dict; it is stored as a shared compressed blob.
+    # Single multi-row INSERT (+ one blob, search-index and similarity batch); caller commits
+    if not rows:
+        return
+    hashes = await store_outputs(db, [row["output"] for row in rows])
+    values = [{**{k: v for k, v in row.items() if k != "output"}, "output_hash": h} for row, h in zip(rows, hashes)]
+    result = await db.execute(insert(Generation).returning(Generation.id, sort_by_parameter_order=True), values)
+    ids = result.scalars().all()
+    await index_generations(db, [
+        {"gen_id": gen_id, "user_id": row.get("user_id"), "product_name": row["product_name"], "output": row["output"]}
+        for gen_id, row in zip(ids, rows)
+    ])
+    await index_similar(db, [{**row, "gen_id": gen_id} for gen_id, row in zip(ids, rows)])
+
+# Keyset cursor: "<created_at iso>|<id>" of the last row on the previous page
+def encode_cursor(created_at: datetime, gen_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{gen_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, gen_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(gen_id)
+
+def filter_generations(stmt, voice: str = None, channel: str = None,
+                       created_from: datetime = None, created_to: datetime = None):
+    if voice:
+        stmt = stmt.where(Generation.voice == voice)
+    if channel:
+        # include is stored comma-separated
+        stmt = stmt.where(("," + func.coalesce(Generation.include, "") + ",").like(f"%,{channel},%"))
+    if created_from:
+        stmt = stmt.where(Generation.created_at >= created_from)
+    if created_to:
+        stmt = stmt.where(Generation.created_at < created_to)
+    return stmt
+
+async def list_generations(db: AsyncSession, user_id: int, limit: int = 20, cursor: str = None,
+                           voice: str = None, channel: str = None,
+                           created_from: datetime = None, created_to: datetime = None):
+    """One page of a user's history, newest first. Returns (rows, next_cursor).
+
+    Only summary columns are selected, so the large output JSON is never loaded.
+    Served by ix_generations_user_created; deep pages cost the same as the first.
+    """
+    stmt = (
+        select(Generation.id, Generation.product_name, Generation.voice,
+               Generation.include, Generation.created_at)
+        .where(Generation.user_id == user_id)
+        .order_by(Generation.created_at.desc(), Generation.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        c_created, c_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            Generation.created_at < c_created,
+            and_(Generation.created_at == c_created, Generation.id < c_id),
+        ))
+    stmt = filter_generations(stmt, voice, channel, created_from, created_to)
+
+    rows = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+async def get_generation(db: AsyncSession, user_id: int, gen_id: int):
+    result = await db.execute(
+        select(Generation).where(Generation.id == gen_id, Generation.user_id == user_id)
+    )
+    return result.scalars().first()
+
+async def get_recent_generation_outputs(db: AsyncSession, limit: int = 1000):
+    # Newest first; used to warm the generation cache on startup
+    result = await db.execute(
+        select(Generation.product_name, Generation.voice, Generation.include,
+               Generation.output_json, OutputBlob.codec, OutputBlob.data)
+        .outerjoin(OutputBlob, Generation.output_hash == OutputBlob.hash)
+        .order_by(Generation.id.desc())
+        .limit(limit)
     )
-    db.add(gen)
-    db.commit()
-    db.refresh(gen)
-    return gen
+    return [(r.product_name, r.voice, r.include, decode_output(r.output_json, r.codec, r.data)) for r in result]
+
+def export_query(user_id: int, latest_only: bool = False, **filters):
+    """All of a user's generations, oldest first, with the output blob joined in.
 
-def get_generations(db: Session, skip: int = 0, limit: int = 20):
-    return db.query(Generation).offset(skip).limit(limit).all()
+    `latest_only` keeps the newest generation per product name. Callers stream
+    it (yield_per) rather than loading it.
+    """
+    stmt = filter_generations(
+        select(Generation.id, Generation.product_name, Generation.voice, Generation.include,
+               Generation.created_at, Generation.output_json, OutputBlob.codec, OutputBlob.data)
+        .outerjoin(OutputBlob, Generation.output_hash == OutputBlob.hash)
+        .where(Generation.user_id == user_id)
+        .order_by(Generation.created_at, Generation.id),
+        **filters,
+    )
+    if latest_only:
+        newest = filter_generations(
+            select(func.max(Generation.id)).where(Generation.user_id == user_id).group_by(Generation.product_name),
+            **filters,
+        )
+        stmt = stmt.where(Generation.id.in_(newest))
+    return stmt
@@ -1,25 +1,145 @@
 # database.py
-import os
+import os, time
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
-engine = create_async_engine(DATABASE_URL, future=True, echo=True)
+# Pool tuning: size the pool against the number of workers hitting the DB
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"  # statement logging, off in production
 
-AsyncSessionLocal = sessionmaker(
+def async_url(url: str) -> str:
+    # Render/Heroku style URLs carry no driver; pick the async one
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+def sync_url(url: str) -> str:
+    url = async_url(url)
+    return url.replace("+asyncpg://", "+psycopg2://").replace("+aiosqlite://", "://")
+
+# ----- Pool checkout timing -----
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited: float):
+        self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "avg_wait_ms": round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 3),
+        }
+
+pool_stats = PoolStats()
+
+class _TimedCheckout:
+    """Records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - start)
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+def _engine_kwargs(url: str, poolclass) -> dict:
+    kwargs = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    if ":memory:" in url or url.rstrip("/").endswith("sqlite:"):
+        return kwargs  # in-memory SQLite uses a single static connection
+    kwargs.update(
+        poolclass=poolclass,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return kwargs
+
+# ----- Async (API) -----
+ASYNC_DATABASE_URL = async_url(DATABASE_URL)
+engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL, TimedAsyncQueuePool))
+
+AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     expire_on_commit=False,
     class_=AsyncSession,
     autoflush=False,
-    autocommit=False,
+)
+
+# ----- Sync adapter (CLI jobs, scripts) -----
+SYNC_DATABASE_URL = sync_url(DATABASE_URL)
+sync_engine = create_engine(SYNC_DATABASE_URL, **_engine_kwargs(SYNC_DATABASE_URL, TimedQueuePool))
+
+SessionLocal = sessionmaker(
+    bind=sync_engine,
+    expire_on_commit=False,
+    autoflush=False,
 )
 
 Base = declarative_base()
 
 async def get_db():
+    # Sessions connect lazily: requests served from caches never check out a connection
     async with AsyncSessionLocal() as session:
         yield session
-        
\ No newline at end of file
+
+# ----- Migrations (Alembic, imported only when used) -----
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+def _alembic_config(url: str = None):
+    from alembic.config import Config
+    config = Config(ALEMBIC_INI)
+    config.attributes["configure_logger"] = False
+    if url:
+        config.set_main_option("sqlalchemy.url", url)
+    return config
+
+def migrate(revision: str = "head", url: str = None):
+    """Same as `alembic upgrade head`; deploys run it before starting the app."""
+    from alembic import command
+    command.upgrade(_alembic_config(url), revision)
+
+def schema_head() -> str:
+    from alembic.script import ScriptDirectory
+    return ScriptDirectory.from_config(_alembic_config()).get_current_head()
+
+def schema_revision(conn):
+    """Revision the database is at (None if never migrated). Run with a sync connection."""
+    from alembic.runtime.migration import MigrationContext
+    return MigrationContext.configure(conn).get_current_revision()
+
+def pool_status() -> dict:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, **pool_stats.as_dict()}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=DB_MAX_OVERFLOW,
+        )
+    return status
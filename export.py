@@ -0,0 +1,195 @@
+# export.py
+import os, io, re, csv, sys, html, json, zlib, itertools
+import argparse
+
+from crud import export_query
+from codec import decode_output
+
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "500"))        # rows fetched per round trip (yield_per)
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", str(64 * 1024)))  # bytes buffered before a chunk is sent
+
+FORMATS = {
+    # format: (media type, file extension)
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "shopify": ("text/csv", "csv"),
+}
+
+# ----- Serializers -----
+CSV_COLUMNS = ["id", "product_name", "voice", "include", "created_at", "SEO_title", "description",
+               "benefit_bullets", "tiktok_caption", "instagram_ad_caption", "email_subjects", "keywords_used"]
+SHOPIFY_COLUMNS = ["Handle", "Title", "Body (HTML)", "Tags", "SEO Title", "SEO Description"]
+
+def handle(name: str) -> str:
+    # Shopify handles: lowercase words joined by hyphens
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+def _output(row) -> dict:
+    return decode_output(row.output_json, row.codec, row.data) or {}
+
+class _CsvLine:
+    # One reusable buffer: each call returns exactly one encoded CSV record
+    def __init__(self):
+        self.buf = io.StringIO()
+        self.writer = csv.writer(self.buf)
+
+    def __call__(self, values) -> str:
+        self.buf.seek(0)
+        self.buf.truncate()
+        self.writer.writerow(values)
+        return self.buf.getvalue()
+
+class CsvFormat:
+    def __init__(self):
+        self.line = _CsvLine()
+
+    def header(self) -> str:
+        return self.line(CSV_COLUMNS)
+
+    def row(self, row) -> str:
+        out = _output(row)
+        return self.line([
+            row.id, row.product_name, row.voice, row.include,
+            row.created_at.isoformat() if row.created_at else "",
+            out.get("SEO_title", ""), out.get("description", ""),
+            " | ".join(out.get("benefit_bullets") or []),
+            out.get("tiktok_caption", ""), out.get("instagram_ad_caption", ""),
+            " | ".join(out.get("email_subjects") or []),
+            ", ".join(out.get("keywords_used") or []),
+        ])
+
+class JsonlFormat:
+    def header(self) -> str:
+        return ""
+
+    def row(self, row) -> str:
+        return json.dumps({
+            "id": row.id,
+            "product_name": row.product_name,
+            "voice": row.voice,
+            "include": row.include.split(",") if row.include else [],
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "output": _output(row),
+        }, ensure_ascii=False) + "\n"
+
+class ShopifyFormat:
+    """Shopify product CSV; importing it fills titles, descriptions and SEO fields."""
+
+    def __init__(self):
+        self.line = _CsvLine()
+
+    def header(self) -> str:
+        return self.line(SHOPIFY_COLUMNS)
+
+    def row(self, row) -> str:
+        out = _output(row)
+        body = f"<p>{html.escape(out.get('description', ''))}</p>"
+        bullets = out.get("benefit_bullets") or []
+        if bullets:
+            body += "<ul>" + "".join(f"<li>{html.escape(b)}</li>" for b in bullets) + "</ul>"
+        return self.line([
+            handle(row.product_name), row.product_name, body,
+            ", ".join(out.get("keywords_used") or []),
+            out.get("SEO_title", ""), out.get("description", "")[:320],
+        ])
+
+SERIALIZERS = {"csv": CsvFormat, "jsonl": JsonlFormat, "shopify": ShopifyFormat}
+
+# ----- Encoding -----
+class Encoder:
+    """Turns lines into ~EXPORT_CHUNK byte chunks, gzipped on the fly if asked."""
+
+    def __init__(self, gzip: bool = False, chunk_size: int = EXPORT_CHUNK):
+        self.chunk_size = chunk_size
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits 31 = gzip container
+        self._parts, self._size = [], 0
+
+    def feed(self, line: str) -> bytes:
+        data = line.encode()
+        if self._gzip:
+            data = self._gzip.compress(data)
+        if data:
+            self._parts.append(data)
+            self._size += len(data)
+        if self._size < self.chunk_size:
+            return b""
+        return self._take()
+
+    def finish(self) -> bytes:
+        if self._gzip:
+            self._parts.append(self._gzip.flush())
+        return self._take()
+
+    def _take(self) -> bytes:
+        chunk = b"".join(self._parts)
+        self._parts, self._size = [], 0
+        return chunk
+
+def _query(user_id: int, fmt: str, filters: dict):
+    if fmt not in SERIALIZERS:
+        raise ValueError(f"Unknown export format {fmt}")
+    # A product appears once in a Shopify import: keep its latest copy
+    return export_query(user_id, latest_only=fmt == "shopify", **filters) \
+        .execution_options(yield_per=EXPORT_BATCH)
+
+def iter_export(session, user_id: int, fmt: str = "csv", gzip: bool = False, **filters):
+    """Sync byte chunks of the export (CLI). yield_per streams rows through a
+    server-side cursor on Postgres, so memory does not grow with the row count."""
+    query = _query(user_id, fmt, filters)
+    serializer, encoder = SERIALIZERS[fmt](), Encoder(gzip)
+    for line in itertools.chain([serializer.header()], map(serializer.row, session.execute(query))):
+        chunk = encoder.feed(line)
+        if chunk:
+            yield chunk
+    yield encoder.finish()
+
+async def aiter_export(session_factory, user_id: int, fmt: str = "csv", gzip: bool = False, **filters):
+    """Async byte chunks of the export, for a StreamingResponse. Opens its own
+    session: the body is sent after the request's dependencies have finished."""
+    query = _query(user_id, fmt, filters)
+    serializer, encoder = SERIALIZERS[fmt](), Encoder(gzip)
+    chunk = encoder.feed(serializer.header())
+    if chunk:
+        yield chunk
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for row in result:
+            chunk = encoder.feed(serializer.row(row))
+            if chunk:
+                yield chunk
+    yield encoder.finish()
+
+if __name__ == "__main__":
+    from sqlalchemy import select
+    from database import SessionLocal
+    from models import User
+
+    parser = argparse.ArgumentParser(description="Export a user's generated copy")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--user-id", type=int)
+    who.add_argument("--email")
+    parser.add_argument("--format", choices=sorted(SERIALIZERS), default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--voice")
+    parser.add_argument("--channel")
+    parser.add_argument("--out", help="file to write (default: stdout)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_id = args.user_id or db.execute(select(User.id).where(User.email == args.email)).scalar()
+        if user_id is None:
+            sys.exit(f"❌ No user {args.email}")
+        out = open(args.out, "wb") if args.out else sys.stdout.buffer
+        written = 0
+        try:
+            for chunk in iter_export(db, user_id, args.format, args.gzip, voice=args.voice, channel=args.channel):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if args.out:
+                out.close()
+    finally:
+        db.close()
+    if args.out:
+        print(f"✅ Exported {written:,} bytes to {args.out}")
@@ -0,0 +1,92 @@
+# hashing.py
+import os, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Raising/lowering the cost is safe: existing hashes are upgraded on next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "100"))
+
+pwd_context = None  # built by get_pwd_context() on first use; keeps passlib/bcrypt off the cold start
+
+def get_pwd_context():
+    global pwd_context
+    if pwd_context is None:
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+    return pwd_context
+
+class HashPoolBusy(RuntimeError):
+    pass
+
+class HashPool:
+    """Dedicated, size-limited executor for bcrypt so hashing never blocks the
+    event loop or the request threadpool. bcrypt releases the GIL, so threads
+    give real parallelism up to `workers`."""
+
+    def __init__(self, workers: int = HASH_WORKERS, max_queue: int = HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self.pending = 0      # submitted and not yet finished
+        self.completed = 0
+        self.rejected = 0
+        self.peak_queue = 0
+        self.total_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HashPoolBusy("Password hashing queue is full")
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            return started - submitted, fn(*args)
+
+        self.pending += 1
+        self.peak_queue = max(self.peak_queue, self.queued)
+        try:
+            waited, result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), job)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.total_wait += waited
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "in_flight": self.pending,
+            "queued": self.queued,
+            "peak_queue": self.peak_queue,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(1000 * self.total_wait / self.completed, 2) if self.completed else 0.0,
+        }
+
+hash_pool = HashPool()
+
+async def hash_password_async(password: str) -> str:
+    return await hash_pool.run(get_pwd_context().hash, password)
+
+async def verify_and_update_async(password: str, hashed: str):
+    """Returns (ok, new_hash). new_hash is set when the stored hash uses an old cost."""
+    return await hash_pool.run(get_pwd_context().verify_and_update, password, hashed)
@@ -0,0 +1,230 @@
+# jobs.py
+import os, json, hmac, uuid, socket, asyncio, hashlib, ipaddress
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+import httpx
+from sqlalchemy import select, update, func
+
+from models import Job
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))                  # concurrent jobs per process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))  # picks up jobs queued by other processes
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "600"))        # requeue "running" jobs older than this
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "60"))  # how often idle workers look for them
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+JOB_CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET")            # signs callback bodies (X-Signature)
+# Comma-separated hosts callbacks may go to; empty allows any host that resolves
+# only to public addresses (never loopback, private, link-local or metadata IPs)
+JOB_CALLBACK_HOSTS = {h.strip() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()}
+
+def _resolve(host: str, port: int) -> list:
+    return [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+
+def _is_public(addr: str) -> bool:
+    ip = ipaddress.ip_address(addr.split("%")[0])  # drop an IPv6 zone id
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved
+                or ip.is_multicast or ip.is_unspecified)
+
+def validate_callback_url(url: str) -> str:
+    """Raise ValueError unless the URL is http(s) and may be called back.
+    Resolves the host (blocking): call it from a thread in async code."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    if JOB_CALLBACK_HOSTS:
+        if parsed.hostname not in JOB_CALLBACK_HOSTS:
+            raise ValueError(f"callback host {parsed.hostname} is not allowed")
+        return url
+    try:
+        addrs = _resolve(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback host {parsed.hostname} does not resolve")
+    if not addrs or not all(_is_public(a) for a in addrs):
+        raise ValueError(f"callback host {parsed.hostname} is not a public address")
+    return url
+
+class JobQueue:
+    """Database-backed job queue with a local worker pool.
+
+    Jobs are rows in `jobs`, so they survive restarts and any process can poll
+    them. Workers claim the highest-priority, oldest queued job with a
+    conditional UPDATE (only one claimer wins). Handlers are
+    `async handler(job_id, user_id, params) -> dict` and are registered by kind;
+    an exception marks the job failed. A finished job is POSTed to its
+    callback_url, if it has one.
+    """
+
+    def __init__(self, session_factory, workers: int = JOB_WORKERS, interval: float = JOB_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.interval = interval
+        self.handlers = {}
+        self._wake = None
+        self._tasks = []
+        self._client = None
+        self._active = set()  # ids of jobs this process is running
+        self._last_sweep = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.callbacks_failed = 0
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        await self.requeue_stale()
+        self._last_sweep = asyncio.get_running_loop().time()
+        self._wake = asyncio.Condition()
+        self._client = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        interrupted = set(self._active)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if interrupted:
+            # Cancelled mid-job: back in line for the next worker, quota still reserved
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(Job).where(Job.id.in_(interrupted), Job.status == "running")
+                    .values(status="queued", started_at=None)
+                )
+                await db.commit()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def submit(self, db, user_id: int, kind: str, params: dict, priority: int = 0,
+                     callback_url: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        db.add(Job(id=job_id, user_id=user_id, kind=kind, params=params,
+                   priority=priority, callback_url=callback_url))
+        await db.commit()
+        await self.notify()
+        return job_id
+
+    async def notify(self):
+        if self._wake is not None:
+            async with self._wake:
+                self._wake.notify()
+
+    async def requeue_stale(self):
+        # A process that died mid-job leaves it "running"; put it back in line
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Job).where(Job.status == "running", Job.started_at < cutoff)
+                .values(status="queued", started_at=None)
+            )
+            await db.commit()
+
+    async def claim(self):
+        """Take the next job (highest priority, then oldest). Returns a Job or None."""
+        async with self.session_factory() as db:
+            while True:
+                job_id = (await db.execute(
+                    select(Job.id).where(Job.status == "queued")
+                    .order_by(Job.priority.desc(), Job.created_at, Job.id)
+                    .limit(1)
+                )).scalar()
+                if job_id is None:
+                    return None
+                claimed = await db.execute(
+                    update(Job).where(Job.id == job_id, Job.status == "queued")
+                    .values(status="running", started_at=datetime.utcnow())
+                )
+                await db.commit()
+                if claimed.rowcount == 1:
+                    return await db.get(Job, job_id)
+                # Another worker got it first; try the next one
+
+    async def run_next(self) -> bool:
+        """Claim and run one job. Returns False if the queue was empty."""
+        job = await self.claim()
+        if job is None:
+            return False
+        self._active.add(job.id)
+        try:
+            result, error, status = await self.handlers[job.kind](job.id, job.user_id, job.params), None, "done"
+            self.completed += 1
+        except Exception as e:
+            result, error, status = None, str(e)[:500], "failed"
+            self.failed += 1
+        finally:
+            self._active.discard(job.id)
+        async with self.session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job.id).values(
+                status=status, result=result, error=error, finished_at=datetime.utcnow()
+            ))
+            await db.commit()
+        if job.callback_url:
+            await self._callback(job.callback_url, {"id": job.id, "kind": job.kind, "status": status,
+                                                    "result": result, "error": error})
+        return True
+
+    async def _callback(self, url: str, body: dict):
+        data = json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"}
+        try:
+            # Again at send time: the host may resolve differently than at submit
+            await asyncio.to_thread(validate_callback_url, url)
+        except ValueError as e:
+            self.callbacks_failed += 1
+            print(f"⚠️ job callback to {url} refused: {e}")
+            return
+        if JOB_CALLBACK_SECRET:
+            headers["X-Signature"] = hmac.new(JOB_CALLBACK_SECRET.encode(), data, hashlib.sha256).hexdigest()
+        try:
+            if self._client is not None:
+                r = await self._client.post(url, content=data, headers=headers)
+            else:
+                async with httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT) as client:
+                    r = await client.post(url, content=data, headers=headers)
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            # Best effort: the result is still available from GET /jobs/{id}
+            self.callbacks_failed += 1
+            print(f"⚠️ job callback to {url} failed: {e}")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if await self.run_next():
+                    continue
+                if loop.time() - self._last_sweep >= JOB_SWEEP_INTERVAL:
+                    self._last_sweep = loop.time()
+                    await self.requeue_stale()
+            except Exception as e:
+                print(f"⚠️ job worker error: {e}")
+            async with self._wake:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def depth(self) -> int:
+        async with self.session_factory() as db:
+            return (await db.execute(select(func.count()).select_from(Job).where(Job.status == "queued"))).scalar()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "callbacks_failed": self.callbacks_failed,
+        }
@@ -0,0 +1,172 @@
+# metrics.py
+import os, time, bisect
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS = os.getenv("METRICS", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")        # /metrics and /*/stats need "Bearer <token>"; unset keeps them closed
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Plan of the user being served, for per-plan counters deep in the call stack
+current_plan: ContextVar = ContextVar("current_plan", default="anonymous")
+# Token totals of the call being served, if something is metering it (usage.Meter)
+current_tokens: ContextVar = ContextVar("current_tokens", default=None)
+
+_tracer = None
+if OTEL_TRACING:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("ecom-ai-backend")
+    except ImportError:  # optional; spans are skipped without opentelemetry-api
+        pass
+
+# ----- Metric types (Prometheus text format, no client library needed) -----
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_labels(self.labels, key)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labels, key, le)} {series[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {round(series[-2], 6)}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {series[-1]}"
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # fn() -> [(name, help, {labels}, value)] gauges read at scrape time
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        seen = set()
+        for fn in self.collectors:
+            for name, help, labels, value in fn():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_latency = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+stage_latency = registry.histogram("stage_duration_seconds", "Time spent per request stage", ("stage",))
+quota_rejections = registry.counter("quota_rejections_total", "Requests refused for plan quota or features", ("plan", "reason"))
+llm_tokens = registry.counter("llm_tokens_total", "LLM tokens used", ("plan", "kind"))
+
+# ----- Stage timers -----
+@contextmanager
+def stage(name: str):
+    """Time a block into stage_duration_seconds (and an OTel span if enabled)."""
+    if not METRICS:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        if _tracer:
+            with _tracer.start_as_current_span(name):
+                yield
+        else:
+            yield
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage=name)
+
+def record_tokens(usage: dict):
+    if usage:
+        plan = current_plan.get()
+        llm_tokens.inc(usage.get("prompt_tokens", 0), plan=plan, kind="prompt")
+        llm_tokens.inc(usage.get("completion_tokens", 0), plan=plan, kind="completion")
+        tokens = current_tokens.get()
+        if tokens is not None:
+            tokens["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            tokens["completion_tokens"] += usage.get("completion_tokens", 0)
+
+# ----- ASGI middleware -----
+class MetricsMiddleware:
+    """Per-route request count and latency. Pure ASGI to keep per-request overhead small;
+    routes are labelled by their template (/generations/{gen_id}), never the raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_latency.observe(time.perf_counter() - start, method=method, route=route)
+            http_requests.inc(method=method, route=route, status=status)
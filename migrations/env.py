@@ -0,0 +1,32 @@
+# migrations/env.py
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from database import Base, SYNC_DATABASE_URL
+import models  # noqa: F401  registers every table on Base.metadata
+
+config = context.config
+if config.config_file_name and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# database.migrate(url=...) may point one run at another database
+url = config.get_main_option("sqlalchemy.url") or SYNC_DATABASE_URL
+
+def include_object(obj, name, type_, reflected, compare_to):
+    # Search tables are raw DDL (search.py), not models; autogenerate must not drop them
+    return not (type_ == "table" and reflected and compare_to is None and name.startswith(("generations_fts", "generation_search")))
+
+def run_migrations_online():
+    engine = create_engine(url, poolclass=pool.NullPool)
+    with engine.connect() as conn:
+        context.configure(connection=conn, target_metadata=Base.metadata, include_object=include_object,
+                          render_as_batch=True)
+        with context.begin_transaction():
+            context.run_migrations()
+    engine.dispose()
+
+if context.is_offline_mode():
+    # The baseline inspects the live schema to upgrade create_all-era databases
+    raise SystemExit("--sql (offline) mode is not supported; run against the database")
+run_migrations_online()
@@ -0,0 +1,147 @@
+"""baseline schema
+
+Creates every table on a fresh database. Databases built by the old startup
+`create_all` already have some tables, so existing tables only get the
+columns and indexes they are missing.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Full-text search tables are dialect-specific raw DDL. Frozen here as of this
+# revision: later changes to search.py ship as new migrations, not edits to this one.
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+        product_name, seo_title, description, keywords, user_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+]
+POSTGRES_SEARCH_DDL = [
+    """CREATE TABLE IF NOT EXISTS generation_search (
+        generation_id INTEGER PRIMARY KEY REFERENCES generations(id) ON DELETE CASCADE,
+        user_id INTEGER,
+        document TSVECTOR NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_generation_search_document ON generation_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_generation_search_user ON generation_search (user_id)",
+]
+
+def _table(name, *columns):
+    """Create the table, or add the columns an older copy of it lacks."""
+    insp = sa.inspect(op.get_bind())
+    if name not in insp.get_table_names():
+        op.create_table(name, *columns)
+        return
+    have = {c["name"] for c in insp.get_columns(name)}
+    for col in columns:
+        if isinstance(col, sa.Column) and col.name not in have:
+            # SQLite cannot add constraints to an existing table: the column comes without its FK
+            op.add_column(name, sa.Column(col.name, col.type, nullable=True, server_default=col.server_default))
+
+def _index(name, table, columns, unique=False):
+    if name not in {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes(table)}:
+        op.create_index(name, table, columns, unique=unique)
+
+def upgrade():
+    _table(
+        "users",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("email", sa.String, nullable=False),
+        sa.Column("password_hash", sa.String, nullable=False),
+        sa.Column("plan", sa.String),
+        sa.Column("monthly_generates", sa.Integer, server_default="0"),
+        sa.Column("last_reset", sa.DateTime),
+        sa.Column("stripe_customer_id", sa.String),
+    )
+    _index("ix_users_id", "users", ["id"])
+    _index("ix_users_email", "users", ["email"], unique=True)
+    _index("ix_users_stripe_customer_id", "users", ["stripe_customer_id"], unique=True)
+
+    _table(
+        "output_blobs",
+        sa.Column("hash", sa.String(64), primary_key=True),
+        sa.Column("codec", sa.String, nullable=False),
+        sa.Column("data", sa.LargeBinary, nullable=False),
+        sa.Column("raw_size", sa.Integer, nullable=False),
+    )
+
+    _table(
+        "generations",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+        sa.Column("product_name", sa.String, nullable=False),
+        sa.Column("voice", sa.String),
+        sa.Column("include", sa.String),
+        sa.Column("output", sa.JSON),
+        sa.Column("output_hash", sa.String(64), sa.ForeignKey("output_blobs.hash")),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    _index("ix_generations_id", "generations", ["id"])
+    _index("ix_generations_user_created", "generations", ["user_id", "created_at", "id"])
+    _index("ix_generations_output_hash", "generations", ["output_hash"])
+
+    _table(
+        "similar_entries",
+        sa.Column("gen_id", sa.Integer, sa.ForeignKey("generations.id"), primary_key=True),
+        sa.Column("name", sa.String, nullable=False),
+        sa.Column("keywords", sa.String),
+    )
+    _table(
+        "similar_bands",
+        sa.Column("band_key", sa.BigInteger, primary_key=True, autoincrement=False),
+        sa.Column("gen_id", sa.Integer, sa.ForeignKey("generations.id"), primary_key=True),
+    )
+
+    _table(
+        "stripe_events",
+        sa.Column("seq", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.String, nullable=False, unique=True),
+        sa.Column("type", sa.String, nullable=False),
+        sa.Column("customer", sa.String, nullable=False),
+        sa.Column("created", sa.Integer, nullable=False),
+        sa.Column("payload", sa.JSON, nullable=False),
+        sa.Column("status", sa.String, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("error", sa.String),
+        sa.Column("received_at", sa.DateTime),
+        sa.Column("processed_at", sa.DateTime),
+    )
+    _index("ix_stripe_events_pending", "stripe_events", ["status", "created", "seq"])
+
+    _table(
+        "jobs",
+        sa.Column("id", sa.String, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("kind", sa.String, nullable=False),
+        sa.Column("status", sa.String, nullable=False),
+        sa.Column("priority", sa.Integer, nullable=False),
+        sa.Column("params", sa.JSON, nullable=False),
+        sa.Column("result", sa.JSON),
+        sa.Column("error", sa.String),
+        sa.Column("callback_url", sa.String),
+        sa.Column("created_at", sa.DateTime),
+        sa.Column("started_at", sa.DateTime),
+        sa.Column("finished_at", sa.DateTime),
+    )
+    _index("ix_jobs_queue", "jobs", ["status", "priority", "created_at"])
+
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for stmt in POSTGRES_SEARCH_DDL if postgres else SQLITE_SEARCH_DDL:
+        op.execute(stmt)
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        op.execute("DROP TABLE IF EXISTS generation_search")
+    else:
+        op.execute("DROP TABLE IF EXISTS generations_fts")
+    for table in ["jobs", "stripe_events", "similar_bands", "similar_entries", "generations", "output_blobs", "users"]:
+        op.drop_table(table)
@@ -0,0 +1,55 @@
+"""usage ledger and rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "usage_events",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("created_at", sa.DateTime, nullable=False),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("plan", sa.String, nullable=False),
+        sa.Column("kind", sa.String, nullable=False),
+        sa.Column("channels", sa.String),
+        sa.Column("voice", sa.String),
+        sa.Column("status", sa.String, nullable=False),
+        sa.Column("cache", sa.String),
+        sa.Column("units", sa.Integer, nullable=False),
+        sa.Column("cache_hits", sa.Integer, nullable=False),
+        sa.Column("latency_ms", sa.Integer, nullable=False),
+        sa.Column("prompt_tokens", sa.Integer, nullable=False),
+        sa.Column("completion_tokens", sa.Integer, nullable=False),
+    )
+    op.create_index("ix_usage_events_created", "usage_events", ["created_at"])
+    op.create_index("ix_usage_events_user_created", "usage_events", ["user_id", "created_at"])
+
+    op.create_table(
+        "usage_rollups",
+        sa.Column("grain", sa.String, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), primary_key=True, autoincrement=False),
+        sa.Column("bucket", sa.DateTime, primary_key=True),
+        sa.Column("kind", sa.String, primary_key=True),
+        sa.Column("plan", sa.String, primary_key=True),
+        sa.Column("requests", sa.Integer, nullable=False),
+        sa.Column("errors", sa.Integer, nullable=False),
+        sa.Column("units", sa.Integer, nullable=False),
+        sa.Column("cache_hits", sa.Integer, nullable=False),
+        sa.Column("latency_ms", sa.BigInteger, nullable=False),
+        sa.Column("prompt_tokens", sa.BigInteger, nullable=False),
+        sa.Column("completion_tokens", sa.BigInteger, nullable=False),
+    )
+    op.create_index("ix_usage_rollups_bucket", "usage_rollups", ["grain", "bucket"])
+
+def downgrade():
+    op.drop_table("usage_rollups")
+    op.drop_table("usage_events")
@@ -0,0 +1,24 @@
+"""stripe event claims
+
+Webhook workers in several processes claim an event (status "applying")
+before applying it; claimed_at lets a crashed worker's claims be requeued.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    with op.batch_alter_table("stripe_events") as batch:
+        batch.add_column(sa.Column("claimed_at", sa.DateTime))
+
+def downgrade():
+    with op.batch_alter_table("stripe_events") as batch:
+        batch.drop_column("claimed_at")
@@ -0,0 +1,23 @@
+"""similarity buckets per user
+
+Band keys now include the owning user, so copy is only ever reused from the
+caller's own generations. Buckets hashed the old way would never match again;
+they are dropped here. Rebuild them with `python similar.py` (idempotent).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("DELETE FROM similar_bands")
+
+def downgrade():
+    # Per-user buckets are not valid for the old lookup either
+    op.execute("DELETE FROM similar_bands")
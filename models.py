@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, JSON, ForeignKey, Index, LargeBinary
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 from datetime import datetime
+from codec import decompress
 
 class User(Base):
     __tablename__ = "users"
@@ -12,13 +14,144 @@ class User(Base):
     plan = Column(String, default="basic")  # basic, pro, premium
     monthly_generates = Column(Integer, default=0)
     last_reset = Column(DateTime, default=datetime.utcnow)
+    stripe_customer_id = Column(String, nullable=True, unique=True, index=True)  # webhook lookups
 
 class Generation(Base):
     __tablename__ = "generations"
 
     id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # null for legacy rows
     product_name = Column(String, nullable=False)
     voice = Column(String, default="default")
     include = Column(String)  # comma-separated string of channels
-    output = Column(JSON)     # JSON field to store generation output
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    output_json = Column("output", JSON(none_as_null=True))  # inline output; only rows not yet compacted
+    # Compressed output, shared by every generation with identical copy
+    output_hash = Column(String(64), ForeignKey("output_blobs.hash"), nullable=True, index=True)
+    # Python-side default keeps one timestamp format across backends (keyset cursors compare it)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=datetime.utcnow)
+
+    # Compressed bytes come along with the row; decompression waits for .output
+    blob = relationship("OutputBlob", lazy="joined")
+
+    __table_args__ = (
+        # Per-user history, newest first, keyset-paginated on (created_at, id)
+        Index("ix_generations_user_created", "user_id", "created_at", "id"),
+    )
+
+    @property
+    def output(self):
+        if self.blob is None:
+            return self.output_json
+        if "_output" not in self.__dict__:
+            self.__dict__["_output"] = decompress(self.blob.codec, self.blob.data)
+        return self.__dict__["_output"]
+
+class OutputBlob(Base):
+    __tablename__ = "output_blobs"
+
+    hash = Column(String(64), primary_key=True)  # sha256 of the canonical JSON
+    codec = Column(String, nullable=False)       # zstd or zlib
+    data = Column(LargeBinary, nullable=False)
+    raw_size = Column(Integer, nullable=False)   # uncompressed bytes, for reporting
+
+class SimilarEntry(Base):
+    __tablename__ = "similar_entries"
+
+    gen_id = Column(Integer, ForeignKey("generations.id"), primary_key=True)
+    name = Column(String, nullable=False)      # normalized product name, for exact re-scoring
+    keywords = Column(String, default="")      # generated keywords_used, lowercased, space-separated
+
+class SimilarBand(Base):
+    __tablename__ = "similar_bands"
+
+    # MinHash LSH bucket (scoped to voice + channels); the PK doubles as the lookup index
+    band_key = Column(BigInteger, primary_key=True, autoincrement=False)
+    gen_id = Column(Integer, ForeignKey("generations.id"), primary_key=True)
+
+class StripeEvent(Base):
+    __tablename__ = "stripe_events"
+
+    seq = Column(Integer, primary_key=True)                    # arrival order
+    event_id = Column(String, unique=True, nullable=False)     # Stripe retries reuse the id
+    type = Column(String, nullable=False)
+    customer = Column(String, nullable=False)                  # per-customer ordering key
+    created = Column(Integer, nullable=False, default=0)       # Stripe's event timestamp
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, applying, done, stale, ignored, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    received_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime)                              # when a worker took it (status applying)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        # Worker scans pending events oldest first
+        Index("ix_stripe_events_pending", "status", "created", "seq"),
+    )
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)                       # opaque, returned to the client
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)                       # generate, email
+    status = Column(String, nullable=False, default="queued")   # queued, running, done, failed
+    priority = Column(Integer, nullable=False, default=0)       # from the plan; higher runs first
+    params = Column(JSON, nullable=False)
+    result = Column(JSON)
+    error = Column(String)
+    callback_url = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # Workers claim the best queued job: highest priority, then oldest
+        Index("ix_jobs_queue", "status", "priority", "created_at"),
+    )
+
+class UsageEvent(Base):
+    __tablename__ = "usage_events"
+
+    # Append-only: one row per /generate, /generate_email or batch call, never updated
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    plan = Column(String, nullable=False)                   # plan when the call was served
+    kind = Column(String, nullable=False)                   # generate, email, batch
+    channels = Column(String)                               # comma-separated, as in generations.include
+    voice = Column(String)
+    status = Column(String, nullable=False, default="ok")   # ok, error
+    cache = Column(String)                                  # hit, miss, similar; null for email and batch
+    units = Column(Integer, nullable=False, default=1)      # generations delivered
+    cache_hits = Column(Integer, nullable=False, default=0) # ...of which served without the model
+    latency_ms = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_usage_events_created", "created_at"),
+        Index("ix_usage_events_user_created", "user_id", "created_at"),
+    )
+
+class UsageRollup(Base):
+    __tablename__ = "usage_rollups"
+
+    # Hourly and daily sums of usage_events, kept current as events are written
+    grain = Column(String, primary_key=True)                # hour, day
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    bucket = Column(DateTime, primary_key=True)             # start of the hour/day, UTC
+    kind = Column(String, primary_key=True)
+    plan = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(BigInteger, nullable=False, default=0)  # total; divide by requests
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        # Per-plan dashboards scan a time range across all users
+        Index("ix_usage_rollups_bucket", "grain", "bucket"),
+    )
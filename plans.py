@@ -0,0 +1,35 @@
+# plans.py
+# --- Plan Rules ---
+PLAN_RULES = {
+    "basic": {
+        "max_generates": 20,
+        "priority": 1,  # async job scheduling; higher runs first
+        "features": {"seo", "description", "subjects", "bullets"},
+    },
+    "pro": {
+        "max_generates": 75,
+        "priority": 2,
+        "features": {"seo", "description", "subjects", "bullets", "instagram", "tiktok"},
+    },
+    "premium": {
+        "max_generates": None,  # unlimited
+        "priority": 3,
+        "features": {"seo", "description", "subjects", "bullets", "instagram", "tiktok", "emails_full"},
+    },
+}
+
+ALL_CHANNELS = ["seo", "description", "bullets", "tiktok", "instagram", "subjects"]
+
+FREE_TRIAL_LIMIT = 3  # users on the "free" plan (no subscription yet)
+
+def plan_limit(plan: str):
+    """Monthly generate limit for a plan; None means unlimited."""
+    if plan == "free":
+        return FREE_TRIAL_LIMIT
+    rules = PLAN_RULES.get(plan)
+    return rules["max_generates"] if rules else 0
+
+def plan_priority(plan: str) -> int:
+    """Job queue priority for a plan; free trial users go last."""
+    rules = PLAN_RULES.get(plan)
+    return rules["priority"] if rules else 0
@@ -0,0 +1,105 @@
+# principal.py
+import os, time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+PRINCIPAL_TTL = float(os.getenv("PRINCIPAL_TTL", "30"))  # seconds
+PRINCIPAL_MAXSIZE = int(os.getenv("PRINCIPAL_MAXSIZE", "10000"))
+# Opt-in: embed plan claims in access tokens so read-only endpoints skip the DB
+JWT_PLAN_CLAIMS = os.getenv("JWT_PLAN_CLAIMS", "0") == "1"
+# Claims are a snapshot taken at login; ignore them once they are older than this
+PRINCIPAL_CLAIMS_MAX_AGE = int(os.getenv("PRINCIPAL_CLAIMS_MAX_AGE", "300"))
+
+@dataclass
+class Principal:
+    """What request handlers need to know about the caller, without an ORM row."""
+    id: int
+    email: str
+    plan: str
+    monthly_generates: int
+    stripe_customer_id: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            plan=user.plan,
+            monthly_generates=user.monthly_generates or 0,
+            stripe_customer_id=user.stripe_customer_id,
+        )
+
+class PrincipalCache:
+    """Size-bounded, short-TTL cache keyed on the token subject (user id).
+
+    Entries are per-process: plan/quota changes made here invalidate explicitly,
+    changes made elsewhere (other workers, cron) become visible within the TTL.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_MAXSIZE, ttl: float = PRINCIPAL_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._invalidated = OrderedDict()  # user_id -> time of last explicit change
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        item = self._data.get(user_id)
+        if item is None or item[0] < time.monotonic():
+            self._data.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return item[1]
+
+    def set(self, principal: Principal):
+        self._data[principal.id] = (time.monotonic() + self.ttl, principal)
+        self._data.move_to_end(principal.id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def bump(self, user_id: int, n: int = 1):
+        # Keep a cached counter in step with an increment we just committed
+        item = self._data.get(user_id)
+        if item is not None:
+            item[1].monthly_generates += n
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+        self._invalidated[user_id] = time.time()
+        self._invalidated.move_to_end(user_id)
+        while len(self._invalidated) > self.maxsize:
+            self._invalidated.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self._invalidated.clear()
+
+    def changed_since(self, user_id: int, ts: float) -> bool:
+        return self._invalidated.get(user_id, 0) >= ts
+
+principal_cache = PrincipalCache()
+
+# ----- Token claims -----
+def principal_claims(user) -> dict:
+    """Extra JWT claims for create_access_token (empty unless JWT_PLAN_CLAIMS)."""
+    if not JWT_PLAN_CLAIMS:
+        return {}
+    p = asdict(Principal.from_user(user))
+    p.pop("id")
+    return {"principal": p}
+
+def principal_from_claims(payload: dict) -> Optional[Principal]:
+    claims = payload.get("principal")
+    iat = payload.get("iat")
+    if not (JWT_PLAN_CLAIMS and claims and iat):
+        return None
+    if time.time() - iat > PRINCIPAL_CLAIMS_MAX_AGE:
+        return None
+    user_id = int(payload["sub"])
+    if principal_cache.changed_since(user_id, iat):
+        return None
+    return Principal(id=user_id, **claims)
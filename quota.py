@@ -0,0 +1,121 @@
+# quota.py
+import os, time
+from collections import OrderedDict
+from sqlalchemy import update, case, or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+from plans import PLAN_RULES, FREE_TRIAL_LIMIT, plan_limit
+
+QUOTA_FRONT = os.getenv("QUOTA_FRONT", "1") == "1"
+QUOTA_FRONT_TTL = float(os.getenv("QUOTA_FRONT_TTL", "60"))  # seconds before re-syncing with the DB
+QUOTA_FRONT_MAXSIZE = int(os.getenv("QUOTA_FRONT_MAXSIZE", "10000"))
+
+class QuotaExceeded(Exception):
+    def __init__(self, plan: str):
+        self.plan = plan
+        super().__init__(plan)
+
+# ----- In-memory front -----
+class QuotaFront:
+    """Per-user token buckets seeded from the remaining quota the DB reported.
+
+    The DB stays authoritative for granting quota; the front only answers "no"
+    locally once a user's bucket is empty, so repeated over-limit requests
+    never reach the database. Buckets expire after `ttl` and are dropped on
+    plan changes and resets.
+    """
+
+    def __init__(self, ttl: float = QUOTA_FRONT_TTL, maxsize: int = QUOTA_FRONT_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # user_id -> [expires, tokens, plan]
+        self.local_rejections = 0
+
+    def allow(self, user_id: int, n: int = 1) -> bool:
+        b = self._buckets.get(user_id)
+        if b is None or b[0] < time.monotonic():
+            self._buckets.pop(user_id, None)
+            return True
+        if b[1] is not None and b[1] < n:
+            self.local_rejections += 1
+            return False
+        return True
+
+    def sync(self, user_id: int, remaining, plan: str):
+        self._buckets[user_id] = [time.monotonic() + self.ttl, remaining, plan]
+        self._buckets.move_to_end(user_id)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+    def plan_of(self, user_id: int):
+        b = self._buckets.get(user_id)
+        return b[2] if b else None
+
+    def credit(self, user_id: int, n: int = 1):
+        b = self._buckets.get(user_id)
+        if b is not None and b[1] is not None:
+            b[1] += n
+
+    def invalidate(self, user_id: int):
+        self._buckets.pop(user_id, None)
+
+    def clear(self):
+        self._buckets.clear()
+
+quota_front = QuotaFront()
+
+# ----- Atomic reservation -----
+def _limit_by_plan():
+    limits = {plan: r["max_generates"] for plan, r in PLAN_RULES.items() if r["max_generates"] is not None}
+    limits["free"] = FREE_TRIAL_LIMIT
+    unlimited = [plan for plan, r in PLAN_RULES.items() if r["max_generates"] is None]
+    return limits, unlimited
+
+async def reserve(db: AsyncSession, user_id: int, plan: str, n: int = 1) -> int:
+    """Atomically take `n` generates from the user's monthly quota.
+
+    Single conditional UPDATE ... RETURNING: the limit is evaluated against the
+    row's own plan, so concurrent requests can neither overshoot nor lose
+    increments. Commits immediately so the reservation is visible to other
+    requests. Returns the new counter; raises QuotaExceeded.
+    """
+    if QUOTA_FRONT and not quota_front.allow(user_id, n):
+        raise QuotaExceeded(quota_front.plan_of(user_id) or plan)
+
+    limits, unlimited = _limit_by_plan()
+    used = func.coalesce(User.monthly_generates, 0)
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .where(or_(User.plan.in_(unlimited), used + n <= case(limits, value=User.plan, else_=-1)))
+        .values(monthly_generates=used + n)
+        .returning(User.monthly_generates, User.plan)
+    )
+    row = (await db.execute(stmt)).first()
+    await db.commit()
+
+    if row is None:
+        if QUOTA_FRONT:
+            quota_front.sync(user_id, 0, plan)
+        raise QuotaExceeded(plan)
+
+    count, db_plan = row
+    if QUOTA_FRONT:
+        limit = plan_limit(db_plan)
+        quota_front.sync(user_id, None if limit is None else limit - count, db_plan)
+    return count
+
+async def refund(db: AsyncSession, user_id: int, n: int = 1):
+    """Give back a reservation whose generation failed."""
+    if n <= 0:
+        return
+    used = func.coalesce(User.monthly_generates, 0)
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(monthly_generates=case((used >= n, used - n), else_=0))
+    )
+    await db.commit()
+    if QUOTA_FRONT:
+        quota_front.credit(user_id, n)
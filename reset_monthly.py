@@ -1,16 +1,75 @@
-from datetime import datetime
+import os
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import update, select, func, or_
 from database import SessionLocal
 from models import User
 
-def reset_all_users():
+RESET_BATCH_SIZE = int(os.getenv("RESET_BATCH_SIZE", "5000"))
+RESET_WINDOW_DAYS = int(os.getenv("RESET_WINDOW_DAYS", "30"))
+
+def _due(now: datetime, window_days: int):
+    # Users whose own monthly window has elapsed (rolling mode)
+    return or_(User.last_reset.is_(None), User.last_reset <= now - timedelta(days=window_days))
+
+def reset_users(db, batch_size: int = None, rolling: bool = False,
+                window_days: int = RESET_WINDOW_DAYS, now: datetime = None, progress=None) -> int:
+    """Reset monthly_generates without loading users into the ORM.
+
+    batch_size=None runs one bulk UPDATE. Otherwise users are updated in
+    keyset-paginated chunks of ids (one short transaction each), calling
+    progress(done, total) after every chunk. With rolling=True only users whose
+    last_reset is older than window_days are reset, so running this hourly
+    spreads resets over the month instead of all landing on the 1st.
+    """
+    now = now or datetime.utcnow()
+    where = [_due(now, window_days)] if rolling else []
+
+    if not batch_size:
+        result = db.execute(
+            update(User).where(*where).values(monthly_generates=0, last_reset=now)
+        )
+        db.commit()
+        if progress:
+            progress(result.rowcount, result.rowcount)
+        return result.rowcount
+
+    total = db.execute(select(func.count()).select_from(User).where(*where)).scalar()
+    done, last_id = 0, 0
+    while True:
+        ids = db.execute(
+            select(User.id).where(User.id > last_id, *where).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        result = db.execute(
+            update(User)
+            .where(User.id >= ids[0], User.id <= ids[-1], *where)
+            .values(monthly_generates=0, last_reset=now)
+        )
+        db.commit()
+        done += result.rowcount
+        last_id = ids[-1]
+        if progress:
+            progress(done, total)
+    return done
+
+def reset_all_users(batch_size: int = None, rolling: bool = False):
     db = SessionLocal()
-    users = db.query(User).all()
-    for user in users:
-        user.monthly_generates = 0
-        user.last_reset = datetime.utcnow()
-    db.commit()
-    db.close()
-    print("✅ All users reset for the month.")
+    try:
+        n = reset_users(
+            db, batch_size=batch_size, rolling=rolling,
+            progress=lambda done, total: print(f"… reset {done}/{total} users"),
+        )
+    finally:
+        db.close()
+    print(f"✅ {n} users reset for the month.")
 
 if __name__ == "__main__":
-    reset_all_users()
+    parser = argparse.ArgumentParser(description="Reset monthly generate counters")
+    parser.add_argument("--rolling", action="store_true",
+                        help=f"only reset users whose last reset is older than {RESET_WINDOW_DAYS} days")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help=f"update in keyset-paginated chunks (e.g. {RESET_BATCH_SIZE}) instead of one UPDATE")
+    args = parser.parse_args()
+    reset_all_users(batch_size=args.batch_size, rolling=args.rolling)
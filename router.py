@@ -0,0 +1,275 @@
+# router.py
+import os, json, time, random, asyncio, bisect
+from collections import deque
+from typing import Callable, List, Optional
+import httpx
+
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.2"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "2.0"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))   # consecutive failures
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds open before a probe
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2.0"))   # used until enough samples
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+class LLMUnavailable(RuntimeError):
+    pass
+
+class RetriableError(Exception):
+    pass
+
+# ----- Metrics -----
+class LatencyHistogram:
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+    def __init__(self, window: int = 500):
+        self.counts = [0] * len(self.BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)  # for percentiles
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def as_dict(self) -> dict:
+        return {
+            "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(self.BUCKETS, self.counts)},
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+# ----- Circuit breaker -----
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures; after `cooldown`
+    one probe request is let through (half-open) and its outcome decides."""
+
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_at = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    @property
+    def ready(self) -> bool:
+        """Whether allow() would let a request through; reading it takes no probe."""
+        state = self.state
+        if state == "closed":
+            return True
+        # An unused or hung probe expires after another cooldown
+        return state == "half_open" and (not self.probing or time.monotonic() - self.probe_at >= self.cooldown)
+
+    def allow(self) -> bool:
+        """Call only when about to send: in half-open this takes the single probe."""
+        if not self.ready:
+            return False
+        if self.state == "half_open":
+            self.probing = True
+            self.probe_at = time.monotonic()
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+# ----- Providers -----
+class Provider:
+    def __init__(self, name: str, url: str, api_key: str, model: str, timeout: float = 30.0):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.errors = {}
+
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def record_error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "timeout": self.timeout,
+            "breaker": self.breaker.state,
+            "latency": self.latency.as_dict(),
+            "errors": dict(self.errors),
+        }
+
+def load_providers(default_url: str, default_key: str, default_model: str, default_timeout: float) -> List[Provider]:
+    """LLM_PROVIDERS is a JSON list of {name, url, api_key | api_key_env, model, timeout},
+    in priority order. Without it, the single LLM_API_URL/LLM_API_KEY provider is used."""
+    raw = os.getenv("LLM_PROVIDERS")
+    if not raw:
+        if not (default_url and default_key):
+            return []
+        return [Provider("default", default_url, default_key, default_model, default_timeout)]
+    providers = []
+    for i, cfg in enumerate(json.loads(raw)):
+        key = cfg.get("api_key") or os.getenv(cfg.get("api_key_env", ""), "")
+        providers.append(Provider(
+            name=cfg.get("name", f"provider{i}"),
+            url=cfg["url"],
+            api_key=key,
+            model=cfg.get("model", default_model),
+            timeout=float(cfg.get("timeout", default_timeout)),
+        ))
+    return providers
+
+# ----- Router -----
+class Router:
+    def __init__(self, providers: List[Provider], client: Callable[[], httpx.AsyncClient],
+                 retries: int = LLM_RETRIES, hedge: bool = LLM_HEDGE):
+        self.providers = providers
+        self.client = client
+        self.retries = retries
+        self.hedge = hedge
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def available(self) -> List[Provider]:
+        # Listing is side-effect free; a half-open provider's probe is taken by acquire()
+        if not self.providers:
+            raise RuntimeError("LLM not configured")
+        candidates = [p for p in self.providers if p.breaker.ready]
+        if not candidates:
+            raise LLMUnavailable("All LLM providers are unavailable")
+        return candidates
+
+    def acquire(self, provider: Provider):
+        """Claim `provider` for one request, right before it is sent."""
+        if not provider.breaker.allow():
+            # Its half-open probe went to a concurrent request after it was listed
+            raise RetriableError(provider.name) from LLMUnavailable(f"{provider.name} is unavailable")
+
+    def first_available(self) -> Provider:
+        """The highest-priority provider that can take a request now, claimed for it."""
+        for provider in self.available():
+            if provider.breaker.allow():
+                return provider
+        raise LLMUnavailable("All LLM providers are unavailable")
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter: spreads retries from many requests hitting one outage
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    async def complete(self, payload: dict) -> dict:
+        """POST an OpenAI-style chat payload; returns the response JSON."""
+        last = None
+        for attempt in range(self.retries + 1):
+            candidates = self.available()
+            # Rotate so a retry goes to the next healthy provider
+            primary = candidates[attempt % len(candidates)]
+            backup = candidates[(attempt + 1) % len(candidates)] if len(candidates) > 1 else None
+            try:
+                if self.hedge and backup is not None:
+                    return await self._hedged(primary, backup, payload)
+                return await self._call(primary, payload)
+            except RetriableError as e:
+                last = e.__cause__ or e
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff(attempt))
+        raise last
+
+    async def _call(self, provider: Provider, payload: dict) -> dict:
+        self.acquire(provider)
+        start = time.perf_counter()
+        try:
+            r = await self.client().post(
+                provider.url,
+                headers=provider.headers(),
+                json={**payload, "model": provider.model},
+                timeout=provider.timeout,
+            )
+        except httpx.TimeoutException as e:
+            provider.record_error("timeout")
+            raise RetriableError(provider.name) from e
+        except httpx.TransportError as e:
+            provider.record_error("transport")
+            raise RetriableError(provider.name) from e
+
+        if r.status_code == 429 or r.status_code >= 500:
+            provider.record_error(f"http_{r.status_code}")
+            raise RetriableError(provider.name) from httpx.HTTPStatusError(
+                f"{provider.name} returned {r.status_code}", request=r.request, response=r
+            )
+        if r.status_code >= 400:
+            # Our request is bad; another provider or a retry will not help
+            provider.errors[f"http_{r.status_code}"] = provider.errors.get(f"http_{r.status_code}", 0) + 1
+            r.raise_for_status()
+
+        provider.latency.observe(time.perf_counter() - start)
+        provider.breaker.record_success()
+        return r.json()
+
+    def hedge_delay(self, provider: Provider) -> float:
+        if len(provider.latency.recent) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_MIN_DELAY
+        return provider.latency.percentile(LLM_HEDGE_PERCENTILE)
+
+    async def _hedged(self, primary: Provider, backup: Provider, payload: dict) -> dict:
+        """Fire `backup` if `primary` is slower than its usual tail; first answer wins."""
+        first = asyncio.ensure_future(self._call(primary, payload))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(primary))
+        if done:
+            return first.result()
+
+        self.hedges_fired += 1
+        second = asyncio.ensure_future(self._call(backup, payload))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "hedge": self.hedge,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "providers": {p.name: p.stats() for p in self.providers},
+        }
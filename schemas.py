@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, conlist, field_validator
 from typing import List, Optional, Literal
+from datetime import datetime
 
 # ----- User -----
 class UserCreate(BaseModel):
@@ -22,12 +23,53 @@ class UserOut(BaseModel):
 class GenerateIn(BaseModel):
     product_name: constr(strip_whitespace=True, min_length=2)
     voice: Optional[str] = "default"  # allow free text for premium users
+    include: Optional[List[str]] = None  # channels to focus on; defaults to all
 
 class GenerateOut(BaseModel):
-    SEO_title: str
-    description: str
-    benefit_bullets: List[str]
-    tiktok_caption: str
-    instagram_ad_caption: str
-    email_subjects: List[str]
-    keywords_used: List[str]
+    # Channels that were not requested come back empty
+    SEO_title: constr(max_length=70) = ""
+    description: constr(max_length=300) = ""
+    benefit_bullets: List[str] = []
+    tiktok_caption: constr(max_length=150) = ""
+    instagram_ad_caption: constr(max_length=2200) = ""
+    email_subjects: List[str] = []
+    keywords_used: conlist(str, max_length=10) = []
+
+    @field_validator("benefit_bullets", "email_subjects")
+    @classmethod
+    def exactly_three(cls, v):
+        if v and len(v) != 3:
+            raise ValueError("must have exactly 3 items")
+        return v
+
+# ----- Generation History -----
+class GenerationSummary(BaseModel):
+    id: int
+    product_name: str
+    voice: Optional[str] = None
+    include: List[str] = []
+    created_at: Optional[datetime] = None
+
+class GenerationPage(BaseModel):
+    items: List[GenerationSummary]
+    next_cursor: Optional[str] = None
+
+class GenerationDetail(GenerationSummary):
+    output: Optional[dict] = None
+
+class GenerationSearchHit(GenerationSummary):
+    rank: float
+
+# ----- Async Jobs -----
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,145 @@
+# search.py
+import re
+import argparse
+from sqlalchemy import text, select, DateTime
+
+from models import Generation, OutputBlob
+from codec import decode_output
+
+# ----- Schema -----
+# SQLite: FTS5 virtual table keyed by generations.id (rowid).
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+        product_name, seo_title, description, keywords, user_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+]
+
+# Postgres: weighted tsvector side table with a GIN index.
+POSTGRES_DDL = [
+    """CREATE TABLE IF NOT EXISTS generation_search (
+        generation_id INTEGER PRIMARY KEY REFERENCES generations(id) ON DELETE CASCADE,
+        user_id INTEGER,
+        document TSVECTOR NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_generation_search_document ON generation_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_generation_search_user ON generation_search (user_id)",
+]
+
+def create_search_schema(conn):
+    """Run with a sync connection (e.g. `await conn.run_sync(create_search_schema)`)."""
+    ddl = POSTGRES_DDL if conn.dialect.name == "postgresql" else SQLITE_DDL
+    for stmt in ddl:
+        conn.exec_driver_sql(stmt)
+
+# ----- Indexing -----
+SQLITE_UPSERT = text(
+    "INSERT OR REPLACE INTO generations_fts (rowid, product_name, seo_title, description, keywords, user_id) "
+    "VALUES (:id, :product_name, :seo_title, :description, :keywords, :user_id)"
+)
+
+POSTGRES_UPSERT = text(
+    "INSERT INTO generation_search (generation_id, user_id, document) VALUES (:id, :user_id, "
+    "setweight(to_tsvector('english', :product_name), 'A') || "
+    "setweight(to_tsvector('english', :seo_title), 'A') || "
+    "setweight(to_tsvector('english', :description), 'B') || "
+    "setweight(to_tsvector('english', :keywords), 'C')) "
+    "ON CONFLICT (generation_id) DO UPDATE SET user_id = EXCLUDED.user_id, document = EXCLUDED.document"
+)
+
+def _upsert(dialect: str):
+    return POSTGRES_UPSERT if dialect == "postgresql" else SQLITE_UPSERT
+
+def search_fields(gen_id: int, user_id, product_name: str, output: dict) -> dict:
+    output = output or {}
+    return {
+        "id": gen_id,
+        "user_id": user_id,
+        "product_name": product_name or "",
+        "seo_title": output.get("SEO_title") or "",
+        "description": output.get("description") or "",
+        "keywords": " ".join(output.get("keywords_used") or []),
+    }
+
+async def index_generations(db, docs: list):
+    """Index (gen_id, user_id, product_name, output) dicts inside the caller's transaction."""
+    if docs:
+        await db.execute(_upsert(db.bind.dialect.name), [search_fields(**d) for d in docs])
+
+# ----- Querying -----
+def fts5_query(q: str) -> str:
+    # Quote every term (FTS5 syntax chars in user input would otherwise error) and
+    # prefix-match the last one so results show up while the user is typing
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return ""
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+SQLITE_SEARCH = text(
+    "SELECT g.id, g.product_name, g.voice, g.include, g.created_at, "
+    "-bm25(generations_fts, 10.0, 10.0, 3.0, 1.0) AS rank "
+    "FROM generations_fts JOIN generations g ON g.id = generations_fts.rowid "
+    "WHERE generations_fts MATCH :q AND generations_fts.user_id = :user_id "
+    "ORDER BY rank DESC LIMIT :limit"
+).columns(created_at=DateTime)
+
+POSTGRES_SEARCH = text(
+    "SELECT g.id, g.product_name, g.voice, g.include, g.created_at, ts_rank(s.document, query) AS rank "
+    "FROM generation_search s JOIN generations g ON g.id = s.generation_id, "
+    "websearch_to_tsquery('english', :q) query "
+    "WHERE s.user_id = :user_id AND s.document @@ query "
+    "ORDER BY rank DESC LIMIT :limit"
+).columns(created_at=DateTime)
+
+async def search_generations(db, user_id: int, q: str, limit: int = 20):
+    """Ranked matches for one user's generations, best first."""
+    if db.bind.dialect.name == "postgresql":
+        stmt, query = POSTGRES_SEARCH, q
+    else:
+        stmt, query = SQLITE_SEARCH, fts5_query(q)
+    if not query.strip():
+        return []
+    result = await db.execute(stmt, {"q": query, "user_id": user_id, "limit": limit})
+    return result.all()
+
+# ----- Backfill -----
+def backfill(session, batch_size: int = 1000, progress=None) -> int:
+    """(Re)index every existing generation, keyset-paginated by id. Idempotent."""
+    create_search_schema(session.connection())
+    upsert = _upsert(session.bind.dialect.name)
+    done, last_id = 0, 0
+    while True:
+        rows = session.execute(
+            select(Generation.id, Generation.user_id, Generation.product_name,
+                   Generation.output_json, OutputBlob.codec, OutputBlob.data)
+            .outerjoin(OutputBlob, Generation.output_hash == OutputBlob.hash)
+            .where(Generation.id > last_id)
+            .order_by(Generation.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        session.execute(upsert, [search_fields(r.id, r.user_id, r.product_name, decode_output(r.output_json, r.codec, r.data))
+                                 for r in rows])
+        session.commit()
+        done += len(rows)
+        last_id = rows[-1].id
+        if progress:
+            progress(done)
+    return done
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Backfill the generation search index")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        n = backfill(db, batch_size=args.batch_size, progress=lambda done: print(f"… indexed {done} generations"))
+    finally:
+        db.close()
+    print(f"✅ Indexed {n} generations.")
@@ -0,0 +1,178 @@
+# similar.py
+import os, re, struct, hashlib
+import argparse
+from typing import Iterable, Optional
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Generation, OutputBlob, SimilarEntry, SimilarBand
+from codec import decode_output
+
+SIMILAR_THRESHOLD = float(os.getenv("SIMILAR_THRESHOLD", "0.75"))  # Jaccard over name trigrams
+SIMILAR_BUCKET_SCAN = int(os.getenv("SIMILAR_BUCKET_SCAN", "64"))   # newest entries read per matching bucket
+SIMILAR_CANDIDATES = int(os.getenv("SIMILAR_CANDIDATES", "16"))     # best band matches re-scored exactly
+
+# ----- MinHash -----
+# 8 bands x 4 rows: names at 0.75 similarity collide in some band ~95% of the time,
+# at 0.3 only ~6%. Changing these means rebuilding the index (python similar.py).
+BANDS, ROWS = 8, 4
+# One SHAKE-128 digest per shingle yields all BANDS*ROWS independent 32-bit hashes,
+# so the signature is an element-wise min done in C (~0.1 ms per name)
+_SIG = struct.Struct(f"<{BANDS * ROWS}I")
+
+def _hash64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+def normalize(name: str) -> str:
+    # "AquaShield Backpack – Black" and "aquashield backpack - black" are the same name
+    return " ".join(re.sub(r"[\W_]+", " ", name.lower()).split())
+
+def shingles(name: str) -> set:
+    padded = f" {normalize(name)} "
+    return {padded[i:i + 3] for i in range(max(len(padded) - 2, 1))}
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def scope(user_id: int, voice: Optional[str], include: Iterable[str]) -> str:
+    # Copy is only reused from the same user's own generations, for the same voice
+    # and the same channels (as in cache_key); other merchants never share a bucket
+    channels = sorted({ch.strip().lower() for ch in include if ch.strip()})
+    return f"{user_id}|{(voice or 'default').strip().lower()}|{','.join(channels)}"
+
+def band_keys(grams: set, scope_key: str) -> list:
+    sig = list(map(min, zip(*(_SIG.unpack(hashlib.shake_128(g.encode()).digest(_SIG.size)) for g in grams))))
+    return [
+        _hash64(f"{scope_key}|{band}|{sig[band * ROWS:(band + 1) * ROWS]}") >> 1  # fits a signed BIGINT
+        for band in range(BANDS)
+    ]
+
+# ----- Index -----
+def _insert(model, dialect_name: str):
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
+
+def index_rows(entries: list):
+    """(gen_id, user_id, product_name, voice, include, output) dicts -> (entry rows, band rows)."""
+    entry_rows, band_rows = [], []
+    for e in entries:
+        include = e.get("include") or []
+        include = include.split(",") if isinstance(include, str) else include
+        keywords = (e.get("output") or {}).get("keywords_used") or []
+        entry_rows.append({"gen_id": e["gen_id"], "name": normalize(e["product_name"]),
+                           "keywords": " ".join(k.lower() for k in keywords)})
+        for key in set(band_keys(shingles(e["product_name"]), scope(e.get("user_id"), e.get("voice"), include))):
+            band_rows.append({"band_key": key, "gen_id": e["gen_id"]})
+    return entry_rows, band_rows
+
+async def index_similar(db, entries: list):
+    """Add generations to the index inside the caller's transaction."""
+    entry_rows, band_rows = index_rows(entries)
+    if entry_rows:
+        await db.execute(_insert(SimilarEntry, db.bind.dialect.name), entry_rows)
+        await db.execute(_insert(SimilarBand, db.bind.dialect.name), band_rows)
+
+# ----- Lookup -----
+# Each bucket is an index range scan capped at its newest entries, so a popular
+# bucket (a common brand prefix) costs the same as a small one. Entries sharing
+# more bands have closer signatures; only the best few are re-scored in Python.
+CANDIDATES = text(
+    "SELECT e.gen_id, e.name, e.keywords FROM (SELECT gen_id, COUNT(*) AS bands FROM ("
+    + " UNION ALL ".join(
+        f"SELECT * FROM (SELECT gen_id FROM similar_bands WHERE band_key = :k{band} "
+        f"ORDER BY gen_id DESC LIMIT :scan) AS b{band}"
+        for band in range(BANDS)
+    )
+    + ") AS hits GROUP BY gen_id ORDER BY bands DESC, gen_id DESC LIMIT :limit) AS top "
+    "JOIN similar_entries e ON e.gen_id = top.gen_id"
+)
+
+async def find_similar(db, user_id: int, product_name: str, voice: Optional[str], include: list,
+                       threshold: float = SIMILAR_THRESHOLD):
+    """The user's closest prior generation for the same voice and channels, or None.
+
+    Returns {"gen_id", "product_name", "score", "output"}. Candidates come from
+    the LSH buckets and are re-scored exactly on name trigrams; ties go to the
+    one whose keywords share most words with the new name, then to the newest.
+    """
+    grams = shingles(product_name)
+    keys = band_keys(grams, scope(user_id, voice, include))
+    rows = (await db.execute(CANDIDATES, {
+        **{f"k{band}": key for band, key in enumerate(keys)},
+        "scan": SIMILAR_BUCKET_SCAN, "limit": SIMILAR_CANDIDATES,
+    })).all()
+    words = set(normalize(product_name).split())
+    best = None
+    for r in rows:
+        rank = (jaccard(grams, shingles(r.name)), len(words & set((r.keywords or "").split())), r.gen_id)
+        if best is None or rank > best:
+            best = rank
+    if best is None or best[0] < threshold:
+        return None
+
+    row = (await db.execute(
+        select(Generation.product_name, Generation.output_json, OutputBlob.codec, OutputBlob.data)
+        .outerjoin(OutputBlob, Generation.output_hash == OutputBlob.hash)
+        .where(Generation.id == best[2], Generation.user_id == user_id)
+    )).first()
+    if row is None:
+        return None
+    return {"gen_id": best[2], "product_name": row.product_name, "score": round(best[0], 3),
+            "output": decode_output(row.output_json, row.codec, row.data)}
+
+def adapt(output: dict, old_name: str, new_name: str) -> dict:
+    """Prior copy with the prior product name swapped for the new one."""
+    pattern = re.compile(re.escape(old_name.strip()), re.IGNORECASE)
+    new = new_name.strip()
+    def swap(value):
+        if isinstance(value, str):
+            return pattern.sub(lambda m: new, value)  # literal: names may contain "\" or "\g<0>"
+        if isinstance(value, list):
+            return [swap(v) for v in value]
+        return value
+    return {field: swap(value) for field, value in output.items()}
+
+# ----- Backfill -----
+def backfill(session, batch_size: int = 1000, progress=None) -> int:
+    """Index every existing generation, keyset-paginated by id. Idempotent."""
+    insert_entries = _insert(SimilarEntry, session.bind.dialect.name)
+    insert_bands = _insert(SimilarBand, session.bind.dialect.name)
+    done, last_id = 0, 0
+    while True:
+        rows = session.execute(
+            select(Generation.id, Generation.user_id, Generation.product_name, Generation.voice, Generation.include,
+                   Generation.output_json, OutputBlob.codec, OutputBlob.data)
+            .outerjoin(OutputBlob, Generation.output_hash == OutputBlob.hash)
+            .where(Generation.id > last_id)
+            .order_by(Generation.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        entry_rows, band_rows = index_rows([
+            {"gen_id": r.id, "user_id": r.user_id, "product_name": r.product_name, "voice": r.voice, "include": r.include or "",
+             "output": decode_output(r.output_json, r.codec, r.data)}
+            for r in rows
+        ])
+        session.execute(insert_entries, entry_rows)
+        session.execute(insert_bands, band_rows)
+        session.commit()
+        done += len(rows)
+        last_id = rows[-1].id
+        if progress:
+            progress(done)
+    return done
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Build the near-duplicate product index")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        total = backfill(db, batch_size=args.batch_size, progress=lambda done: print(f"… indexed {done} generations"))
+    finally:
+        db.close()
+    print(f"✅ Similarity index covers {total} generations.")
@@ -0,0 +1,67 @@
+# streaming.py
+import json
+
+class FieldStreamParser:
+    """Incrementally parse a streamed top-level JSON object.
+
+    `feed()` returns the (key, value) pairs whose values became complete in that
+    chunk, so each field can be sent to the client as soon as the model finishes it.
+    Anything before the first "{" (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0            # next char to scan
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.segment_start = 0  # start of the current `"key": value` segment
+        self.done = False
+        self.fields = {}
+
+    def feed(self, chunk: str):
+        self.buf += chunk
+        completed = []
+        while self.pos < len(self.buf) and not self.done:
+            c = self.buf[self.pos]
+            if not self.started:
+                if c == "{":
+                    self.started = True
+                    self.depth = 1
+                    self.segment_start = self.pos + 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "[{":
+                self.depth += 1
+            elif c in "]}":
+                self.depth -= 1
+                if self.depth == 0:
+                    completed += self._close_segment(self.pos)
+                    self.done = True
+            elif c == "," and self.depth == 1:
+                completed += self._close_segment(self.pos)
+                self.segment_start = self.pos + 1
+            self.pos += 1
+        return completed
+
+    def _close_segment(self, end: int):
+        segment = self.buf[self.segment_start:end].strip()
+        if not segment:
+            return []
+        try:
+            pair = json.loads("{" + segment + "}")
+        except json.JSONDecodeError:
+            return []  # left for full-object validation at the end
+        self.fields.update(pair)
+        return list(pair.items())
+
+def ndjson(obj) -> str:
+    return json.dumps(obj) + "\n"
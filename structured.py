@@ -0,0 +1,145 @@
+# structured.py
+import re, json
+from pydantic import ValidationError
+
+from schemas import GenerateOut
+
+try:
+    import orjson
+
+    def _loads(text: str):
+        return orjson.loads(text)
+    JSON_PARSER = "orjson"
+except ImportError:  # optional speedup
+    def _loads(text: str):
+        return json.loads(text)
+    JSON_PARSER = "json"
+
+class StructuredOutputError(ValueError):
+    pass
+
+# ----- Metrics -----
+class ParseStats:
+    def __init__(self):
+        self.parsed = 0           # clean on first try
+        self.repaired = 0         # needed repair_json
+        self.parse_failed = 0     # unrecoverable
+        self.trimmed = 0          # over-long lists cut locally
+        self.invalid_fields = 0   # fields that failed validation or were missing
+        self.reasks = 0
+        self.reask_fixed = 0
+
+    def as_dict(self) -> dict:
+        total = self.parsed + self.repaired + self.parse_failed
+        return {
+            "parser": JSON_PARSER,
+            "parsed": self.parsed,
+            "repaired": self.repaired,
+            "parse_failed": self.parse_failed,
+            "repair_rate": round(self.repaired / total, 4) if total else 0.0,
+            "failure_rate": round(self.parse_failed / total, 4) if total else 0.0,
+            "trimmed": self.trimmed,
+            "invalid_fields": self.invalid_fields,
+            "reasks": self.reasks,
+            "reask_fixed": self.reask_fixed,
+        }
+
+parse_stats = ParseStats()
+
+# ----- Parsing & repair -----
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def repair_json(text: str) -> str:
+    """Best-effort fix for the ways LLM JSON usually breaks: markdown fences,
+    prose around the object, trailing commas, and truncation mid-output."""
+    text = _FENCE.sub("", text.strip())
+    start = text.find("{")
+    if start == -1:
+        raise StructuredOutputError("No JSON object in output")
+    text = text[start:]
+
+    # Walk the text tracking open strings/brackets; cut after the top-level object
+    stack, in_string, escape, end = [], False, False, None
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                break
+
+    if end is not None:
+        text = text[:end]
+    else:
+        # Truncated: close the open string, drop a dangling key or comma, close brackets
+        if in_string:
+            text += '"'
+        if stack and stack[-1] == "}":
+            text = re.sub(r'([,{])\s*"[^"]*"\s*:?\s*$', r"\1", text)
+        text = re.sub(r'[,:]\s*$', "", text)
+        text += "".join(reversed(stack))
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+def parse_json(text: str) -> dict:
+    try:
+        data = _loads(text)
+        if isinstance(data, dict):
+            parse_stats.parsed += 1
+            return data
+    except ValueError:  # json's and orjson's decode errors both subclass it
+        pass
+    try:
+        data = _loads(repair_json(text))
+    except ValueError:
+        parse_stats.parse_failed += 1
+        raise StructuredOutputError("LLM output is not valid JSON")
+    if not isinstance(data, dict):
+        parse_stats.parse_failed += 1
+        raise StructuredOutputError("LLM output is not a JSON object")
+    parse_stats.repaired += 1
+    return data
+
+# ----- Validation -----
+LIST_LIMITS = {"benefit_bullets": 3, "email_subjects": 3, "keywords_used": 10}
+
+def validate_output(data: dict, required: list):
+    """Split `data` into (valid fields, {field: problem}) against GenerateOut.
+
+    Over-long lists are trimmed locally rather than re-asked. `required` lists
+    the keys the caller asked for; only those are reported when invalid, missing
+    or empty. Invalid keys the caller did not ask for are dropped (left empty).
+    """
+    fields = {k: v for k, v in data.items() if k in GenerateOut.model_fields}
+    for key, limit in LIST_LIMITS.items():
+        if isinstance(fields.get(key), list) and len(fields[key]) > limit:
+            fields[key] = fields[key][:limit]
+            parse_stats.trimmed += 1
+
+    invalid, dropped = {}, set()
+    try:
+        GenerateOut(**fields)
+    except ValidationError as e:
+        for err in e.errors():
+            key = err["loc"][0]
+            fields.pop(key, None)
+            if key in required:
+                invalid[key] = err["msg"]
+            else:
+                dropped.add(key)
+    for key in required:
+        if not fields.get(key) and key not in invalid:
+            invalid[key] = "missing"
+    parse_stats.invalid_fields += len(invalid) + len(dropped)
+    return fields, invalid
@@ -0,0 +1,120 @@
+# stubllm.py
+import os, re, json, math, time, random, asyncio, argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Latency spec (seconds): fixed:S | uniform:LO:HI | normal:MEAN:SD | lognormal:MEDIAN:SIGMA
+STUB_LATENCY = os.getenv("STUB_LATENCY", "lognormal:0.8:0.4")
+STUB_TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY", "0.005"))  # between streamed tokens
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))        # fraction answered with 503
+STUB_SEED = os.getenv("STUB_SEED")
+
+class Latency:
+    """Samples a delay from a spec string like "lognormal:0.8:0.4"."""
+
+    def __init__(self, spec: str, rng: random.Random = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, *args = spec.split(":")
+        args = [float(a) for a in args]
+        if kind == "fixed":
+            self._sample = lambda: args[0]
+        elif kind == "uniform":
+            self._sample = lambda: self.rng.uniform(args[0], args[1])
+        elif kind == "normal":
+            self._sample = lambda: self.rng.gauss(args[0], args[1])
+        elif kind == "lognormal":
+            # median/sigma is easier to reason about than mu/sigma
+            mu = math.log(args[0]) if args[0] > 0 else 0.0
+            self._sample = lambda: self.rng.lognormvariate(mu, args[1]) if args[0] > 0 else 0.0
+        else:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+
+    def sample(self) -> float:
+        return max(0.0, self._sample())
+
+# ----- Fake output -----
+SAMPLE = {
+    "SEO_title": "{name} — Lightweight, Durable, Ready to Go",
+    "description": "Meet {name}: built for everyday use with durable materials and a clean design that fits any routine.",
+    "benefit_bullets": ["Lightweight build for daily carry", "Durable materials that last", "Easy returns, fast support"],
+    "tiktok_caption": "{name} in action 👀 #fyp #musthave",
+    "instagram_ad_caption": "{name}: made for the way you move. Tap to shop.",
+    "email_subjects": ["{name} just landed", "Why everyone wants {name}", "Last chance: {name}"],
+    "keywords_used": ["durable", "lightweight", "everyday"],
+}
+
+def fake_output(prompt: str) -> dict:
+    """Valid GenerateOut fields for exactly the keys the prompt lists."""
+    match = re.search(r'product_name: "(.*)"', prompt)
+    name = (match.group(1) if match else "Product")[:30]
+    keys = [k for k in SAMPLE if f"- {k}" in prompt] or list(SAMPLE)
+    fill = lambda v: v.format(name=name) if isinstance(v, str) else [s.format(name=name) for s in v]
+    return {k: fill(SAMPLE[k]) for k in keys}
+
+def tokens(text: str, size: int = 4):
+    # ~4 chars per token is close enough for load shape
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+# ----- App -----
+def create_app(latency: str = STUB_LATENCY, token_delay: float = STUB_TOKEN_DELAY,
+               error_rate: float = STUB_ERROR_RATE, seed=STUB_SEED) -> FastAPI:
+    rng = random.Random(seed)
+    delay = Latency(latency, rng)
+    stub = FastAPI(title="stub-llm")
+    stub.state.requests = 0
+
+    @stub.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        stub.state.requests += 1
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse(status_code=503, content={"error": {"message": "stub overloaded"}})
+
+        prompt = body["messages"][-1]["content"]
+        content = json.dumps(fake_output(prompt), ensure_ascii=False)
+        model = body.get("model", "stub")
+        await asyncio.sleep(delay.sample())  # time to first token
+
+        if body.get("stream"):
+            async def events():
+                for tok in tokens(content):
+                    chunk = {"object": "chat.completion.chunk", "model": model,
+                             "choices": [{"index": 0, "delta": {"content": tok}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if token_delay:
+                        await asyncio.sleep(token_delay)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        completion_tokens = len(tokens(content))
+        if token_delay:
+            await asyncio.sleep(token_delay * completion_tokens)
+        return {
+            "id": f"stub-{stub.state.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(tokens(prompt)), "completion_tokens": completion_tokens},
+        }
+
+    return stub
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default=STUB_LATENCY)
+    parser.add_argument("--token-delay", type=float, default=STUB_TOKEN_DELAY)
+    parser.add_argument("--error-rate", type=float, default=STUB_ERROR_RATE)
+    parser.add_argument("--seed", default=STUB_SEED)
+    args = parser.parse_args()
+
+    print(f"🤖 Stub LLM on http://{args.host}:{args.port}/v1/chat/completions (latency {args.latency})")
+    uvicorn.run(create_app(args.latency, args.token_delay, args.error_rate, args.seed),
+                host=args.host, port=args.port, log_level="warning")
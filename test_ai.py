@@ -0,0 +1,99 @@
+# test_ai.py
+import asyncio, json
+import httpx
+import ai
+from router import Router, Provider
+
+def _mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+def _reply(content: dict):
+    return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(content)}}]})
+
+VALID = {
+    "SEO_title": "t",
+    "description": "d",
+    "benefit_bullets": ["a", "b", "c"],
+    "tiktok_caption": "c",
+    "instagram_ad_caption": "i",
+    "email_subjects": ["x", "y", "z"],
+    "keywords_used": ["k"],
+}
+
+def _fields_for(prompt: str) -> dict:
+    # A well-behaved model: exactly the keys the prompt lists
+    return {k: v for k, v in VALID.items() if f"- {k}" in prompt}
+
+def _configure(monkeypatch, client):
+    provider = Provider("stub", "http://llm.local/v1/chat/completions", "test", ai.MODEL)
+    monkeypatch.setattr(ai, "router", Router([provider], client=ai.get_client))
+    monkeypatch.setattr(ai, "_client", client)
+
+def test_call_llm_reuses_shared_client(monkeypatch):
+    seen = []
+    def handler(request):
+        body = json.loads(request.content)
+        seen.append(body["model"])
+        return _reply(_fields_for(body["messages"][1]["content"]))
+
+    client = _mock_client(handler)
+    _configure(monkeypatch, client)
+
+    async def run():
+        a = await ai.call_llm("AquaShield Backpack")
+        b = await ai.call_llm("AquaShield Backpack", include=["seo"])
+        return a, b
+
+    a, b = asyncio.run(run())
+    assert a == VALID
+    assert b == {"SEO_title": "t", "keywords_used": ["k"]}
+    assert len(seen) == 2
+    assert ai.get_client() is client
+
+def test_call_llm_respects_concurrency_cap(monkeypatch):
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return _reply(VALID)
+
+    _configure(monkeypatch, _mock_client(handler))
+
+    async def run():
+        monkeypatch.setattr(ai, "_semaphore", asyncio.Semaphore(3))
+        await asyncio.gather(*(ai.call_llm(f"Product {i}") for i in range(12)))
+
+    asyncio.run(run())
+    assert peak == 3
+
+def test_minimal_prompt_only_asks_for_requested_channels(monkeypatch):
+    bodies = []
+
+    def handler(request):
+        body = json.loads(request.content)
+        bodies.append(body)
+        return _reply(_fields_for(body["messages"][1]["content"]))
+
+    _configure(monkeypatch, _mock_client(handler))
+    monkeypatch.setattr(ai, "CHANNEL_MODE", "minimal")
+
+    result = asyncio.run(ai.call_llm("AquaShield Backpack", include=["seo"]))
+    prompt = bodies[-1]["messages"][1]["content"]
+    assert "instagram_ad_caption" not in prompt and "SEO_title" in prompt
+    assert bodies[-1]["max_tokens"] < 200
+    assert result == {"SEO_title": "t", "keywords_used": ["k"]}
+
+    # every channel requested -> the full prompt, no output cap
+    asyncio.run(ai.call_llm("AquaShield Backpack", include=list(ai.CHANNEL_FIELDS)))
+    assert "max_tokens" not in bodies[-1]
+
+    monkeypatch.setattr(ai, "CHANNEL_MODE", "parallel")
+    bodies.clear()
+    result = asyncio.run(ai.call_llm("AquaShield Backpack", include=["tiktok", "seo"]))
+    assert len(bodies) == 2
+    assert result == {"SEO_title": "t", "tiktok_caption": "c", "keywords_used": ["k"]}
@@ -0,0 +1,452 @@
+# test_app.py
+import asyncio, time, uuid
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+from app import app
+from principal import principal_cache
+from quota import quota_front
+import metrics
+
+OPS = {"Authorization": "Bearer ops-test"}
+
+def payload(name):
+    return {
+        "SEO_title": f"{name} — Lightweight Travel",
+        "description": f"Discover {name}.",
+        "benefit_bullets": ["Light", "Durable", "Waterproof"],
+        "tiktok_caption": f"{name} in action",
+        "instagram_ad_caption": f"{name}: built for travel.",
+        "email_subjects": ["New", "Trending", "Limited"],
+        "keywords_used": ["travel", "bags"],
+    }
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    async def fake_llm(name, include=None, voice="default"):
+        calls.append(name)
+        if name.startswith("Broken"):
+            raise RuntimeError("LLM down")
+        return payload(name)
+
+    monkeypatch.setattr(app_module, "call_llm", fake_llm)
+    principal_cache.clear()
+    quota_front.clear()
+    with TestClient(app) as c:
+        c.llm_calls = calls
+        yield c
+
+def flush_writes(client):
+    # Generation rows are written behind the request; wait for the queue to drain
+    client.portal.call(app_module.writer.flush)
+
+def signup_and_login(client):
+    email = f"{uuid.uuid4().hex[:8]}@shop.com"
+    assert client.post("/signup", json={"email": email, "password": "s3cret!"}).status_code == 200
+    r = client.post("/login", json={"email": email, "password": "s3cret!"})
+    assert r.status_code == 200
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+def test_signup_login_me(client):
+    headers = signup_and_login(client)
+    me = client.get("/me", headers=headers).json()
+    assert me["plan"] == "free" and me["monthly_generates"] == 0
+    assert client.post("/login", json={"email": "nobody@shop.com", "password": "x"}).status_code == 401
+
+def test_ready_reports_warm_up(client):
+    for _ in range(200):
+        r = client.get("/ready")
+        if r.status_code == 200:
+            break
+        time.sleep(0.01)
+    body = r.json()
+    assert r.status_code == 200 and body["database"] and body["cache_warm"]
+    assert body["schema"]["current"] == body["schema"]["head"]
+
+def test_heavy_sdks_load_lazily():
+    import subprocess, sys
+    probe = "import sys, app; print([m for m in ('stripe', 'openai', 'passlib', 'alembic') if m in sys.modules])"
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+def test_generate_reserves_quota_and_refunds_failures(client):
+    headers = signup_and_login(client)
+    name = f"AquaShield {uuid.uuid4().hex[:6]}"
+
+    r = client.post("/generate", json={"product_name": name}, headers=headers)
+    assert r.status_code == 200 and r.headers["X-Cache"] == "MISS"
+    r = client.post("/generate", json={"product_name": name}, headers=headers)
+    assert r.headers["X-Cache"] == "HIT"
+    assert client.llm_calls.count(name) == 1
+
+    with pytest.raises(RuntimeError):
+        client.post("/generate", json={"product_name": "Broken Thing"}, headers=headers)
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 2
+
+    assert client.post("/generate", json={"product_name": "Trail Bottle"}, headers=headers).status_code == 200
+    r = client.post("/generate", json={"product_name": "One Too Many"}, headers=headers)
+    assert r.status_code == 403 and "Free trial" in r.json()["detail"]
+
+def test_generate_reuses_similar_product_copy(client):
+    headers = signup_and_login(client)
+    tag = uuid.uuid4().hex[:6]
+    black, blue = f"AquaShield Weekender {tag} – Black", f"AquaShield Weekender {tag} - Blue"
+    assert client.post("/generate", json={"product_name": black}, headers=headers).status_code == 200
+    flush_writes(client)
+
+    r = client.post("/generate", params={"reuse_similar": "true"}, json={"product_name": blue}, headers=headers)
+    assert r.status_code == 200 and r.headers["X-Cache"] == "SIMILAR"
+    assert float(r.headers["X-Similarity"]) >= 0.75 and r.headers["X-Similar-To"]
+    assert r.json()["SEO_title"].startswith(blue) and blue not in client.llm_calls
+    # Another merchant never gets this user's copy
+    other = signup_and_login(client)
+    r = client.post("/generate", params={"reuse_similar": "true"}, json={"product_name": black}, headers=other)
+    assert r.headers["X-Cache"] != "SIMILAR" and "X-Similar-To" not in r.headers
+    # Streamed and queued requests cannot reuse copy
+    for mode in ("stream", "async"):
+        r = client.post("/generate", params={"reuse_similar": "true", mode: "true"}, json={"product_name": blue}, headers=headers)
+        assert r.status_code == 422
+    # Without opting in the same request goes to the model
+    r = client.post("/generate", json={"product_name": blue}, headers=headers)
+    assert r.headers["X-Cache"] == "MISS"
+
+def test_batch_streams_ndjson_and_charges_successes(client):
+    headers = signup_and_login(client)
+    r = client.post(
+        "/generate/batch",
+        content="product_name\nBatch Alpha\nBroken Beta\n",
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    lines = [l for l in r.text.splitlines() if l]
+    assert len(lines) == 3 and '"done": true' in lines[-1]
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 1
+
+def test_batch_disconnect_saves_finished_items_and_refunds_the_rest(client, monkeypatch):
+    import json
+    from starlette.requests import Request
+    from database import AsyncSessionLocal
+    from principal import Principal
+
+    headers = signup_and_login(client)
+    me = client.get("/me", headers=headers).json()
+    user = Principal(id=me["id"], email=me["email"], plan=me["plan"], monthly_generates=0)
+
+    async def slow_llm(name, include=None, voice="default"):
+        await asyncio.sleep(0 if name.startswith("Fast") else 5)
+        return payload(name)
+    monkeypatch.setattr(app_module, "call_llm", slow_llm)
+
+    async def disconnect_after_first_line():
+        body = json.dumps([{"product_name": n} for n in ("Fast Lamp", "Slow Lamp", "Slow Chair")]).encode()
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+        request = Request({"type": "http", "method": "POST", "path": "/generate/batch", "query_string": b"",
+                           "headers": [(b"content-type", b"application/json")]}, receive)
+        async with AsyncSessionLocal() as db:
+            response = await app_module.generate_batch(request, current_user=user, db=db)
+        first = await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()  # what the server does when the client goes away
+        await asyncio.gather(*app_module.settling)
+        return json.loads(first)
+
+    assert client.portal.call(disconnect_after_first_line)["product_name"] == "Fast Lamp"
+    principal_cache.clear()
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 1
+    items = client.get("/generations", headers=headers).json()["items"]
+    assert [i["product_name"] for i in items] == ["Fast Lamp"]
+
+def test_stream_disconnect_refunds_and_meters_the_request(client, monkeypatch):
+    import json
+    from fastapi import Response
+    from database import AsyncSessionLocal
+    from principal import Principal
+    from schemas import GenerateIn
+
+    headers = signup_and_login(client)
+    me = client.get("/me", headers=headers).json()
+    user = Principal(id=me["id"], email=me["email"], plan=me["plan"], monthly_generates=0)
+    name = f"Half Lamp {uuid.uuid4().hex[:6]}"
+
+    async def stalled_llm(name, include=None, voice="default"):
+        yield json.dumps({"SEO_title": name})[:-1] + ", "
+        await asyncio.sleep(5)
+        yield '"description": "never sent"}'
+    monkeypatch.setattr(app_module, "stream_llm", stalled_llm)
+
+    async def disconnect_after_first_line():
+        async with AsyncSessionLocal() as db:
+            response = await app_module.generate_copy(
+                GenerateIn(product_name=name), Response(), stream=True, async_job=False, callback_url=None,
+                reuse_similar=False, similarity=0.75, current_user=user, db=db)
+            assert user.monthly_generates == 1
+        first = await response.body_iterator.__anext__()
+        await response.body_iterator.aclose()  # what the server does when the client goes away
+        await asyncio.gather(*app_module.settling)
+        return json.loads(first)
+
+    assert client.portal.call(disconnect_after_first_line) == {"field": "SEO_title", "value": name}
+    flush_writes(client)
+    principal_cache.clear()
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 0
+    assert client.get("/generations", headers=headers).json()["items"] == []
+    totals = client.get("/usage", headers=headers).json()["totals"]
+    assert (totals["requests"], totals["units"], totals["errors"]) == (1, 0, 1)
+
+def test_full_write_queue_refunds_instead_of_losing_the_unit(client):
+    writer = app_module.writer
+    headers = signup_and_login(client)
+
+    async def jam():
+        # A queue of one that the flusher is not reading, already full
+        queue = asyncio.Queue(maxsize=1)
+        queue.put_nowait(("usage", None))
+        return queue
+
+    saved = writer._queue, writer.block_timeout
+    writer._queue, writer.block_timeout = client.portal.call(jam), 0.05
+    try:
+        r = client.post("/generate", json={"product_name": "Jammed Lamp"}, headers=headers)
+    finally:
+        writer._queue, writer.block_timeout = saved
+    assert r.status_code == 503 and r.headers["Retry-After"] == "5"
+    flush_writes(client)
+    principal_cache.clear()
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 0
+    assert client.get("/generations", headers=headers).json()["items"] == []
+    totals = client.get("/usage", headers=headers).json()["totals"]
+    assert (totals["requests"], totals["units"], totals["errors"]) == (1, 0, 1)
+
+def test_stats_need_the_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", None)
+    assert client.get("/db/stats", headers=OPS).status_code == 401  # closed when unconfigured
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "ops-test")
+    for path in ("/auth/stats", "/db/stats", "/llm/stats", "/cache/stats", "/metrics"):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get(path, headers=OPS).status_code == 200
+
+def test_db_stats_reports_pool(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "ops-test")
+    stats = client.get("/db/stats", headers=OPS).json()
+    assert stats["checkouts"] > 0 and "avg_wait_ms" in stats
+
+def test_generation_history_keyset_pagination(client):
+    headers = signup_and_login(client)
+    other = signup_and_login(client)
+    client.post("/generate", json={"product_name": "Someone Else"}, headers=other)
+    client.post(
+        "/generate/batch",
+        json=[{"product_name": "Hist One", "include": ["seo"]}, {"product_name": "Hist Two"}],
+        headers=headers,
+    ).read()
+    client.post("/generate", json={"product_name": "Hist Three", "voice": "luxury"}, headers=headers)
+    flush_writes(client)
+
+    seen, cursor = [], None
+    while True:
+        page = client.get("/generations", params={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=headers).json()
+        assert all("output" not in item for item in page["items"])
+        seen += [item["product_name"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen[0] == "Hist Three" and sorted(seen) == ["Hist One", "Hist Three", "Hist Two"]
+
+    lux = client.get("/generations", params={"voice": "luxury"}, headers=headers).json()["items"]
+    assert [i["product_name"] for i in lux] == ["Hist Three"]
+    seo_only = client.get("/generations", params={"channel": "tiktok"}, headers=headers).json()["items"]
+    assert "Hist One" not in [i["product_name"] for i in seo_only]
+
+    detail = client.get(f"/generations/{lux[0]['id']}", headers=headers).json()
+    assert detail["output"]["SEO_title"].startswith("Hist Three")
+    assert client.get(f"/generations/{lux[0]['id']}", headers=other).status_code == 404
+    assert client.get("/generations", params={"cursor": "!!"}, headers=headers).status_code == 400
+
+def test_search_ranks_own_generations_and_backfill_is_idempotent(client):
+    from database import SessionLocal
+    from search import backfill, fts5_query
+
+    headers = signup_and_login(client)
+    other = signup_and_login(client)
+    client.post("/generate", json={"product_name": "Searchable Waterproof Kayak"}, headers=headers)
+    client.post("/generate/batch", json=[{"product_name": "Searchable Desk Lamp"}], headers=headers).read()
+    client.post("/generate", json={"product_name": "Searchable Waterproof Tent"}, headers=other)
+    flush_writes(client)
+
+    hits = client.get("/generations/search", params={"q": "waterproof kay"}, headers=headers).json()
+    assert [h["product_name"] for h in hits] == ["Searchable Waterproof Kayak"]
+    hits = client.get("/generations/search", params={"q": "searchable"}, headers=headers).json()
+    assert sorted(h["product_name"] for h in hits) == ["Searchable Desk Lamp", "Searchable Waterproof Kayak"]
+    assert client.get("/generations/search", params={"q": '"(*'}, headers=headers).json() == []
+
+    assert fts5_query('aqua "shield') == '"aqua" "shield"*'
+    db = SessionLocal()
+    try:
+        assert backfill(db, batch_size=2) == backfill(db, batch_size=50) > 0
+    finally:
+        db.close()
+    hits = client.get("/generations/search", params={"q": "searchable"}, headers=headers).json()
+    assert len(hits) == 2
+
+def test_usage_reports_rollups_per_user_and_plan(client, monkeypatch):
+    headers = signup_and_login(client)
+    name = f"Usage Lamp {uuid.uuid4().hex[:6]}"
+    client.post("/generate", json={"product_name": name}, headers=headers)
+    client.post("/generate", json={"product_name": name}, headers=headers)
+    with pytest.raises(RuntimeError):
+        client.post("/generate", json={"product_name": "Broken Usage"}, headers=headers)
+    flush_writes(client)
+
+    usage = client.get("/usage", headers=headers).json()
+    totals = usage["totals"]
+    assert (totals["requests"], totals["units"], totals["errors"], totals["cache_hits"]) == (3, 2, 1, 1)
+    assert usage["quota"]["used"] == 2 and usage["quota"]["month_to_date"]["units"] == 2
+    assert [(s["kind"], s["requests"]) for s in usage["series"]] == [("generate", 3)]
+    hourly = client.get("/usage", params={"grain": "hour", "days": 1}, headers=headers).json()
+    assert sum(s["requests"] for s in hourly["series"]) == 3
+
+    monkeypatch.setenv("ADMIN_SECRET", "admin-test")
+    assert client.get("/admin/usage", headers={"x-api-key": "wrong"}).status_code == 401
+    summary = client.get("/admin/usage", headers={"x-api-key": "admin-test"}).json()
+    free = next(p for p in summary["plans"] if p["plan"] == "free")
+    assert free["requests"] >= 3 and free["errors"] >= 1
+
+def test_export_streams_gzipped_shopify_csv(client):
+    import csv, gzip, io, json
+
+    headers = signup_and_login(client)
+    other = signup_and_login(client)
+    client.post("/generate", json={"product_name": "Export Trail Bottle"}, headers=headers)
+    client.post("/generate", json={"product_name": "Export Desk Lamp", "voice": "luxury"}, headers=headers)
+    client.post("/generate", json={"product_name": "Export Other Shop"}, headers=other)
+    flush_writes(client)
+
+    r = client.get("/generations/export", params={"format": "shopify", "gzip": "true"}, headers=headers)
+    assert r.status_code == 200 and r.headers["content-type"] == "application/gzip"
+    assert "generations-shopify.csv.gz" in r.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(r.content).decode())))
+    assert [row["Handle"] for row in rows] == ["export-trail-bottle", "export-desk-lamp"]
+
+    r = client.get("/generations/export", params={"format": "jsonl", "voice": "luxury"}, headers=headers)
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["product_name"] for line in r.text.splitlines()] == ["Export Desk Lamp"]
+    assert client.get("/generations/export", params={"format": "xml"}, headers=headers).status_code == 422
+
+def test_metrics_endpoint_reports_routes_stages_and_rejections(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "ops-test")
+    headers = signup_and_login(client)
+    for i in range(4):
+        client.post("/generate", json={"product_name": f"Metered {uuid.uuid4().hex[:6]}"}, headers=headers)
+    client.get("/generations/12345", headers=headers)
+
+    text = client.get("/metrics", headers=OPS).text
+    assert 'http_requests_total{method="POST",route="/generate",status="200"}' in text
+    assert 'route="/generations/{gen_id}",status="404"' in text  # template, not the raw path
+    assert 'stage_duration_seconds_count{stage="auth.jwt"}' in text
+    assert 'stage_duration_seconds_count{stage="quota"}' in text
+    assert 'quota_rejections_total{plan="free",reason="quota"}' in text
+    assert "write_behind_queued" in text
+
+def post_webhook(client, event, secret="whsec_test"):
+    import hashlib, hmac, json, time
+    body = json.dumps(event).encode()
+    ts = int(time.time())
+    sig = hmac.new(secret.encode(), f"{ts}.".encode() + body, hashlib.sha256).hexdigest()
+    return client.post("/webhook", content=body, headers={"stripe-signature": f"t={ts},v1={sig}"})
+
+def test_webhook_dedupes_and_applies_in_order_per_customer(client, monkeypatch):
+    monkeypatch.setattr(app_module, "WEBHOOK_SECRET", "whsec_test")
+    headers = signup_and_login(client)
+    me = client.get("/me", headers=headers).json()
+    customer = f"cus_{uuid.uuid4().hex[:10]}"
+    checkout = {
+        "id": f"evt_{uuid.uuid4().hex}", "type": "checkout.session.completed", "created": 100,
+        "data": {"object": {"customer": customer, "customer_email": me["email"],
+                            "client_reference_id": str(me["id"]), "metadata": {"plan": "pro"}}},
+    }
+    cancelled = {
+        "id": f"evt_{uuid.uuid4().hex}", "type": "customer.subscription.deleted", "created": 200,
+        "data": {"object": {"customer": customer}},
+    }
+    assert post_webhook(client, checkout, secret="wrong").status_code == 400
+
+    # Delivered out of order within one poll: applied by Stripe's created time
+    monkeypatch.setattr(app_module.webhook_worker, "notify", lambda: None)
+    assert post_webhook(client, cancelled).json() == {"status": "success"}
+    assert post_webhook(client, checkout).json() == {"status": "success"}
+    client.portal.call(app_module.webhook_worker.drain)
+    assert client.get("/me", headers=headers).json()["plan"] == "basic"
+
+    # A retried delivery is acknowledged but not re-applied (no second quota reset)
+    r = client.post("/generate", json={"product_name": f"Hooked {uuid.uuid4().hex[:6]}", "include": ["seo"]}, headers=headers)
+    assert r.status_code == 200
+    assert post_webhook(client, checkout).json() == {"status": "duplicate"}
+    client.portal.call(app_module.webhook_worker.drain)
+    me = client.get("/me", headers=headers).json()
+    assert me["plan"] == "basic" and me["monthly_generates"] == 1
+
+    # Later events find the user through the indexed customer id alone
+    upgrade = {
+        "id": f"evt_{uuid.uuid4().hex}", "type": "checkout.session.completed", "created": 300,
+        "data": {"object": {"customer": customer, "metadata": {"plan": "premium"}}},
+    }
+    post_webhook(client, upgrade)
+    client.portal.call(app_module.webhook_worker.drain)
+    assert client.get("/me", headers=headers).json()["plan"] == "premium"
+
+def test_webhook_workers_in_two_processes_apply_each_event_once(client, monkeypatch):
+    import webhooks
+    from database import AsyncSessionLocal
+    from webhooks import WebhookWorker, record_event
+
+    applied = []
+
+    async def slow_handler(db, obj):
+        applied.append(obj["n"])
+        await asyncio.sleep(0.01)  # widen the window for a second worker to grab the same row
+    monkeypatch.setitem(webhooks.HANDLERS, "test.counted", slow_handler)
+
+    async def run():
+        customer = f"cus_{uuid.uuid4().hex[:10]}"
+        async with AsyncSessionLocal() as db:
+            for n in range(5):
+                await record_event(db, {"id": f"evt_{uuid.uuid4().hex}", "type": "test.counted", "created": n,
+                                        "data": {"object": {"customer": customer, "n": n}}})
+        # Two workers standing in for two uvicorn processes
+        workers = [WebhookWorker(AsyncSessionLocal) for _ in range(2)]
+        await asyncio.gather(*(w.drain() for w in workers))
+        await workers[0].drain()  # picks up anything skipped while the other was busy
+
+    client.portal.call(run)
+    assert applied == [0, 1, 2, 3, 4]
+
+def wait_for_job(client, job_id, headers):
+    import time
+    for _ in range(200):
+        job = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_async_generate_returns_job_and_refunds_failures(client):
+    headers = signup_and_login(client)
+    name = f"Queued {uuid.uuid4().hex[:6]}"
+    r = client.post("/generate", params={"async": "true"}, json={"product_name": name}, headers=headers)
+    assert r.status_code == 202
+    job = wait_for_job(client, r.json()["job_id"], headers)
+    assert job["status"] == "done" and job["result"]["SEO_title"].startswith(name)
+    assert client.get(f"/jobs/{job['id']}", headers=signup_and_login(client)).status_code == 404
+
+    r = client.post("/generate", params={"async": "true"}, json={"product_name": "Broken Queue"}, headers=headers)
+    job = wait_for_job(client, r.json()["job_id"], headers)
+    assert job["status"] == "failed" and "LLM down" in job["error"]
+    assert client.get("/me", headers=headers).json()["monthly_generates"] == 1
+
+    for callback in ["ftp://x", "http://127.0.0.1:8000/admin/usage", "http://169.254.169.254/latest/meta-data/"]:
+        r = client.post("/generate", params={"async": "true", "callback_url": callback},
+                        json={"product_name": name}, headers=headers)
+        assert r.status_code == 400
@@ -0,0 +1,46 @@
+# test_batch.py
+import asyncio, json
+import pytest
+from fastapi import HTTPException
+from batch import parse_csv, parse_jsonl, parse_json, run_batch, batch_line
+
+def test_parse_csv_and_jsonl():
+    items = parse_csv("product_name,voice,include\nAquaShield Backpack,luxury,seo;tiktok\nTrail Bottle,,\n")
+    assert [i.product_name for i in items] == ["AquaShield Backpack", "Trail Bottle"]
+    assert items[0].include == ["seo", "tiktok"]
+    assert items[1].voice == "default" and items[1].include is None
+
+    items = parse_jsonl('{"product_name": "AquaShield Backpack"}\n\n{"product_name": "Trail Bottle", "voice": "minimal"}\n')
+    assert len(items) == 2 and items[1].voice == "minimal"
+
+    assert len(parse_json({"items": [{"product_name": "AquaShield Backpack"}]})) == 1
+
+def test_parse_reports_bad_item():
+    with pytest.raises(HTTPException) as e:
+        parse_jsonl('{"product_name": "AquaShield Backpack"}\n{"product_name": "X"}\n')
+    assert e.value.status_code == 422 and "Item 2" in e.value.detail
+
+def test_run_batch_is_bounded_and_streams_errors():
+    in_flight = peak = 0
+
+    async def generate(name, voice, include):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+        if name == "Broken Item":
+            raise RuntimeError("LLM failed")
+        return {"SEO_title": name, "include": include}, False
+
+    items = parse_json([{"product_name": f"Product {i}"} for i in range(10)] + [{"product_name": "Broken Item"}])
+
+    async def run():
+        return [r async for r in run_batch(items, generate, ["seo"], concurrency=3)]
+
+    results = asyncio.run(run())
+    assert peak == 3
+    assert sorted(r[0] for r in results) == list(range(11))
+    errors = [r for r in results if r[3] is not None]
+    assert len(errors) == 1 and errors[0][3] == "LLM failed"
+    assert json.loads(batch_line(errors[0][0], errors[0][1], error=errors[0][3]))["ok"] is False
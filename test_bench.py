@@ -0,0 +1,63 @@
+# test_bench.py
+import asyncio, json
+import httpx
+import ai
+import app as app_module
+import bench
+import stubllm
+from schemas import GenerateOut
+
+def test_stub_llm_answers_requested_fields_and_streams():
+    stub = stubllm.create_app(latency="fixed:0", token_delay=0, seed=1)
+    prompt = ai.build_channel_payload("AquaShield Backpack", ["seo", "bullets"])["messages"][1]["content"]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://stub") as c:
+            body = {"model": "m", "messages": [{"role": "user", "content": prompt}]}
+            plain = (await c.post("/v1/chat/completions", json=body)).json()
+            streamed = ""
+            async with c.stream("POST", "/v1/chat/completions", json={**body, "stream": True}) as r:
+                async for line in r.aiter_lines():
+                    if line.startswith("data:") and "[DONE]" not in line:
+                        streamed += json.loads(line[5:])["choices"][0]["delta"]["content"]
+            return plain, streamed
+
+    plain, streamed = asyncio.run(run())
+    content = plain["choices"][0]["message"]["content"]
+    assert content == streamed
+    out = json.loads(content)
+    assert set(out) == {"SEO_title", "benefit_bullets", "keywords_used"}
+    GenerateOut(**out)
+
+def test_latency_distributions():
+    assert stubllm.Latency("fixed:0.5").sample() == 0.5
+    samples = [stubllm.Latency("uniform:0.1:0.2").sample() for _ in range(50)]
+    assert all(0.1 <= s <= 0.2 for s in samples)
+    assert stubllm.Latency("lognormal:0.8:0.4").sample() > 0
+
+def test_bench_run_reports_latency_and_query_counts(monkeypatch):
+    # run_bench swaps these for the stub; put them back afterwards
+    monkeypatch.setattr(ai, "router", ai.router)
+    monkeypatch.setattr(ai, "_client", ai._client)
+    monkeypatch.setattr(app_module, "WEBHOOK_SECRET", None)
+
+    requests = {"login_storm": 5, "me": 10, "generation_burst": 5, "batch_catalog": 1}
+    results = asyncio.run(bench.run_bench(
+        users=30, requests=requests, concurrency=4, stub_latency="fixed:0", stub_token_delay=0,
+        scenarios=["login_storm", "me", "generation_burst", "batch_catalog"],
+    ))
+    json.dumps(results)  # machine-readable as-is
+    scenarios = results["scenarios"]
+    assert set(scenarios) == {"login_storm", "me", "generation_burst", "batch_catalog"}
+    for name, r in scenarios.items():
+        assert r["requests"] == requests[name] and r["errors"] == 0, (name, r["status"])
+        assert r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"]
+        assert r["queries_per_request"] > 0
+    assert results["meta"]["database"] == "sqlite"
+
+def test_compare_flags_regressions():
+    base = {"scenarios": {"me": {"p95_ms": 10.0, "rps": 1000, "queries_per_request": 1.0, "errors": 0}}}
+    same = {"scenarios": {"me": {"p95_ms": 11.0, "rps": 950, "queries_per_request": 1.0, "errors": 0}}}
+    worse = {"scenarios": {"me": {"p95_ms": 20.0, "rps": 500, "queries_per_request": 2.0, "errors": 3}}}
+    assert bench.compare(base, same) == []
+    assert len(bench.compare(base, worse)) == 4
@@ -0,0 +1,66 @@
+# test_blobstore.py
+import asyncio, json
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import Session
+from database import AsyncSessionLocal, engine, Base, migrate
+from models import Generation, OutputBlob
+from blobstore import backfill
+from search import create_search_schema
+from crud import bulk_create_generations, get_generation
+from codec import canonical_json, content_hash, compress, decompress
+
+OUT = {"SEO_title": "Mug", "description": "A sturdy ceramic mug. " * 10, "bullets": ["a", "b", "c"]}
+
+def test_codec_roundtrip_is_canonical():
+    assert canonical_json({"b": 1, "a": 2}) == canonical_json({"a": 2, "b": 1})
+    raw = canonical_json(OUT)
+    blob = compress(raw, "zlib")
+    assert len(blob) < len(raw)
+    assert decompress("zlib", blob) == OUT
+
+def test_backfill_upgrades_legacy_table_and_dedupes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    eng = create_engine(url)
+    with eng.begin() as conn:
+        # Table as created before output_hash existed
+        conn.exec_driver_sql("CREATE TABLE generations (id INTEGER PRIMARY KEY, user_id INTEGER, product_name VARCHAR NOT NULL, "
+                             "voice VARCHAR, include VARCHAR, output JSON, created_at DATETIME)")
+        OutputBlob.__table__.create(conn)
+        for i in range(6):
+            out = OUT if i % 2 else {**OUT, "SEO_title": f"Mug {i}"}
+            conn.exec_driver_sql("INSERT INTO generations (product_name, voice, include, output) VALUES (?, 'default', 'seo', ?)",
+                                 (f"p{i}", json.dumps(out)))
+
+    with Session(eng) as session:
+        dry = backfill(session, batch_size=4, dry_run=True)
+        assert dry["rows"] == 6 and dry["blobs_created"] == 4 and dry["deduplicated"] == 2
+    migrate(url=url)
+    with Session(eng) as session:
+        stats = backfill(session, batch_size=4)
+        assert stats == {**dry}
+        assert stats["blob_bytes"] < stats["inline_bytes"]
+        assert session.scalar(select(func.count()).select_from(OutputBlob)) == 4
+        assert backfill(session)["rows"] == 0  # idempotent
+        gen = session.get(Generation, 2)
+        assert gen.output_json is None and gen.output_hash == content_hash(canonical_json(OUT))
+        assert gen.output == OUT
+
+def test_bulk_create_stores_each_output_once():
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(create_search_schema)
+        rows = [{"user_id": 4242, "product_name": f"dup-{i}", "voice": "default", "include": "seo", "output": OUT}
+                for i in range(3)]
+        async with AsyncSessionLocal() as db:
+            await bulk_create_generations(db, rows)
+            await db.commit()
+            digest = content_hash(canonical_json(OUT))
+            blobs = (await db.execute(select(func.count()).select_from(OutputBlob).where(OutputBlob.hash == digest))).scalar()
+            gen_id = (await db.execute(select(Generation.id).where(Generation.product_name == "dup-1"))).scalar()
+            gen = await get_generation(db, 4242, gen_id)
+            return blobs, gen.output_json, gen.output
+
+    blobs, inline, output = asyncio.run(run())
+    assert blobs == 1
+    assert inline is None and output == OUT
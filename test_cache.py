@@ -0,0 +1,39 @@
+# test_cache.py
+import asyncio
+from cache import cache_key, MemoryBackend, GenerationCache
+
+def test_cache_key_normalizes_inputs():
+    a = cache_key("AquaShield  Backpack", "Luxury", ["seo", "tiktok"])
+    b = cache_key(" aquashield backpack ", "luxury", ["tiktok", "seo", "seo"])
+    assert a == b
+    assert a != cache_key("AquaShield Backpack", "luxury", ["seo"])
+    assert a != cache_key("AquaShield Backpack", "playful", ["seo", "tiktok"])
+
+def test_memory_backend_lru_and_ttl():
+    async def run():
+        backend = MemoryBackend(maxsize=2, ttl=60)
+        await backend.set("a", {"v": 1})
+        await backend.set("b", {"v": 2})
+        await backend.get("a")          # a becomes most recently used
+        await backend.set("c", {"v": 3})  # evicts b
+        assert await backend.get("b") is None
+        assert await backend.get("a") == {"v": 1}
+
+        expired = MemoryBackend(maxsize=2, ttl=-1)
+        await expired.set("a", {"v": 1})
+        assert await expired.get("a") is None
+    asyncio.run(run())
+
+def test_generation_cache_counts_and_warms():
+    async def run():
+        cache = GenerationCache(MemoryBackend())
+        n = await cache.warm([
+            ("AquaShield Backpack", "default", "seo,tiktok", {"SEO_title": "x"}),
+            ("Empty", "default", "", None),
+        ])
+        assert n == 1
+        assert await cache.get(cache_key("aquashield backpack", "default", ["tiktok", "seo"])) == {"SEO_title": "x"}
+        assert await cache.get(cache_key("Other", "default", [])) is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+# test_coalesce.py
+import asyncio
+from coalesce import SingleFlight
+
+def test_concurrent_duplicates_share_one_call():
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"SEO_title": "ok"}
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", upstream) for _ in range(5)))
+        other = await flight.do("other", upstream)
+        return flight, results, other
+
+    flight, results, other = asyncio.run(run())
+    assert calls == 2
+    assert all(r == {"SEO_title": "ok"} for r in results)
+    assert flight.stats() == {"in_flight": 0, "leaders": 2, "coalesced": 4}
+
+def test_errors_propagate_to_every_waiter_and_are_not_cached():
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        # a later call retries instead of reusing the failure
+        await asyncio.gather(flight.do("k", failing), return_exceptions=True)
+
+    asyncio.run(run())
+    assert calls == 2
@@ -0,0 +1,67 @@
+# test_export.py
+import asyncio, csv, io, json, gzip, tracemalloc
+import export
+from database import AsyncSessionLocal, SessionLocal
+from crud import bulk_create_generations
+from export import iter_export, aiter_export
+
+USER_ID = 777001
+
+def out(name, i=0):
+    return {"SEO_title": f"{name} #{i}", "description": f"All about {name}. " + "Lovely details. " * 12,
+            "benefit_bullets": ["Light", "Tough <steel>", "Warm"], "keywords_used": ["bags", "travel"]}
+
+def seed(user_id, names):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            await bulk_create_generations(db, [
+                {"user_id": user_id, "product_name": name, "voice": "default", "include": "seo,description",
+                 "output": out(name, i)} for i, name in enumerate(names)
+            ])
+            await db.commit()
+    asyncio.run(run())
+
+def export_bytes(user_id, fmt, gz=False, **filters):
+    db = SessionLocal()
+    try:
+        data = b"".join(iter_export(db, user_id, fmt, gz, **filters))
+    finally:
+        db.close()
+    return gzip.decompress(data) if gz else data
+
+def test_csv_jsonl_and_shopify_formats():
+    seed(USER_ID, ["Trail Pack", "Desk Lamp", "Trail Pack"])
+
+    rows = list(csv.DictReader(io.StringIO(export_bytes(USER_ID, "csv").decode())))
+    assert [r["product_name"] for r in rows] == ["Trail Pack", "Desk Lamp", "Trail Pack"]
+    assert rows[0]["benefit_bullets"] == "Light | Tough <steel> | Warm"
+
+    lines = export_bytes(USER_ID, "jsonl", gz=True).decode().splitlines()
+    assert len(lines) == 3 and json.loads(lines[1])["output"]["SEO_title"] == "Desk Lamp #1"
+    assert json.loads(lines[0])["include"] == ["seo", "description"]
+
+    # One row per product (its latest copy), with HTML-escaped bullets
+    shop = list(csv.DictReader(io.StringIO(export_bytes(USER_ID, "shopify").decode())))
+    assert [(r["Handle"], r["SEO Title"]) for r in shop] == [("desk-lamp", "Desk Lamp #1"), ("trail-pack", "Trail Pack #2")]
+    assert "<li>Tough &lt;steel&gt;</li>" in shop[0]["Body (HTML)"] and shop[0]["Tags"] == "bags, travel"
+
+def test_async_export_matches_sync():
+    async def collect():
+        return b"".join([chunk async for chunk in aiter_export(AsyncSessionLocal, USER_ID, "csv")])
+    assert asyncio.run(collect()) == export_bytes(USER_ID, "csv")
+
+def test_export_memory_does_not_grow_with_rows(monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_BATCH", 100)
+    user_id = USER_ID + 1
+    seed(user_id, [f"Product {i}" for i in range(4000)])
+
+    db = SessionLocal()
+    try:
+        tracemalloc.start()
+        total = sum(len(chunk) for chunk in iter_export(db, user_id, "jsonl"))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        db.close()
+    assert total > 2_000_000
+    assert peak < total / 4
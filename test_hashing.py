@@ -0,0 +1,41 @@
+# test_hashing.py
+import asyncio, threading, time
+import pytest
+from passlib.context import CryptContext
+import hashing
+from hashing import HashPool, HashPoolBusy
+
+def test_pool_bounds_workers_and_rejects_when_full():
+    active = peak = 0
+    lock = threading.Lock()
+
+    def slow(x):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        return x
+
+    async def run():
+        pool = HashPool(workers=2, max_queue=3)
+        results = await asyncio.gather(*(pool.run(slow, i) for i in range(8)), return_exceptions=True)
+        pool.shutdown()
+        return pool, results
+
+    pool, results = asyncio.run(run())
+    assert peak == 2
+    rejected = [r for r in results if isinstance(r, HashPoolBusy)]
+    assert len(rejected) == 3 and pool.stats()["rejected"] == 3
+    assert pool.stats()["completed"] == 5 and pool.stats()["peak_queue"] == 3
+
+def test_verify_rehashes_when_cost_changes(monkeypatch):
+    old = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4).hash("s3cret")
+    monkeypatch.setattr(hashing, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5))
+    monkeypatch.setattr(hashing, "hash_pool", HashPool(workers=1))
+
+    ok, new_hash = asyncio.run(hashing.verify_and_update_async("s3cret", old))
+    assert ok and new_hash.startswith("$2b$05$")
+    assert asyncio.run(hashing.verify_and_update_async("wrong", old)) == (False, None)
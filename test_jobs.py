@@ -0,0 +1,113 @@
+# test_jobs.py
+import asyncio, json
+import httpx
+from database import AsyncSessionLocal, engine, schema_head, schema_revision
+from jobs import JobQueue, validate_callback_url
+from plans import plan_priority
+
+def test_premium_jobs_run_before_lower_plans():
+    order = []
+
+    async def handler(job_id, user_id, params):
+        order.append(params["plan"])
+        if params["plan"] == "basic":
+            raise RuntimeError("boom")
+        return {"ok": True}
+
+    async def run():
+        # Schema comes from the Alembic migrations conftest.py runs, as in production
+        async with engine.connect() as conn:
+            assert await conn.run_sync(schema_revision) == schema_head()
+        queue = JobQueue(AsyncSessionLocal, workers=0)  # no pool: drive it by hand
+        queue.register("t", handler)
+        async with AsyncSessionLocal() as db:
+            for plan in ["free", "basic", "premium", "free", "pro"]:
+                await queue.submit(db, 1, "t", {"plan": plan}, priority=plan_priority(plan))
+        while await queue.run_next():
+            pass
+        return queue
+
+    queue = asyncio.run(run())
+    assert order == ["premium", "pro", "basic", "free", "free"]
+    assert queue.completed == 4 and queue.failed == 1
+
+def test_job_callback_is_posted_and_signed(monkeypatch):
+    import jobs
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_SECRET", "cb-secret")
+    monkeypatch.setattr(jobs, "_resolve", lambda host, port: ["93.184.216.34"])
+    received = []
+
+    def handler(request):
+        received.append((request.url.host, request.headers.get("X-Signature"), json.loads(request.content)))
+        return httpx.Response(204)
+
+    async def run():
+        queue = JobQueue(AsyncSessionLocal, workers=0)
+        queue.register("t", lambda job_id, user_id, params: asyncio.sleep(0, {"n": params["n"]}))
+        queue._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with AsyncSessionLocal() as db:
+            job_id = await queue.submit(db, 1, "t", {"n": 7}, callback_url="https://hooks.shop.com/done")
+        while await queue.run_next():
+            pass
+        return job_id
+
+    job_id = asyncio.run(run())
+    host, signature, body = received[-1]
+    assert host == "hooks.shop.com" and signature
+    assert body == {"id": job_id, "kind": "t", "status": "done", "result": {"n": 7}, "error": None}
+
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", {"hooks.shop.com"})
+    try:
+        validate_callback_url("https://evil.example/x")
+        assert False, "host allow-list not applied"
+    except ValueError:
+        pass
+
+def test_callback_urls_must_resolve_to_public_addresses(monkeypatch):
+    import jobs
+    for url in ["http://127.0.0.1:8000/admin/usage", "http://169.254.169.254/latest/meta-data/",
+                "http://localhost/x", "http://10.0.0.5/", "http://[::ffff:127.0.0.1]/", "ftp://hooks.shop.com/"]:
+        try:
+            validate_callback_url(url)
+            assert False, f"{url} accepted"
+        except ValueError:
+            pass
+    # A public name that resolves to a private address is refused too
+    monkeypatch.setattr(jobs, "_resolve", lambda host, port: ["93.184.216.34", "192.168.1.10"])
+    try:
+        validate_callback_url("https://hooks.shop.com/done")
+        assert False, "private resolution accepted"
+    except ValueError:
+        pass
+    monkeypatch.setattr(jobs, "_resolve", lambda host, port: ["93.184.216.34"])
+    assert validate_callback_url("https://hooks.shop.com/done")
+
+def test_stopping_mid_job_requeues_it():
+    from models import Job
+    started = asyncio.Event()
+
+    async def slow(job_id, user_id, params):
+        started.set()
+        await asyncio.sleep(params["sleep"])
+        return {"ok": True}
+
+    async def run():
+        first = JobQueue(AsyncSessionLocal, workers=1, interval=0.01)
+        first.register("t", slow)
+        await first.start()
+        async with AsyncSessionLocal() as db:
+            job_id = await first.submit(db, 1, "t", {"sleep": 0.05})
+        await started.wait()
+        await first.stop()  # shutdown while the job is running
+        async with AsyncSessionLocal() as db:
+            assert (await db.get(Job, job_id)).status == "queued"
+
+        second = JobQueue(AsyncSessionLocal, workers=0)
+        second.register("t", slow)
+        while await second.run_next():
+            pass
+        async with AsyncSessionLocal() as db:
+            job = await db.get(Job, job_id)
+            return job.status, job.result
+
+    assert asyncio.run(run()) == ("done", {"ok": True})
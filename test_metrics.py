@@ -0,0 +1,31 @@
+# test_metrics.py
+import asyncio
+from metrics import Registry, stage, stage_latency, record_tokens, current_plan, llm_tokens
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    h = registry.histogram("op_seconds", "Op latency", ("op",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.observe(v, op="read")
+    c = registry.counter("ops_total", "Ops", ("op",))
+    c.inc(op="read")
+    c.inc(2, op="read")
+
+    text = registry.render()
+    assert 'op_seconds_bucket{op="read",le="0.1"} 1' in text
+    assert 'op_seconds_bucket{op="read",le="1.0"} 3' in text
+    assert 'op_seconds_bucket{op="read",le="+Inf"} 4' in text
+    assert 'op_seconds_count{op="read"} 4' in text
+    assert 'ops_total{op="read"} 3' in text
+
+def test_stage_timer_and_tokens_by_plan():
+    async def run():
+        current_plan.set("pro")
+        with stage("unit.test"):
+            await asyncio.sleep(0.01)
+        record_tokens({"prompt_tokens": 10, "completion_tokens": 5})
+
+    asyncio.run(run())
+    series = stage_latency.series[("unit.test",)]
+    assert series[-1] == 1 and series[-2] >= 0.01
+    assert llm_tokens.values[("pro", "completion")] >= 5
@@ -0,0 +1,32 @@
+# test_principal.py
+import time
+import principal as pr
+from principal import Principal, PrincipalCache
+
+def _p(uid=1, used=0):
+    return Principal(id=uid, email=f"u{uid}@shop.com", plan="pro", monthly_generates=used)
+
+def test_cache_ttl_size_and_bump():
+    cache = PrincipalCache(maxsize=2, ttl=60)
+    cache.set(_p(1)); cache.set(_p(2)); cache.get(1); cache.set(_p(3))
+    assert cache.get(2) is None and cache.get(1) is not None
+    cache.bump(1, 2)
+    assert cache.get(1).monthly_generates == 2
+
+    expired = PrincipalCache(ttl=-1)
+    expired.set(_p(1))
+    assert expired.get(1) is None
+
+def test_claims_respect_age_and_invalidation(monkeypatch):
+    monkeypatch.setattr(pr, "JWT_PLAN_CLAIMS", True)
+    cache = PrincipalCache()
+    monkeypatch.setattr(pr, "principal_cache", cache)
+    claims = {"email": "u1@shop.com", "plan": "pro", "monthly_generates": 4, "stripe_customer_id": "cus_1"}
+    now = time.time()
+
+    p = pr.principal_from_claims({"sub": "1", "iat": now, "principal": claims})
+    assert p == Principal(id=1, **claims)
+    assert pr.principal_from_claims({"sub": "1", "iat": now - pr.PRINCIPAL_CLAIMS_MAX_AGE - 1, "principal": claims}) is None
+
+    cache.invalidate(1)  # e.g. webhook changed the plan after the token was issued
+    assert pr.principal_from_claims({"sub": "1", "iat": now - 1, "principal": claims}) is None
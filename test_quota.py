@@ -0,0 +1,90 @@
+# test_quota.py
+import asyncio, uuid
+import pytest
+
+import quota
+from quota import reserve, refund, QuotaExceeded, QuotaFront
+from database import AsyncSessionLocal, engine, Base
+from models import User
+from reset_monthly import reset_users
+
+async def make_user(plan: str, used: int = 0) -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"{uuid.uuid4().hex[:8]}@shop.com", password_hash="x", plan=plan, monthly_generates=used)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+async def used(user_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.get(User, user_id)).monthly_generates
+
+async def try_reserve(user_id: int, plan: str):
+    async with AsyncSessionLocal() as db:
+        try:
+            return await reserve(db, user_id, plan)
+        except QuotaExceeded:
+            return None
+
+def test_concurrent_reservations_never_overshoot(monkeypatch):
+    monkeypatch.setattr(quota, "quota_front", QuotaFront())
+
+    async def run():
+        uid = await make_user("basic", used=17)  # basic allows 20
+        results = await asyncio.gather(*(try_reserve(uid, "basic") for _ in range(8)))
+        granted = sorted(r for r in results if r is not None)
+        assert granted == [18, 19, 20]
+        assert await used(uid) == 20
+
+        async with AsyncSessionLocal() as db:
+            await refund(db, uid, 2)
+        assert await used(uid) == 18
+        await engine.dispose()
+
+    asyncio.run(run())
+
+def test_front_rejects_without_db_and_limit_follows_db_plan(monkeypatch):
+    front = QuotaFront()
+    monkeypatch.setattr(quota, "quota_front", front)
+
+    async def run():
+        uid = await make_user("free", used=3)
+        assert await try_reserve(uid, "free") is None
+        assert await try_reserve(uid, "free") is None
+        assert front.local_rejections == 1
+
+        # A stale cached plan cannot grant more than the row's own plan allows
+        front.invalidate(uid)
+        assert await try_reserve(uid, "premium") is None
+
+        premium = await make_user("premium", used=10_000)
+        assert await try_reserve(premium, "premium") == 10_001
+        await engine.dispose()
+
+    asyncio.run(run())
+
+def test_reset_engine_bulk_chunked_and_rolling():
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, update
+
+    async def run():
+        ids = [await make_user("pro", used=5) for _ in range(5)]
+        async with AsyncSessionLocal() as db:
+            old = datetime.utcnow() - timedelta(days=40)
+            await db.execute(update(User).where(User.id.in_(ids[:2])).values(last_reset=old))
+            await db.commit()
+
+            progress = []
+            n = await db.run_sync(lambda s: reset_users(s, batch_size=2, rolling=True, progress=lambda d, t: progress.append((d, t))))
+            assert n == 2 and progress[-1] == (2, 2)
+            counts = (await db.execute(select(User.monthly_generates).where(User.id.in_(ids)).order_by(User.id))).scalars().all()
+            assert counts == [0, 0, 5, 5, 5]
+
+            n = await db.run_sync(lambda s: reset_users(s))
+            assert n >= 5
+        assert await used(ids[-1]) == 0
+        await engine.dispose()
+
+    asyncio.run(run())
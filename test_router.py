@@ -0,0 +1,110 @@
+# test_router.py
+import asyncio, json
+import httpx
+import pytest
+import router as router_module
+from router import Router, Provider, CircuitBreaker, LLMUnavailable
+
+def reply(text="{}"):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+def make_router(behaviours, **kwargs):
+    """behaviours: {host: async handler(request) -> Response}; one provider per host."""
+    async def dispatch(request):
+        return await behaviours[request.url.host](request)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(dispatch))
+    providers = [Provider(host, f"http://{host}/v1/chat/completions", "k", f"model-{host}", timeout=1.0)
+                 for host in behaviours]
+    return Router(providers, client=lambda: client, **kwargs), providers
+
+def test_retries_fail_over_to_next_provider(monkeypatch):
+    monkeypatch.setattr(router_module, "LLM_BACKOFF_BASE", 0.001)
+    seen = []
+
+    async def down(request):
+        seen.append(("a", json.loads(request.content)["model"]))
+        return httpx.Response(503)
+
+    async def up(request):
+        seen.append(("b", json.loads(request.content)["model"]))
+        return reply()
+
+    r, (a, b) = make_router({"a": down, "b": up}, retries=2)
+    assert asyncio.run(r.complete({"messages": []}))["choices"]
+    assert seen == [("a", "model-a"), ("b", "model-b")]
+    assert a.errors == {"http_503": 1} and b.latency.count == 1
+
+def test_client_errors_are_not_retried():
+    calls = 0
+
+    async def bad(request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(400)
+
+    r, _ = make_router({"a": bad}, retries=3)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(r.complete({}))
+    assert calls == 1
+
+def test_breaker_opens_and_half_opens(monkeypatch):
+    breaker = CircuitBreaker(threshold=2, cooldown=10)
+    clock = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: clock[0])
+    breaker.record_failure(); breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock[0] += 10
+    assert breaker.allow() and not breaker.allow()  # a single probe
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    async def down(request):
+        raise httpx.ConnectError("refused")
+
+    r, (a,) = make_router({"a": down}, retries=0)
+    a.breaker = CircuitBreaker(threshold=1, cooldown=60)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(r.complete({}))
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(r.complete({}))
+
+def test_listing_providers_does_not_take_the_probe(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: clock[0])
+    sent = []
+
+    async def up(request):
+        sent.append(request.url.host)
+        return reply()
+
+    r, (a,) = make_router({"a": up}, retries=0)
+    a.breaker = CircuitBreaker(threshold=1, cooldown=10)
+    a.breaker.record_failure()
+    clock[0] += 10
+    for _ in range(3):
+        assert r.available() == [a] and a.breaker.state == "half_open"  # e.g. stats, stream setup
+    assert asyncio.run(r.complete({}))["choices"] and sent == ["a"]  # the probe went to a real request
+    assert a.breaker.state == "closed"
+
+def test_hedge_fires_after_delay_and_fast_backup_wins(monkeypatch):
+    monkeypatch.setattr(router_module, "LLM_HEDGE_MIN_DELAY", 0.02)
+
+    async def slow(request):
+        await asyncio.sleep(0.5)
+        return reply('{"from": "slow"}')
+
+    async def fast(request):
+        return reply('{"from": "fast"}')
+
+    r, _ = make_router({"slow": slow, "fast": fast}, hedge=True)
+
+    async def run():
+        start = asyncio.get_running_loop().time()
+        data = await r.complete({})
+        return data, asyncio.get_running_loop().time() - start
+
+    data, elapsed = asyncio.run(run())
+    assert json.loads(data["choices"][0]["message"]["content"]) == {"from": "fast"}
+    assert elapsed < 0.3
+    assert (r.hedges_fired, r.hedges_won) == (1, 1)
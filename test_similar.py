@@ -0,0 +1,51 @@
+# test_similar.py
+import asyncio, uuid
+from database import AsyncSessionLocal, engine, Base
+from search import create_search_schema
+from crud import bulk_create_generations
+from similar import normalize, shingles, jaccard, band_keys, scope, find_similar, adapt, SIMILAR_THRESHOLD
+
+def test_trivial_variants_land_in_the_same_bucket():
+    a, b = "AquaShield Backpack – Black", "AquaShield Backpack - Blue"
+    assert normalize(a) == "aquashield backpack black"
+    assert jaccard(shingles(a), shingles(b)) >= SIMILAR_THRESHOLD
+    assert set(band_keys(shingles(a), scope(1, "default", ["seo"]))) & set(band_keys(shingles(b), scope(1, None, ["SEO "])))
+    # Other voice, channels or user never share a bucket
+    assert not set(band_keys(shingles(a), scope(1, "default", ["seo"]))) & set(band_keys(shingles(a), scope(1, "luxury", ["seo"])))
+    assert not set(band_keys(shingles(a), scope(1, "default", ["seo"]))) & set(band_keys(shingles(a), scope(2, "default", ["seo"])))
+
+def test_adapt_renames_the_product():
+    out = {"SEO_title": "AquaShield Backpack – Black | Travel", "benefit_bullets": ["aquashield backpack – black rocks", "b", "c"]}
+    new = adapt(out, "AquaShield Backpack – Black", "AquaShield Backpack - Blue")
+    assert new["SEO_title"] == "AquaShield Backpack - Blue | Travel"
+    assert new["benefit_bullets"][0] == "AquaShield Backpack - Blue rocks"
+    # The new name is inserted literally, never read as a regex template
+    new = adapt({"SEO_title": "Tool Kit Pro | Garage"}, "Tool Kit Pro", r"Tool Kit \Pro \g<0>")
+    assert new["SEO_title"] == r"Tool Kit \Pro \g<0> | Garage"
+
+def test_find_similar_returns_closest_prior_generation():
+    tag = uuid.uuid4().hex[:6]
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(create_search_schema)
+        rows = [
+            {"user_id": 1, "product_name": f"Trailblazer {tag} Boots Size 10", "voice": "default", "include": "seo",
+             "output": {"SEO_title": f"Trailblazer {tag} Boots Size 10", "keywords_used": ["boots"]}},
+            {"user_id": 1, "product_name": f"Kettle {tag} Steel", "voice": "default", "include": "seo",
+             "output": {"SEO_title": "Kettle"}},
+        ]
+        async with AsyncSessionLocal() as db:
+            await bulk_create_generations(db, rows)
+            await db.commit()
+            near = await find_similar(db, 1, f"Trailblazer {tag} Boots – Size 11", "default", ["seo"])
+            other_voice = await find_similar(db, 1, f"Trailblazer {tag} Boots – Size 11", "luxury", ["seo"])
+            other_user = await find_similar(db, 2, f"Trailblazer {tag} Boots Size 10", "default", ["seo"])
+            unrelated = await find_similar(db, 1, f"Desk Lamp {tag}", "default", ["seo"])
+        return near, other_voice, other_user, unrelated
+
+    near, other_voice, other_user, unrelated = asyncio.run(run())
+    assert near["product_name"] == f"Trailblazer {tag} Boots Size 10"
+    assert near["score"] >= SIMILAR_THRESHOLD and near["output"]["keywords_used"] == ["boots"]
+    assert other_voice is None and other_user is None and unrelated is None
@@ -0,0 +1,17 @@
+# test_streaming.py
+from streaming import FieldStreamParser
+
+def test_fields_emitted_as_soon_as_complete():
+    text = '```json\n{"SEO_title": "Aqua, \\"Shield\\"", "benefit_bullets": ["a, b", "c", "d"], "keywords_used": ["x"]}\n```'
+    parser = FieldStreamParser()
+    emitted = []
+    for i in range(0, len(text), 7):
+        for field, value in parser.feed(text[i:i + 7]):
+            emitted.append((field, value, parser.pos))
+
+    assert [e[0] for e in emitted] == ["SEO_title", "benefit_bullets", "keywords_used"]
+    assert emitted[0][1] == 'Aqua, "Shield"'
+    assert emitted[1][1] == ["a, b", "c", "d"]
+    # the title is out well before the stream finishes
+    assert emitted[0][2] < len(text) // 2
+    assert parser.done and parser.fields["keywords_used"] == ["x"]
@@ -0,0 +1,74 @@
+# test_structured.py
+import asyncio, json
+import httpx
+import pytest
+import ai
+from router import Router, Provider
+from structured import parse_json, repair_json, validate_output, parse_stats, StructuredOutputError
+
+def test_parse_json_repairs_fences_trailing_commas_and_truncation():
+    assert parse_json('{"SEO_title": "t"}') == {"SEO_title": "t"}
+    assert parse_json('```json\n{"SEO_title": "t",}\n```') == {"SEO_title": "t"}
+    assert parse_json('Sure! {"a": {"b": "}"}} hope that helps') == {"a": {"b": "}"}}
+
+    # Cut off mid-value, mid-key and mid-list
+    assert parse_json('{"SEO_title": "t", "description": "half a sent') == {"SEO_title": "t", "description": "half a sent"}
+    assert parse_json('{"SEO_title": "t", "descr') == {"SEO_title": "t"}
+    assert parse_json('{"benefit_bullets": ["a", "b"') == {"benefit_bullets": ["a", "b"]}
+    assert json.loads(repair_json('{"k": ["a",')) == {"k": ["a"]}
+
+    with pytest.raises(StructuredOutputError):
+        parse_json("I can't help with that.")
+
+def test_validate_output_trims_lists_and_reports_bad_fields():
+    fields, invalid = validate_output({
+        "SEO_title": "x" * 200,
+        "benefit_bullets": ["a", "b", "c", "d"],
+        "email_subjects": ["only one"],
+        "unknown": "dropped",
+    }, required=["SEO_title", "benefit_bullets", "keywords_used"])
+    assert fields == {"benefit_bullets": ["a", "b", "c"]}
+    # email_subjects was not asked for: dropped, not reported
+    assert set(invalid) == {"SEO_title", "keywords_used"}
+    assert invalid["keywords_used"] == "missing"
+
+def test_call_llm_reasks_only_invalid_fields(monkeypatch):
+    prompts = []
+
+    def handler(request):
+        prompt = json.loads(request.content)["messages"][1]["content"]
+        prompts.append(prompt)
+        if len(prompts) == 1:
+            # Fenced, one title too long
+            return _reply('```json\n{"SEO_title": "' + "x" * 90 + '", "keywords_used": ["k"]}\n```')
+        return _reply('{"SEO_title": "Short title"}')
+
+    _configure(monkeypatch, handler)
+    result = asyncio.run(ai.call_llm("AquaShield Backpack", include=["seo"]))
+    assert result == {"SEO_title": "Short title", "keywords_used": ["k"]}
+    assert len(prompts) == 2
+    assert "- SEO_title" in prompts[1] and "keywords_used" not in prompts[1]
+    assert parse_stats.reask_fixed >= 1
+
+def test_finalize_ignores_bad_fields_that_were_not_requested(monkeypatch):
+    def handler(request):
+        raise AssertionError("re-asked for a channel that was not requested")
+
+    _configure(monkeypatch, handler)
+    data = {"SEO_title": "Short title", "keywords_used": ["k"], "tiktok_caption": "x" * 200}
+    result = asyncio.run(ai.finalize("AquaShield Backpack", ["seo"], "default", data))
+    assert result == {"SEO_title": "Short title", "keywords_used": ["k"]}
+
+def test_call_llm_gives_up_after_reasks(monkeypatch):
+    _configure(monkeypatch, lambda request: _reply('{"SEO_title": "' + "x" * 90 + '"}'))
+    with pytest.raises(StructuredOutputError):
+        asyncio.run(ai.call_llm("AquaShield Backpack", include=["seo"]))
+
+def _reply(content: str):
+    return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+def _configure(monkeypatch, handler):
+    provider = Provider("stub", "http://llm.local/v1/chat/completions", "test", ai.MODEL)
+    monkeypatch.setattr(ai, "router", Router([provider], client=ai.get_client))
+    monkeypatch.setattr(ai, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai, "CHANNEL_MODE", "minimal")
@@ -0,0 +1,75 @@
+# test_usage.py
+import asyncio, uuid
+from datetime import datetime
+from sqlalchemy import select, func
+
+from database import AsyncSessionLocal, SessionLocal
+from models import User, UsageEvent
+from metrics import record_tokens
+from usage import Meter, ingest_usage, rebuild, rollup_rows, summarize, summarize_sync
+
+def make_user(plan="pro") -> int:
+    db = SessionLocal()
+    try:
+        user = User(email=f"{uuid.uuid4().hex[:8]}@usage.com", password_hash="x", plan=plan)
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+def event(meter, when, **row):
+    return {**meter.row(**row), "created_at": when}
+
+def test_meter_counts_tokens_from_spawned_tasks():
+    async def run():
+        meter = Meter(1, "pro", "generate", "default", ["seo", "tiktok"])
+
+        async def llm_call():
+            record_tokens({"prompt_tokens": 10, "completion_tokens": 4})
+        await asyncio.gather(llm_call(), llm_call())
+        return meter.row(cache="miss")
+
+    row = asyncio.run(run())
+    assert (row["prompt_tokens"], row["completion_tokens"]) == (20, 8)
+    assert row["channels"] == "seo,tiktok" and row["units"] == 1 and row["cache_hits"] == 0
+    assert Meter(1, "pro", "generate").row(status="error")["units"] == 0
+
+def test_rollups_track_ledger_and_rebuild_matches():
+    user_id = make_user()
+    meter = Meter(user_id, "pro", "generate")
+    meter.tokens.update(prompt_tokens=100, completion_tokens=50)
+    events = [
+        event(meter, datetime(2026, 3, 1, 9, 15), cache="miss"),
+        event(meter, datetime(2026, 3, 1, 9, 45), cache="hit"),
+        event(meter, datetime(2026, 3, 1, 17, 5), status="error"),
+    ]
+    assert len(rollup_rows(events)) == 3  # two hours + one day
+
+    async def ingest():
+        # Two flushes land on the same rollup rows
+        for batch in (events[:2], events[2:]):
+            async with AsyncSessionLocal() as db:
+                await ingest_usage(db, batch)
+                await db.commit()
+        async with AsyncSessionLocal() as db:
+            day = await summarize(db, "day", datetime(2026, 3, 1), user_id, group_by=("bucket",))
+            hours = await summarize(db, "hour", datetime(2026, 3, 1), user_id, group_by=("bucket", "kind"))
+        return day, hours
+
+    day, hours = asyncio.run(ingest())
+    assert len(day) == 1
+    assert {k: day[0][k] for k in ("requests", "errors", "units", "cache_hits", "prompt_tokens")} == \
+        {"requests": 3, "errors": 1, "units": 2, "cache_hits": 1, "prompt_tokens": 300}
+    assert day[0]["cache_hit_ratio"] == 0.5
+    assert [(h["bucket"].hour, h["requests"]) for h in hours] == [(9, 2), (17, 1)]
+
+    db = SessionLocal()
+    try:
+        assert db.execute(select(func.count()).where(UsageEvent.user_id == user_id)).scalar() == 3
+        before = summarize_sync(db, "hour", datetime(2026, 3, 1), user_id, group_by=("bucket",))
+        assert rebuild(db, datetime(2026, 3, 1, 12), batch_size=2) >= 3
+        assert rebuild(db, datetime(2026, 3, 1)) >= 3  # idempotent
+        assert summarize_sync(db, "hour", datetime(2026, 3, 1), user_id, group_by=("bucket",)) == before
+    finally:
+        db.close()
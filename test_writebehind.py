@@ -0,0 +1,126 @@
+# test_writebehind.py
+import asyncio
+import pytest
+from writebehind import WriteBehind, WriteBehindFull
+
+class FakeSession:
+    def __init__(self, log, fail):
+        self.log, self.fail = log, fail
+        self.pending = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def commit(self):
+        if self.fail and self.fail.pop():
+            raise RuntimeError("db down")
+        self.log.append(self.pending)
+
+def make_writer(fail=None, **kwargs):
+    commits = []
+    writer = WriteBehind(lambda: FakeSession(commits, fail), **kwargs)
+
+    async def handler(db, rows):
+        db.pending.extend(rows)
+
+    writer.register("generation", handler)
+    return writer, commits
+
+def test_batches_by_size_and_time_and_drains_on_stop():
+    async def run():
+        writer, commits = make_writer(batch_size=3, interval=0.05, enabled=True)
+        await writer.start()
+        for i in range(7):
+            await writer.put("generation", {"i": i})
+        await writer.stop()
+        return writer, commits
+
+    writer, commits = asyncio.run(run())
+    assert [len(c) for c in commits] == [3, 3, 1]
+    assert [r["i"] for c in commits for r in c] == list(range(7))
+    assert writer.stats()["flushed"] == 7 and not writer.running
+
+def test_retries_failed_flush():
+    async def run():
+        writer, commits = make_writer(fail=[False, True], batch_size=10, interval=0.01, enabled=True)
+        await writer.start()
+        await writer.put("generation", {"i": 0})
+        await writer.stop()
+        return writer, commits
+
+    writer, commits = asyncio.run(run())
+    assert commits == [[{"i": 0}]]
+    assert writer.stats()["errors"] == 1 and writer.stats()["lost"] == 0
+
+def test_sync_backpressure_writes_inline_when_queue_is_full():
+    async def run():
+        writer, commits = make_writer(batch_size=1, interval=0.01, max_queue=1, policy="sync", enabled=True)
+
+        async def slow(db, rows):
+            await asyncio.sleep(0.02)
+            db.pending.extend(rows)
+
+        writer.register("generation", slow)
+        await writer.start()
+        await writer.put("generation", {"i": 0})
+        await asyncio.sleep(0)                     # worker takes 0 and starts flushing
+        await writer.put("generation", {"i": 1})  # fills the queue
+        await writer.put("generation", {"i": 2})  # full -> written inline
+        await writer.stop()
+        return writer, commits
+
+    writer, commits = asyncio.run(run())
+    assert sorted(r["i"] for c in commits for r in c) == [0, 1, 2]
+    assert writer.stats()["backpressure"] == 1
+
+def test_disabled_writes_inline():
+    writer, commits = make_writer(enabled=False)
+    asyncio.run(writer.put("generation", {"i": 0}))
+    assert commits == [[{"i": 0}]]
+
+def test_bad_record_is_dead_lettered_and_the_rest_written(tmp_path):
+    async def run():
+        writer, commits = make_writer(batch_size=8, interval=0.01, retries=2, enabled=True,
+                                      dead_letter_file=str(tmp_path / "dead.jsonl"))
+
+        async def strict(db, rows):
+            if any(r["i"] == 5 for r in rows):
+                raise ValueError("FOREIGN KEY constraint failed")
+            db.pending.extend(rows)
+
+        writer.register("generation", strict)
+        await writer.start()
+        for i in range(8):
+            await writer.put("generation", {"i": i})
+        await writer.flush()
+        await writer.put("generation", {"i": 8})  # later records keep flowing
+        await writer.stop()
+        return writer, commits
+
+    writer, commits = asyncio.run(run())
+    assert sorted(r["i"] for c in commits for r in c) == [0, 1, 2, 3, 4, 6, 7, 8]
+    assert writer.stats()["dead_lettered"] == 1 and writer.dead_letters[0][1] == {"i": 5}
+    assert '"i": 5' in (tmp_path / "dead.jsonl").read_text()
+
+def test_block_policy_times_out_instead_of_hanging():
+    async def run():
+        writer, _ = make_writer(batch_size=1, max_queue=1, block_timeout=0.05, enabled=True)
+        stuck = asyncio.Event()
+
+        async def down(db, rows):
+            await stuck.wait()
+
+        writer.register("generation", down)
+        await writer.start()
+        await writer.put("generation", {"i": 0})
+        await asyncio.sleep(0)                     # worker takes 0 and hangs on the database
+        await writer.put("generation", {"i": 1})  # fills the queue
+        with pytest.raises(WriteBehindFull):
+            await writer.put("generation", {"i": 2})
+        stuck.set()
+        await writer.stop()
+
+    asyncio.run(run())
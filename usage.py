@@ -0,0 +1,178 @@
+# usage.py
+import os, time
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, func, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import UsageEvent, UsageRollup
+from metrics import current_tokens
+
+USAGE_REBUILD_BATCH = int(os.getenv("USAGE_REBUILD_BATCH", "5000"))
+
+GRAINS = ("hour", "day")
+ROLLUP_KEY = ["grain", "user_id", "bucket", "kind", "plan"]
+SUMS = ["requests", "errors", "units", "cache_hits", "latency_ms", "prompt_tokens", "completion_tokens"]
+
+def truncate(ts: datetime, grain: str) -> datetime:
+    """Start of the hour or day `ts` falls in."""
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if grain == "day" else ts
+
+def window_start(days: int) -> datetime:
+    # days=1 is today so far (UTC)
+    return truncate(datetime.utcnow(), "day") - timedelta(days=days - 1)
+
+# ----- Metering -----
+class Meter:
+    """Times one call and counts the LLM tokens spent under it, for its ledger row.
+
+    Tokens arrive through a context variable, so calls made in tasks spawned
+    from here (parallel channels, hedges, batch workers) are counted too.
+    A coalesced follower spends nothing; the leader's call carries the tokens.
+    """
+
+    def __init__(self, user_id: int, plan: str, kind: str, voice: str = None, include: list = None):
+        self.fields = {"user_id": user_id, "plan": plan, "kind": kind, "voice": voice,
+                       "channels": ",".join(include) if include else None}
+        self.tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+        self.started = time.perf_counter()
+        self.attach()
+
+    def attach(self):
+        # Call again from a response stream that runs outside the handler's context
+        current_tokens.set(self.tokens)
+
+    def row(self, status: str = "ok", cache: str = None, units: int = None, cache_hits: int = None) -> dict:
+        if units is None:
+            units = 1 if status == "ok" else 0
+        if cache_hits is None:
+            cache_hits = units if cache in ("hit", "similar") else 0
+        return {
+            **self.fields,
+            **self.tokens,
+            "created_at": datetime.utcnow(),
+            "status": status,
+            "cache": cache,
+            "units": units,
+            "cache_hits": cache_hits,
+            "latency_ms": round(1000 * (time.perf_counter() - self.started)),
+        }
+
+# ----- Ledger + rollups -----
+def rollup_rows(events) -> list:
+    """Fold ledger rows into per-(grain, user, bucket, kind, plan) increments."""
+    acc = {}
+    for e in events:
+        for grain in GRAINS:
+            key = (grain, e["user_id"], truncate(e["created_at"], grain), e["kind"], e["plan"])
+            r = acc.get(key)
+            if r is None:
+                r = acc[key] = {**dict(zip(ROLLUP_KEY, key)), **dict.fromkeys(SUMS, 0)}
+            r["requests"] += 1
+            r["errors"] += e["status"] != "ok"
+            for col in ("units", "cache_hits", "latency_ms", "prompt_tokens", "completion_tokens"):
+                r[col] += e[col]
+    # Every flush touches rollup rows in the same order, so concurrent upserts cannot deadlock
+    return [acc[key] for key in sorted(acc)]
+
+def _upsert_rollups(dialect_name: str):
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    stmt = dialect.insert(UsageRollup)
+    return stmt.on_conflict_do_update(
+        index_elements=ROLLUP_KEY,
+        set_={col: getattr(UsageRollup, col) + getattr(stmt.excluded, col) for col in SUMS},
+    )
+
+async def ingest_usage(db, rows: list):
+    """Write-behind handler: append to the ledger and add to the rollups in the
+    same transaction, so the two never disagree."""
+    await db.execute(insert(UsageEvent), rows)
+    await db.execute(_upsert_rollups(db.bind.dialect.name), rollup_rows(rows))
+
+def rebuild(session, since: datetime, batch_size: int = USAGE_REBUILD_BATCH) -> int:
+    """Recompute rollups from the ledger, from the day `since` falls in onwards.
+    Idempotent; returns the number of events folded in."""
+    since = truncate(since, "day")
+    dialect_name = session.bind.dialect.name
+    if dialect_name == "postgresql":
+        # Live flushes wait behind this lock, so their events land in the rebuilt rows exactly once
+        session.execute(text("LOCK TABLE usage_rollups IN EXCLUSIVE MODE"))
+    session.execute(delete(UsageRollup).where(UsageRollup.bucket >= since))
+    upsert = _upsert_rollups(dialect_name)
+    events = UsageEvent.__table__
+
+    last_id, n = 0, 0
+    while True:
+        rows = session.execute(
+            select(events)
+            .where(events.c.created_at >= since, events.c.id > last_id)
+            .order_by(events.c.id)
+            .limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        session.execute(upsert, rollup_rows(rows))
+        last_id = rows[-1]["id"]
+        n += len(rows)
+    session.commit()
+    return n
+
+# ----- Reporting (rollups only; never scans the ledger) -----
+def rollup_query(grain: str, since: datetime, user_id: int = None, group_by=()):
+    cols = [getattr(UsageRollup, g) for g in group_by]
+    stmt = (
+        select(*cols, *[func.sum(getattr(UsageRollup, c)).label(c) for c in SUMS])
+        .where(UsageRollup.grain == grain, UsageRollup.bucket >= since)
+    )
+    if user_id is not None:
+        stmt = stmt.where(UsageRollup.user_id == user_id)
+    if cols:
+        stmt = stmt.group_by(*cols).order_by(*cols)
+    return stmt
+
+def _summary(row, group_by) -> dict:
+    out = {g: getattr(row, g) for g in group_by}
+    sums = {c: int(getattr(row, c) or 0) for c in SUMS}
+    latency = sums.pop("latency_ms")
+    out.update(sums)
+    out["avg_latency_ms"] = round(latency / sums["requests"], 1) if sums["requests"] else None
+    out["cache_hit_ratio"] = round(sums["cache_hits"] / sums["units"], 3) if sums["units"] else None
+    return out
+
+async def summarize(db, grain: str, since: datetime, user_id: int = None, group_by=()) -> list:
+    rows = await db.execute(rollup_query(grain, since, user_id, group_by))
+    return [_summary(r, group_by) for r in rows]
+
+def summarize_sync(session, grain: str, since: datetime, user_id: int = None, group_by=()) -> list:
+    rows = session.execute(rollup_query(grain, since, user_id, group_by))
+    return [_summary(r, group_by) for r in rows]
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Usage rollups: rebuild from the ledger, or print a per-plan summary")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("rebuild")
+    p.add_argument("--since", type=datetime.fromisoformat, required=True, help="e.g. 2026-10-01")
+    p.add_argument("--batch-size", type=int, default=USAGE_REBUILD_BATCH)
+    p = sub.add_parser("summary")
+    p.add_argument("--grain", choices=GRAINS, default="day")
+    p.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            n = rebuild(db, args.since, args.batch_size)
+            print(f"✅ Rebuilt rollups from {n:,} usage events since {truncate(args.since, 'day'):%Y-%m-%d}")
+        else:
+            rows = summarize_sync(db, args.grain, window_start(args.days), group_by=("bucket", "plan"))
+            print(f"{args.grain:<20}{'plan':<10}{'requests':>10}{'units':>8}{'errors':>8}{'hit %':>7}{'tokens':>10}{'avg ms':>8}")
+            for r in rows:
+                hit = f"{100 * r['cache_hit_ratio']:.0f}" if r["cache_hit_ratio"] is not None else "-"
+                tokens = r["prompt_tokens"] + r["completion_tokens"]
+                print(f"{r['bucket']:%Y-%m-%d %H:%M}    {r['plan']:<10}{r['requests']:>10}{r['units']:>8}"
+                      f"{r['errors']:>8}{hit:>7}{tokens:>10}{r['avg_latency_ms'] or 0:>8}")
+    finally:
+        db.close()
@@ -1,17 +1,9 @@
 # utils.py
 import os
-import openai
-from passlib.context import CryptContext
+from ai import MODEL, required_fields
+from structured import parse_json, validate_output, StructuredOutputError
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 def baseline_generate(product_name: str, voice: str = "default"):
     """
@@ -27,7 +19,7 @@ def baseline_generate(product_name: str, voice: str = "default"):
     Respond ONLY in valid JSON with the following fields:
     {{
       "SEO_title": "string (max 70 chars)",
-      "description": "string (100–200 words)",
+      "description": "string (max 300 chars)",
       "benefit_bullets": ["exactly 3 short bullet points"],
       "tiktok_caption": "string (max 150 chars)",
       "instagram_ad_caption": "string (up to 2200 chars)",
@@ -36,9 +28,16 @@ def baseline_generate(product_name: str, voice: str = "default"):
     }}
     """
 
-    response = openai.ChatCompletion.create(
-    model="gpt-4o-mini",
-    messages=[{"role": "user", "content": prompt}],
-)
-
-    return response.choices[0].message.parsed
+    import openai  # heavy SDK: only the baseline comparison needs it
+    response = openai.OpenAI(api_key=OPENAI_API_KEY).chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        response_format={"type": "json_object"},
+    )
+
+    # Without a parse-capable response format `.parsed` is never set; parse the text
+    data = parse_json(response.choices[0].message.content or "")
+    fields, invalid = validate_output(data, required_fields(None))
+    if invalid:
+        raise StructuredOutputError(f"LLM output invalid for: {', '.join(sorted(invalid))}")
+    return fields
@@ -0,0 +1,263 @@
+# webhooks.py
+import os, asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, StripeEvent
+from principal import principal_cache
+from quota import quota_front
+
+WEBHOOK_WORKER = os.getenv("WEBHOOK_WORKER", "1") == "1"  # safe in every process: events are claimed
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))  # also retries failures
+WEBHOOK_BATCH = int(os.getenv("WEBHOOK_BATCH", "200"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_CLAIM_TIMEOUT = int(os.getenv("WEBHOOK_CLAIM_TIMEOUT", "300"))  # requeue claims left by a crashed worker
+
+# ----- Ingestion -----
+def event_customer(event: dict) -> str:
+    """Ordering key: the Stripe customer, else the email, else the event itself."""
+    obj = event.get("data", {}).get("object", {}) or {}
+    return (obj.get("customer")
+            or obj.get("customer_email")
+            or (obj.get("customer_details") or {}).get("email")
+            or event["id"])
+
+async def record_event(db: AsyncSession, event: dict) -> bool:
+    """Durably store a verified event. Returns False if this event id was already seen."""
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(StripeEvent).values(
+        event_id=event["id"],
+        type=event.get("type", ""),
+        customer=event_customer(event),
+        created=event.get("created") or 0,
+        payload=event,
+    ).on_conflict_do_nothing(index_elements=["event_id"])
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.rowcount == 1
+
+# ----- Handlers -----
+async def find_user(db: AsyncSession, obj: dict):
+    # Customer id first (indexed, stable), then our user id, then email for old checkouts
+    if obj.get("customer"):
+        user = (await db.execute(select(User).where(User.stripe_customer_id == obj["customer"]))).scalars().first()
+        if user:
+            return user
+    ref = obj.get("client_reference_id")
+    if ref and str(ref).isdigit():
+        user = await db.get(User, int(ref))
+        if user:
+            return user
+    email = obj.get("customer_email") or (obj.get("customer_details") or {}).get("email")
+    if email:
+        return (await db.execute(select(User).where(User.email == email))).scalars().first()
+    return None
+
+async def checkout_completed(db: AsyncSession, obj: dict):
+    user = await find_user(db, obj)
+    if not user:
+        return None
+    if obj.get("customer"):
+        user.stripe_customer_id = obj["customer"]
+    user.plan = (obj.get("metadata") or {}).get("plan", "basic")  # fallback to basic if missing
+    user.monthly_generates = 0  # ✅ reset counter on successful upgrade
+    print(f"✅ Upgraded {user.email} to {user.plan} and reset monthly_generates")
+    return user
+
+async def subscription_deleted(db: AsyncSession, obj: dict):
+    user = await find_user(db, obj)
+    if not user:
+        return None
+    user.plan = "basic"
+    user.monthly_generates = 0  # reset when downgraded too
+    print(f"❌ Downgraded {user.email} to basic (subscription cancelled)")
+    return user
+
+HANDLERS = {
+    "checkout.session.completed": checkout_completed,
+    "customer.subscription.deleted": subscription_deleted,
+}
+
+async def apply_event(db: AsyncSession, event: dict):
+    """Apply one event inside the caller's transaction; returns the changed user, if any."""
+    handler = HANDLERS.get(event.get("type"))
+    if handler is None:
+        return None
+    return await handler(db, event["data"]["object"])
+
+async def superseded(db: AsyncSession, row: StripeEvent) -> bool:
+    # Arrived after a newer event for the same customer was applied: its state is outdated
+    newer = await db.execute(
+        select(StripeEvent.seq).where(
+            StripeEvent.customer == row.customer,
+            StripeEvent.status == "done",
+            StripeEvent.created > row.created,
+        ).limit(1)
+    )
+    return newer.first() is not None
+
+# ----- Worker -----
+class WebhookWorker:
+    """Applies recorded events in the background, in Stripe `created` order per customer.
+
+    Different customers are applied concurrently. An event older than one already
+    applied for its customer is marked stale instead of rolling the state back. A failing event is retried on
+    later polls and holds back that customer's newer events until it succeeds or
+    is marked failed after `max_attempts`. Pending events survive restarts.
+
+    Every process may run a worker: an event is claimed (pending -> applying)
+    with a conditional UPDATE before it is applied, so only one process applies
+    it, and a customer with an event being applied elsewhere is skipped.
+    """
+
+    def __init__(self, session_factory, interval: float = WEBHOOK_POLL_INTERVAL,
+                 batch_size: int = WEBHOOK_BATCH, max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+                 enabled: bool = WEBHOOK_WORKER, claim_timeout: int = WEBHOOK_CLAIM_TIMEOUT):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self.claim_timeout = claim_timeout
+        self._wake = None
+        self._task = None
+        self._lock = asyncio.Lock()
+        self.applied = 0
+        self.failures = 0
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"⚠️ webhook worker pass failed: {e}")
+
+    async def drain(self) -> int:
+        """Apply everything pending right now. Returns how many events were settled."""
+        async with self._lock:
+            await self.requeue_stale_claims()
+            settled, blocked = 0, set()  # customers with an event to retry on a later pass
+            while True:
+                async with self.session_factory() as db:
+                    # Another process is applying one of these customers' events; keep their order
+                    busy = set((await db.execute(
+                        select(StripeEvent.customer).where(StripeEvent.status == "applying")
+                    )).scalars())
+                stmt = (
+                    select(StripeEvent.seq, StripeEvent.customer)
+                    .where(StripeEvent.status == "pending")
+                    .order_by(StripeEvent.created, StripeEvent.seq)
+                    .limit(self.batch_size)
+                )
+                if blocked | busy:
+                    stmt = stmt.where(StripeEvent.customer.notin_(blocked | busy))
+                async with self.session_factory() as db:
+                    rows = (await db.execute(stmt)).all()
+                if not rows:
+                    return settled
+                by_customer = OrderedDict()
+                for seq, customer in rows:
+                    by_customer.setdefault(customer, []).append(seq)
+                results = await asyncio.gather(*(self._apply_customer(seqs) for seqs in by_customer.values()))
+                for customer, (n, ok) in zip(by_customer, results):
+                    settled += n
+                    if not ok:
+                        blocked.add(customer)
+                if len(rows) < self.batch_size:
+                    return settled
+
+    async def requeue_stale_claims(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.claim_timeout)
+        async with self.session_factory() as db:
+            await db.execute(update(StripeEvent).where(
+                StripeEvent.status == "applying", StripeEvent.claimed_at < cutoff
+            ).values(status="pending"))
+            await db.commit()
+
+    async def _claim(self, db: AsyncSession, seq: int) -> bool:
+        claimed = await db.execute(
+            update(StripeEvent).where(StripeEvent.seq == seq, StripeEvent.status == "pending")
+            .values(status="applying", claimed_at=datetime.utcnow())
+        )
+        await db.commit()
+        return claimed.rowcount == 1
+
+    async def _apply_customer(self, seqs: list):
+        """Apply in order; stop at the first failure. Returns (settled, all_ok)."""
+        n = 0
+        for seq in seqs:
+            if not await self._apply_one(seq):
+                return n, False  # keep this customer's later events behind the failing one
+            n += 1
+        return n, True
+
+    async def _apply_one(self, seq: int) -> bool:
+        async with self.session_factory() as db:
+            if not await self._claim(db, seq):
+                return False  # another process took it; it applies this customer's later events too
+            row = await db.get(StripeEvent, seq)
+            event_id, attempts = row.event_id, row.attempts
+            try:
+                user_id = None
+                if await superseded(db, row):
+                    row.status = "stale"
+                else:
+                    user = await apply_event(db, row.payload)
+                    user_id = user.id if user is not None else None
+                    # Unhandled types and unknown customers change nothing
+                    row.status = "done" if user_id is not None else "ignored"
+                row.processed_at = datetime.utcnow()
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                self.failures += 1
+                attempts += 1
+                await db.execute(update(StripeEvent).where(StripeEvent.seq == seq).values(
+                    attempts=attempts,
+                    error=str(e)[:500],
+                    status="failed" if attempts >= self.max_attempts else "pending",
+                ))
+                await db.commit()
+                print(f"⚠️ webhook {event_id} failed (attempt {attempts}): {e}")
+                return attempts >= self.max_attempts
+        if user_id is not None:
+            principal_cache.invalidate(user_id)
+            quota_front.invalidate(user_id)
+        self.applied += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "applied": self.applied,
+            "failures": self.failures,
+        }
@@ -0,0 +1,204 @@
+# writebehind.py
+import os, json, asyncio
+from collections import OrderedDict, deque
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError
+from metrics import stage
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))         # flush at this many records
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))  # ...or after this many seconds
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+# When the queue is full: "block" makes the request wait for space,
+# "sync" writes that record inline on the request path instead
+WRITE_BEHIND_POLICY = os.getenv("WRITE_BEHIND_POLICY", "block")
+WRITE_BEHIND_BLOCK_TIMEOUT = float(os.getenv("WRITE_BEHIND_BLOCK_TIMEOUT", "5"))  # "block" gives up after this
+# A batch still failing after this many attempts (for a reason other than the
+# connection) is split in halves until the records that fail are isolated
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+WRITE_BEHIND_DEAD_LETTER_FILE = os.getenv("WRITE_BEHIND_DEAD_LETTER_FILE")  # JSONL of rejected records
+WRITE_BEHIND_SHUTDOWN_RETRIES = 3
+
+class WriteBehindFull(Exception):
+    """The queue stayed full for WRITE_BEHIND_BLOCK_TIMEOUT (database down or too slow)."""
+
+def is_transient(e: Exception) -> bool:
+    # Connection loss, lock timeouts, DB unreachable: the same batch can succeed later
+    if isinstance(e, DBAPIError) and e.connection_invalidated:
+        return True
+    return isinstance(e, (OperationalError, InterfaceError, ConnectionError, TimeoutError))
+
+class WriteBehind:
+    """In-process write-behind queue for append-only records.
+
+    Records are grouped by kind and flushed by one background task in batched
+    multi-row inserts, one transaction per flush. Handlers are
+    `async handler(db, rows)` and must not commit. Failed flushes are retried
+    with backoff while new records keep queueing (and backpressure applies).
+    Connection errors are retried until the database is back; any other error
+    splits the batch after `retries` attempts, so one bad record is dead-lettered
+    instead of stalling everything behind it.
+    `stop()` drains the queue before returning, so a clean shutdown loses nothing.
+    """
+
+    def __init__(self, session_factory, batch_size: int = WRITE_BEHIND_BATCH,
+                 interval: float = WRITE_BEHIND_INTERVAL, max_queue: int = WRITE_BEHIND_MAX_QUEUE,
+                 policy: str = WRITE_BEHIND_POLICY, enabled: bool = WRITE_BEHIND,
+                 retries: int = WRITE_BEHIND_RETRIES, block_timeout: float = WRITE_BEHIND_BLOCK_TIMEOUT,
+                 dead_letter_file: str = WRITE_BEHIND_DEAD_LETTER_FILE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_queue = max_queue
+        self.policy = policy
+        self.enabled = enabled
+        self.retries = retries
+        self.block_timeout = block_timeout
+        self.dead_letter_file = dead_letter_file
+        self.dead_letters = deque(maxlen=100)  # (kind, row, error) of the latest rejected records
+        self.handlers = {}
+        self._queue = None
+        self._task = None
+        self._stopping = False
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.backpressure = 0
+        self.lost = 0
+        self.dead_lettered = 0
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._stopping = False
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, kind: str, row: dict):
+        if not self.running:
+            await self.write(kind, [row])
+            return
+        if self._queue.full():
+            self.backpressure += 1
+            if self.policy == "sync":
+                await self.write(kind, [row])
+                return
+        try:
+            await asyncio.wait_for(self._queue.put((kind, row)), self.block_timeout)
+        except asyncio.TimeoutError:
+            raise WriteBehindFull(f"write-behind queue full for {self.block_timeout:.0f}s")
+
+    async def flush(self):
+        """Wait until everything queued so far is written."""
+        if self.running:
+            await self._queue.join()
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._stopping = True
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def write(self, kind: str, rows: list):
+        """Write rows inline on the caller's path, bypassing the queue."""
+        async with self.session_factory() as db:
+            await self.handlers[kind](db, rows)
+            await db.commit()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0 or self._stopping:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush_batch(self, batch: list):
+        groups = OrderedDict()
+        for kind, row in batch:
+            groups.setdefault(kind, []).append(row)
+
+        delay, attempts = 0.1, 0
+        while True:
+            try:
+                with stage("persist.flush"):
+                    async with self.session_factory() as db:
+                        for kind, rows in groups.items():
+                            await self.handlers[kind](db, rows)
+                        await db.commit()
+                self.flushed += len(batch)
+                self.flushes += 1
+                return
+            except Exception as e:
+                self.errors += 1
+                attempts += 1
+                if self._stopping and attempts >= WRITE_BEHIND_SHUTDOWN_RETRIES:
+                    self.lost += len(batch)
+                    print(f"❌ write-behind dropped {len(batch)} records at shutdown: {e}")
+                    return
+                if attempts >= self.retries and not is_transient(e):
+                    await self._isolate(batch, e)
+                    return
+                print(f"⚠️ write-behind flush failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    async def _isolate(self, batch: list, error: Exception):
+        """Bisect a batch that keeps failing: good halves are written, a single
+        record that still fails is dead-lettered."""
+        if len(batch) == 1:
+            self._dead_letter(*batch[0], error)
+            return
+        mid = len(batch) // 2
+        await self._flush_batch(batch[:mid])
+        await self._flush_batch(batch[mid:])
+
+    def _dead_letter(self, kind: str, row: dict, error: Exception):
+        self.dead_lettered += 1
+        self.dead_letters.append((kind, row, str(error)))
+        print(f"❌ write-behind rejected a {kind} record: {error}")
+        if self.dead_letter_file:
+            with open(self.dead_letter_file, "a") as f:
+                f.write(json.dumps({"kind": kind, "row": row, "error": str(error)}, default=str) + "\n")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "policy": self.policy,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "backpressure": self.backpressure,
+            "lost": self.lost,
+            "dead_lettered": self.dead_lettered,
+        }